@@ -7,6 +7,19 @@ GENERAL_BATCH_SIZE = 10
 
 USE_RATE_LIMIT=False
 
+# INCREMENTAL MODE: revisit only the pages changed since the previous execution (sitemap
+# lastmod or 304 from the HTTP cache) and write delta.json and the merged catalog.jsonl
+INCREMENTAL = False
+
+# CHECKPOINT (results/<domain>/execution_N/checkpoint.json, deleted when the run finishes)
+RESUME_FROM_CHECKPOINT = True   # Resume the last execution if it left a checkpoint
+CHECKPOINT_INTERVAL = 30        # Seconds between checkpoints when nothing changes
+CHECKPOINT_MIN_INTERVAL = 1     # Seconds between checkpoints saved when a batch changes stage
+
+# URL DISCOVERY: "crawl" (follow links), "sitemap" (only sitemap URLs) or "sitemap+crawl"
+DISCOVERY_MODE = "crawl"
+SITEMAP_PRODUCTS_ONLY = True
+
 # IGNORE URLS WITH:
 IGNORE_URLS_WITH = ""
 
@@ -30,15 +43,91 @@ PRICE_TAGS = [
             {"tag": "p", "class": "price"}
             ]
 
-# TITLE FETCH BATCH SIZE
+# TITLE FETCH BATCH SIZE (upper bound when USE_RATE_LIMIT, the rate limiter finds the safe concurrency per host)
 CONCURRENT_REQUESTS = 10
 
 # REQUEST TIMEOUT
 REQUEST_TIMEOUT = 20
 
-# LLM BATCH SIZE
+# HTTP CONNECTION POOL (shared by the crawler and the fetcher)
+HTTP_LIMIT = 100
+HTTP_LIMIT_PER_HOST = 20
+HTTP_DNS_CACHE_TTL = 300
+HTTP_KEEPALIVE_TIMEOUT = 30
+
+# RATE LIMITER (per host token bucket and AIMD concurrency window, used when USE_RATE_LIMIT)
+RATE_LIMIT_INITIAL_RPS = 5
+RATE_LIMIT_MIN_RPS = 0.2
+RATE_LIMIT_MAX_RPS = 50
+RATE_LIMIT_INITIAL_CONCURRENCY = 4
+RATE_LIMIT_MAX_CONCURRENCY = 20
+RATE_LIMIT_TARGET_LATENCY = 3   # Seconds to the response headers before shrinking the window
+RATE_LIMIT_MAX_BACKOFF = 60     # Max seconds to pause a host after a 429/503 without Retry-After
+
+# RETRY POLICY (shared by the crawler and the fetcher)
+RETRY_MAX_ATTEMPTS = 3          # Attempts per URL before deferring it
+RETRY_BASE_DELAY = 1            # Seconds, lower bound of the jittered back off
+RETRY_MAX_DELAY = 30            # Seconds, upper bound of the back off (Retry-After included)
+RETRY_BUDGET_RATIO = 0.1        # Retries allowed per request of the run...
+RETRY_MIN_BUDGET = 10           # ...plus this many
+RETRY_DEFER_DELAY = 60          # Seconds before a deferred URL is retried by a later batch
+RETRY_MAX_DEFERRALS = 2         # Times a URL is deferred before giving up
+
+# HTTP CACHE (results/<domain>/http_cache, shared by executions)
+# "revalidate" (conditional requests, 304s served from disk), "offline" (only cached pages,
+# to debug the selectors of WEBSITE_DETAILS without touching the site) or "off"
+HTTP_CACHE_MODE = "revalidate"
+HTTP_CACHE_MAX_MB = 1024
+
+# PARSE POOL (processes parsing the HTML off the event loop, 0 to parse on the event loop)
+PARSE_WORKERS = 4
+PARSE_MAX_PENDING = 100         # Pages submitted to the pool at a time
+LOOP_LAG_INTERVAL = 0.1         # Seconds between event loop lag samples
+
+# PIPELINE (batches waiting between stages and seconds between status reports)
+PIPELINE_QUEUE_SIZE = 2
+PIPELINE_REPORT_INTERVAL = 30
+
+# FETCH MODE: "static" (aiohttp only), "render" (Chromium only) or "auto" (static first,
+# rendered when the page needs it, learned per URL shape in results/<domain>/render_routes.json)
+FETCH_MODE = "auto"
+ROUTER_MIN_LINKS = 10          # Static pages with fewer links are rendered
+ROUTER_MIN_SAMPLES = 5         # Pages of a URL shape checked before routing it directly
+ROUTER_MIN_AGREEMENT = 0.9     # Share of those pages that must have needed rendering
+ROUTER_PROBE_RATE = 0.05       # Share of rendered routes still tried statically
+
+# BROWSER POOL (reusable Chromium pages for JS-driven crawling)
+BROWSER_POOL_SIZE = 5
+BROWSER_MAX_NAVIGATIONS = 50    # Navigations before a page and its context are recycled
+
+# RENDER PROFILE (overrides of render_profile.DEFAULT_RENDER_PROFILE for this site)
+# e.g. {"wait_for_selector": "h1.product-title", "network_idle_timeout": 3, "allow_domains": ["cdn.example.com"]}
+RENDER_PROFILE = {}
+
+# PAGE STORE (crawled HTML reused for title and details extraction)
+PAGE_STORE_MAX_PAGES = 500
+
+# LLM BATCH SIZE (only used when batches are not packed by tokens)
 LLM_BATCH_SIZE = 30
 
+# LLM BATCH TOKEN BUDGET (tokens of items per request, tuned during the run)
+LLM_BATCH_TOKEN_BUDGET = 2000
+LLM_MIN_BATCH_TOKENS = 250
+LLM_MAX_BATCH_TOKENS = 8000
+LLM_MAX_BATCH_ITEMS = 200
+LLM_TARGET_LATENCY = 20         # Seconds per request before shrinking the budget
+
+# LOCAL URL CLASSIFIER (learns from the LLM decisions to skip obvious items)
+USE_URL_CLASSIFIER = True
+CLASSIFIER_MIN_SUPPORT = 8       # Decisions needed before trusting a pattern
+CLASSIFIER_MIN_PURITY = 0.97     # Share of decisions that must agree
+CLASSIFIER_AUDIT_RATE = 0.05     # Share of local decisions still checked by the LLM
+
+# LLM DECISION CACHE (results/<domain>/llm_cache.sqlite, shared by executions)
+USE_LLM_CACHE = True
+LLM_CACHE_TTL_DAYS = 90          # None to keep decisions forever
+LLM_CACHE_MAX_ENTRIES = 500000
+
 # LLM MODEL
 LLM_MODEL = "gpt-4o-mini"
 LLM_TEMPERATURE = 0.2
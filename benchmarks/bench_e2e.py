@@ -0,0 +1,264 @@
+"""
+End-to-end throughput of the scraper against the local mock shop.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_e2e [pipeline|crawler|new_crawler|fetch] [--products N] [--latency S] ...
+
+Scenarios:
+    pipeline     Crawler -> fetch_titles -> select_product_urls (stub LLM) -> fetch_product_details
+                 -> ResultsManager, connected by the Pipeline like main.py
+    crawler      Crawler.get_next_batch_urls until the frontier is empty
+    new_crawler  NewCrawler.get_batch until every page of the shop is discovered
+    fetch        fetch_titles and fetch_product_details of every product URL
+
+Every scenario reports pages/s, p50/p95 latency to the response headers,
+CPU seconds (parse workers included), peak RSS and, for the pipeline, LLM
+calls per product. The results folder, HTTP cache and checkpoints go to a
+temporary working directory. JS-only pages (--js-ratio) need Chromium.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from benchmarks.mock_shop import add_shop_arguments, shop_from_arguments
+from CONFIG import CONCURRENT_REQUESTS, GENERAL_BATCH_SIZE, PAGE_STORE_MAX_PAGES, PIPELINE_QUEUE_SIZE
+from src import fetcher, pipeline, results
+from src.classifier import UrlPatternClassifier
+from src.http_cache import HttpCache
+from src.http_client import HttpClient
+from src.pages import PageStore
+from src.parse_pool import ParsePool
+from src.rate_limiter import RateLimiter
+from src.retry import RetryPolicy
+from src.router import FetchRouter
+from src.url_filter import UrlFilter
+
+
+class Run:
+    """
+    Shared components of a scenario, built like main.py builds them.
+    """
+    def __init__(self, shop, args, workdir):
+        self.shop = shop
+        self.args = args
+        self.workdir = workdir
+        self.http_cache = HttpCache(os.path.join(workdir, 'http_cache')) if args.http_cache else None
+        self.rate_limiter = RateLimiter() if not args.no_rate_limit else None
+        self.client = None
+        self.parse_pool = ParsePool(args.parse_workers)
+        self.retry_policy = RetryPolicy()
+        self.page_store = PageStore(PAGE_STORE_MAX_PAGES)
+        self.browser_pool = None
+
+        self.pages = 0     # Pages crawled or fetched
+        self.products = 0  # Products saved
+
+    async def start(self):
+        self.client = await HttpClient(cache=self.http_cache, rate_limiter=self.rate_limiter).start()
+        self.parse_pool.start()
+        if self.shop.js_ratio > 0:
+            # Imported here: only the JS-only pages need playwright
+            from src.browser_pool import BrowserPool
+            from src.render_profile import RenderProfile
+            self.browser_pool = await BrowserPool(RenderProfile(self.shop.url)).start()
+        return self
+
+    async def close(self):
+        await self.client.close()
+        self.parse_pool.close()
+        if self.browser_pool is not None:
+            await self.browser_pool.close()
+        if self.http_cache is not None:
+            self.http_cache.close()
+
+    def crawler(self):
+        # Imported here: the crawler needs playwright, the fetch scenario does not
+        from src.crawler import Crawler
+
+        # With JS-only pages the router sends them to the browser
+        router = FetchRouter() if self.shop.js_ratio > 0 else None
+        crawler = Crawler(self.shop.url, False, UrlFilter.from_rules([]), self.page_store, self.client,
+                          browser_pool=self.browser_pool, router=router, parse_pool=self.parse_pool,
+                          retry_policy=self.retry_policy)
+        return crawler
+
+    async def crawl_batches(self, crawler):
+        while True:
+            batch_urls = await crawler.get_next_batch_urls(self.args.batch_size)
+            crawler.requeue(self.retry_policy.deferred.pop_ready('crawl'))
+            if not batch_urls:
+                if not crawler.urls_to_visit and self.retry_policy.deferred.next_ready_in() is None:
+                    return
+                await asyncio.sleep(self.retry_policy.deferred.next_ready_in() or 0)
+                continue
+            self.pages += len(batch_urls)
+            yield batch_urls
+
+
+async def run_crawler(run):
+    crawler = run.crawler()
+    async for _ in run.crawl_batches(crawler):
+        pass
+    await crawler.close()
+
+
+async def run_new_crawler(run):
+    # Imported here: the module configures the logging of the whole process when imported
+    from src.new_crawler import NewCrawler
+    from src.checkpoint import Checkpoint
+    from src.browser_pool import BrowserPool
+    from src.render_profile import RenderProfile
+
+    # Home, categories, information pages and products
+    expected = 1 + run.shop.categories + 5 + run.shop.products
+    crawler = NewCrawler(run.shop.url + '/', concurrency=run.args.concurrency, batch_size=run.args.batch_size,
+                         client=run.client, browser_pool=run.browser_pool or BrowserPool(RenderProfile(run.shop.url)),
+                         parse_pool=run.parse_pool, retry_policy=run.retry_policy)
+    crawler.root_folder = run.workdir
+    crawler.checkpoint = Checkpoint(os.path.join(run.workdir, 'crawler_status', 'checkpoint.json'))
+    await crawler.start()
+    try:
+        while run.pages < expected - 1:
+            try:
+                batch = await asyncio.wait_for(crawler.get_batch(), timeout=run.args.idle_timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"No complete batch in {run.args.idle_timeout}s, {run.pages} of {expected} pages discovered")
+                break
+            run.pages += len(batch)
+    finally:
+        await crawler.stop()
+
+
+async def run_fetch(run):
+    urls = run.shop.product_urls()
+    url_titles = await fetcher.fetch_titles(urls, max_concurrent_requests=run.args.concurrency, client=run.client,
+                                            parse_pool=run.parse_pool, retry_policy=run.retry_policy)
+    product_details = await fetcher.fetch_product_details(url_titles, max_concurrent_requests=run.args.concurrency, client=run.client,
+                                                          parse_pool=run.parse_pool, retry_policy=run.retry_policy)
+    run.pages = len(urls) * 2
+    run.products = len([product for product in product_details if product is not None])
+
+
+async def run_pipeline(run):
+    # Imported here: only the pipeline talks to the LLM through langchain
+    from src import analizer
+
+    crawler = run.crawler()
+    results_manager = results.ResultsManager(run.shop.url, 1)
+    classifier = UrlPatternClassifier()
+    token_batcher = analizer.TokenBatcher()
+
+    async def titles_stage(batch_urls):
+        url_titles = await fetcher.fetch_titles(batch_urls, max_concurrent_requests=run.args.concurrency, page_store=run.page_store,
+                                                client=run.client, parse_pool=run.parse_pool, retry_policy=run.retry_policy)
+        results_manager.save_urls_to_txt(url_titles)
+        return url_titles
+
+    async def select_stage(url_titles):
+        return await analizer.select_product_urls(url_titles, run.args.batch_size, classifier=classifier, batcher=token_batcher)
+
+    async def details_stage(product_urls_titles):
+        return await fetcher.fetch_product_details(product_urls_titles, max_concurrent_requests=run.args.concurrency, page_store=run.page_store,
+                                                   client=run.client, parse_pool=run.parse_pool, retry_policy=run.retry_policy)
+
+    async def results_stage(product_details):
+        results_manager.append_results(product_details, [])
+        return product_details
+
+    scraping_pipeline = pipeline.Pipeline([
+        pipeline.Stage("titles", titles_stage),
+        pipeline.Stage("select", select_stage),
+        pipeline.Stage("details", details_stage),
+        pipeline.Stage("results", results_stage),
+    ], queue_size=PIPELINE_QUEUE_SIZE, report_interval=3600)
+    await scraping_pipeline.run(run.crawl_batches(crawler))
+    await crawler.close()
+    results_manager.save_results()
+    run.products = results_manager.total_products
+    logging.info(f"URL classifier: {classifier.report()}")
+
+
+SCENARIOS = {
+    'pipeline': run_pipeline,
+    'crawler': run_crawler,
+    'new_crawler': run_new_crawler,
+    'fetch': run_fetch,
+}
+
+
+async def bench(args, workdir):
+    shop = await shop_from_arguments(args).start()
+    # analizer talks to the stub LLM of the shop
+    os.environ['OPENAI_API_KEY'] = 'mock'
+    os.environ['OPENAI_BASE_URL'] = os.environ['OPENAI_API_BASE'] = f'{shop.url}/v1'
+
+    run = await Run(shop, args, workdir).start()
+    cpu_start = time.process_time()
+    start_time = time.perf_counter()
+    try:
+        await SCENARIOS[args.scenario](run)
+    finally:
+        elapsed = time.perf_counter() - start_time
+        await run.close()
+        await shop.stop()
+
+    # The parse workers are counted once they have exited
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = time.process_time() - cpu_start + children.ru_utime + children.ru_stime
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss_unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / rss_unit
+
+    print()
+    print(f"Scenario     {args.scenario}: {shop.products} products, {shop.latency * 1000:.0f} ms latency, "
+          f"{shop.throttle_rate:.0%} throttled, {shop.js_ratio:.0%} JS-only, {args.parse_workers} parse workers")
+    print(f"Throughput   {run.pages} pages in {elapsed:.2f}s, {run.pages / elapsed:.1f} pages/s")
+    print(f"Latency      p50 {run.client.latency_percentile(50) * 1000:.0f} ms, p95 {run.client.latency_percentile(95) * 1000:.0f} ms")
+    print(f"CPU          {cpu:.2f}s ({cpu / elapsed:.0%} of one core), peak RSS {peak_rss:.0f} MiB")
+    if args.scenario in ('pipeline', 'fetch'):
+        llm_per_product = shop.llm_calls / run.products if run.products else 0
+        print(f"Products     {run.products} saved, {shop.llm_calls} LLM calls ({llm_per_product:.3f} per product)")
+    print(f"Shop         {shop.report()}")
+    print(f"Retries      {run.retry_policy.report()}")
+    if run.rate_limiter is not None:
+        print(f"Rate limiter {run.rate_limiter.report()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", nargs="?", default="pipeline", choices=SCENARIOS)
+    add_shop_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENT_REQUESTS)
+    parser.add_argument("--batch-size", type=int, default=GENERAL_BATCH_SIZE)
+    parser.add_argument("--parse-workers", type=int, default=0, help="Processes of the ParsePool, 0 to parse on the event loop")
+    parser.add_argument("--http-cache", action="store_true", help="Go through an HttpCache in the working directory")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Run without the RateLimiter")
+    parser.add_argument("--idle-timeout", type=float, default=10, help="Seconds without a new batch before NewCrawler stops")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(levelname)s -\t%(message)s')
+
+    # ResultsManager writes to results/ and copies CONFIG.py from the working directory
+    repository = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='bench_e2e_')
+    shutil.copy(os.path.join(repository, 'CONFIG.py'), workdir)
+    os.chdir(workdir)
+    try:
+        asyncio.run(bench(args, workdir))
+    finally:
+        os.chdir(repository)
+        if args.keep:
+            print(f"Working directory: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
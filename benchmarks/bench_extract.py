@@ -0,0 +1,196 @@
+"""
+Compare the former BeautifulSoup extraction of the fetcher with the lxml HtmlExtractor.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_extract [page.html ...] [--runs N]
+
+Without files a synthetic product page is generated from the tags in CONFIG.py.
+Both paths must return the same title and details for every page.
+"""
+import argparse
+import time
+from bs4 import BeautifulSoup
+from CONFIG import (TITLE_TAGS, DESCRIPTION_TAGS, PRICE_TAGS, IMAGE_CLASSES, NO_OG_IMAGE, NO_OG_DESCRIPTION,
+                    NO_OG_TITLE)
+from src.extract import EXTRACTOR
+
+
+def tag_html(entry, text):
+    class_attr = f' class="{entry["class"]}"' if entry.get("class") else ''
+    return f'<{entry["tag"]}{class_attr}>{text}</{entry["tag"]}>'
+
+
+def synthetic_page(menu_links=400, reviews=50):
+    """
+    Product page with a large menu and reviews, like most shop templates.
+    """
+    menu = "".join(f'<li><a href="/category-{i}/">Category {i}</a></li>' for i in range(menu_links))
+    review_blocks = "".join(f'<div class="review"><p>Review {i} ' + 'lorem ipsum ' * 30 + '</p></div>' for i in range(reviews))
+    return f"""<!DOCTYPE html>
+<html><head>
+<meta charset="utf-8">
+<title>Camiseta roja | Shop</title>
+<meta property="og:title" content="Camiseta roja">
+<meta property="og:image" content="https://shop.com/img/camiseta.jpg">
+<meta property="og:description" content="Camiseta de algodón">
+<script>{'var x = 1;' * 2000}</script>
+<style>{'.a {{ color: red; }}' * 500}</style>
+</head><body>
+<nav><ul>{menu}</ul></nav>
+<main>
+{tag_html(TITLE_TAGS[0], 'Camiseta roja') if TITLE_TAGS else ''}
+<img class="{IMAGE_CLASSES[0] if IMAGE_CLASSES else ''}" src="https://shop.com/img/camiseta-zoom.jpg">
+{tag_html(DESCRIPTION_TAGS[0], 'Camiseta de algodón') if DESCRIPTION_TAGS else ''}
+{tag_html(PRICE_TAGS[0], '19,90 €') if PRICE_TAGS else ''}
+</main>
+{review_blocks}
+</body></html>"""
+
+
+# Reference implementations: the BeautifulSoup extraction of the fetcher before HtmlExtractor
+
+def extract_title_from_soup(soup):
+    """
+    Extract the product title from a parsed page, the way the fetcher did
+    before HtmlExtractor.title.
+
+    :param soup: BeautifulSoup object.
+    :return: The title, or None if it was not found.
+    """
+    # Try to extract the Open Graph title
+    title = None
+    if not NO_OG_TITLE:
+        og_title = soup.find("meta", property="og:title")
+        if og_title and og_title.get("content"):
+            title = og_title.get("content")
+
+    # try other title tags
+    if not title:
+        # Iterate through each specified tag and attribute in TITLE_TAGS
+        for entry in TITLE_TAGS:
+            # Use ** to unpack dictionary entries as keyword arguments
+            title = soup.find(entry["tag"], class_=entry.get("class"))
+            if title:
+                # Extract text and strip any excess whitespace
+                title = title.get_text(strip=True)
+                break
+
+    return title
+
+
+def fetch_product_details_from_soup(soup):
+    """
+    Fetch product details from BeautifulSoup object, the way the fetcher did
+    before HtmlExtractor.details.
+
+    :param soup: BeautifulSoup object.
+    :return: A dictionary with 'image', 'description', and 'price'.
+    """
+
+    # Extract image URL
+    image = None
+    if not NO_OG_IMAGE:
+        meta_image = soup.find("meta", property="og:image")
+        if meta_image:
+            image = meta_image.get("content", "").strip()
+
+    if not image:
+        for img_class in IMAGE_CLASSES:
+            img_tag = soup.find("img", class_=img_class)
+            if img_tag:
+                image = img_tag.get("src", "").strip()
+                if image:
+                    break
+        else:
+            image = "Image not found"
+
+    # Extract description
+    description = None
+    if not NO_OG_DESCRIPTION:
+        meta_description = soup.find("meta", property="og:description")
+        if meta_description:
+            description = meta_description.get("content", "").strip()
+
+    if not description:
+        for desc_tag in DESCRIPTION_TAGS:
+            tag = soup.find(desc_tag["tag"], class_=desc_tag["class"])
+            if tag:
+                description = tag.get_text().strip()
+                if description:
+                    break
+        else:
+            description = "Description not found"
+
+    # Extract price
+    price = None
+    for price_tag in PRICE_TAGS:
+        tag = soup.find(price_tag["tag"], class_=price_tag["class"])
+        if tag:
+            price = tag.get_text().strip()
+            if price:
+                break
+    else:
+        price = "Price not found"
+
+    if price != "Price not found":
+        # Format price
+        formatted_price = price.replace("€", "").replace(",", ".").strip()
+        try:
+            price_value = float(formatted_price)
+            formatted_price = f"{price_value:.2f}€"
+            price = formatted_price
+        except ValueError:
+            pass
+
+    return {
+        "image": image,
+        "description": description,
+        "price": price
+    }
+
+
+def soup_title(content):
+    return extract_title_from_soup(BeautifulSoup(content, 'lxml'))
+
+
+def soup_details(content):
+    return fetch_product_details_from_soup(BeautifulSoup(content, 'lxml'))
+
+
+def timed(function, pages, runs):
+    start_time = time.perf_counter()
+    for _ in range(runs):
+        for page in pages:
+            function(page)
+    return (time.perf_counter() - start_time) / (runs * len(pages)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="HTML files of real product pages")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.files:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            pages.append(f.read())
+    if not pages:
+        pages = [synthetic_page()]
+
+    for page in pages:
+        assert soup_title(page) == EXTRACTOR.title(page), (soup_title(page), EXTRACTOR.title(page))
+        assert soup_details(page) == EXTRACTOR.details(page), (soup_details(page), EXTRACTOR.details(page))
+
+    print(f"{len(pages)} pages, {sum(len(page) for page in pages) / len(pages) / 1024:.0f} KiB on average, {args.runs} runs")
+    for name, reference, fast in (
+        ("title", soup_title, EXTRACTOR.title),
+        ("details", soup_details, EXTRACTOR.details),
+    ):
+        reference_ms = timed(reference, pages, args.runs)
+        fast_ms = timed(fast, pages, args.runs)
+        print(f"{name:8} BeautifulSoup {reference_ms:7.2f} ms/page   lxml {fast_ms:7.2f} ms/page   {reference_ms / fast_ms:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
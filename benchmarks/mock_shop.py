@@ -0,0 +1,245 @@
+"""
+Local e-commerce site with a synthetic catalog, to measure the scraper without hitting real shops.
+
+Usage (from the repository root):
+    python -m benchmarks.mock_shop [--products N] [--port P] ...
+
+The shop has a home page, a chain of category pages with fanout products
+each, information pages and one page per product with the tags of
+CONFIG.py, padded to page_kb. Every page answers after a random latency,
+a share of the requests gets a 429 with Retry-After, and a share of the
+products are app shells only rendered by JavaScript. Pages have an ETag and
+answer 304 to If-None-Match. /sitemap.xml lists every product.
+
+/v1/chat/completions is a stub of the OpenAI API for analizer: it marks the
+/product/ paths of the prompt as products, without a real model.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from aiohttp import web
+from CONFIG import DESCRIPTION_TAGS, PRICE_TAGS, IMAGE_CLASSES, TITLE_TAGS
+from benchmarks.bench_extract import tag_html
+
+INFO_PAGES = {
+    'contacto': 'Contacto',
+    'envios': 'Información de Envíos',
+    'devoluciones': 'Política de Devolución',
+    'terminos': 'Términos y Condiciones',
+    'faq': 'Preguntas Frecuentes',
+}
+NAV_CATEGORIES = 30  # Categories linked from the menu of every page
+
+
+class MockShop:
+    def __init__(self, products=1000, fanout=20, page_kb=60, latency=0.05, throttle_rate=0.0,
+                 js_ratio=0.0, seed=0):
+        """
+        :param products: Products of the catalog.
+        :param fanout: Products listed by each category page.
+        :param page_kb: Approximate size of a product page.
+        :param latency: Mean seconds before each answer (exponentially distributed).
+        :param throttle_rate: Share of the requests answered with a 429.
+        :param js_ratio: Share of the products only rendered by JavaScript.
+        :param seed: Seed of the random latencies, throttles and JS pages.
+        """
+        self.products = products
+        self.fanout = fanout
+        self.page_kb = page_kb
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.js_ratio = js_ratio
+        self.random = random.Random(seed)
+        self.js_products = set(i for i in range(products) if random.Random(seed * 1000003 + i).random() < js_ratio)
+        self.categories = max(1, -(-products // fanout))
+
+        self.runner = None
+        self.url = None
+
+        self.requests = 0
+        self.throttled = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.llm_calls = 0
+        self.llm_items = 0
+
+    # Pages
+
+    def nav(self):
+        links = ''.join(f'<li><a href="/category/{i}">Categoría {i}</a></li>' for i in range(min(self.categories, NAV_CATEGORIES)))
+        links += ''.join(f'<li><a href="/info/{slug}">{title}</a></li>' for slug, title in INFO_PAGES.items())
+        return f'<nav><ul><li><a href="/">Inicio</a></li>{links}</ul></nav>'
+
+    def page(self, title, body, head=''):
+        return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title} | Mock Shop</title>{head}</head>'
+                f'<body>{self.nav()}<main>{body}</main></body></html>')
+
+    def home(self):
+        return self.page('Mock Shop', '<h1>Bienvenido</h1>')
+
+    def category(self, index):
+        first = index * self.fanout
+        products = ''.join(f'<li><a href="/product/{i}">Producto {i}</a></li>' for i in range(first, min(first + self.fanout, self.products)))
+        more = f'<a href="/category/{index + 1}">Siguiente</a>' if index + 1 < self.categories else ''
+        return self.page(f'Categoría {index}', f'<h1>Categoría {index}</h1><ul>{products}</ul>{more}')
+
+    def product(self, index):
+        name = f'Producto {index} modelo {index % 7} color {("rojo", "azul", "verde")[index % 3]}'
+        head = (f'<meta property="og:title" content="{name}">'
+                f'<meta property="og:image" content="/img/{index}.jpg">'
+                f'<meta property="og:description" content="Descripción del producto {index}">')
+        related = ''.join(f'<li><a href="/product/{(index + i) % self.products}">Relacionado {i}</a></li>' for i in range(1, 6))
+        body = (f'{tag_html(TITLE_TAGS[0], name) if TITLE_TAGS else f"<h1>{name}</h1>"}'
+                f'<img class="{IMAGE_CLASSES[0] if IMAGE_CLASSES else ""}" src="/img/{index}-zoom.jpg">'
+                f'{tag_html(DESCRIPTION_TAGS[0], f"Descripción del producto {index}") if DESCRIPTION_TAGS else ""}'
+                f'{tag_html(PRICE_TAGS[0], f"{10 + index % 90},90 €") if PRICE_TAGS else ""}'
+                f'<ul>{related}</ul>')
+        html = self.page(name, body, head)
+        # Reviews up to the page weight
+        review = '<div class="review"><p>' + 'lorem ipsum dolor sit amet ' * 20 + '</p></div>'
+        reviews = max(0, (self.page_kb * 1024 - len(html)) // len(review))
+        return html.replace('</main>', '</main>' + review * reviews)
+
+    def app_shell(self, index):
+        return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Mock Shop</title></head>'
+                f'<body><div id="root"></div><script src="/static/app.js?product={index}"></script></body></html>')
+
+    def app_js(self, index):
+        return f'document.open(); document.write({json.dumps(self.product(index))}); document.close();'
+
+    def sitemap(self):
+        urls = ''.join(f'<url><loc>{self.url}/product/{i}</loc><lastmod>2024-01-01</lastmod></url>' for i in range(self.products))
+        return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+
+    # Server
+
+    async def handle(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.random.expovariate(1 / self.latency) if self.latency > 0 else 0)
+        if self.throttle_rate and self.random.random() < self.throttle_rate:
+            self.throttled += 1
+            return web.Response(status=429, headers={'Retry-After': '1'})
+
+        path = request.path
+        content_type = 'text/html'
+        match = re.fullmatch(r'/(category|product|info)/([^/]+)', path)
+        if path == '/':
+            body = self.home()
+        elif path == '/robots.txt':
+            body, content_type = f'User-agent: *\nSitemap: {self.url}/sitemap.xml\n', 'text/plain'
+        elif path == '/sitemap.xml':
+            body, content_type = self.sitemap(), 'application/xml'
+        elif path == '/static/app.js' and request.query.get('product', '').isdigit():
+            body, content_type = self.app_js(int(request.query['product'])), 'application/javascript'
+        elif match and match.group(1) == 'category' and match.group(2).isdigit() and int(match.group(2)) < self.categories:
+            body = self.category(int(match.group(2)))
+        elif match and match.group(1) == 'product' and match.group(2).isdigit() and int(match.group(2)) < self.products:
+            index = int(match.group(2))
+            body = self.app_shell(index) if index in self.js_products else self.product(index)
+        elif match and match.group(1) == 'info' and match.group(2) in INFO_PAGES:
+            title = INFO_PAGES[match.group(2)]
+            body = self.page(title, f'<h1>{title}</h1><p>{"texto " * 200}</p>')
+        else:
+            return web.Response(status=404, text='Not found')
+
+        etag = '"' + hashlib.blake2b(body.encode('utf-8'), digest_size=8).hexdigest() + '"'
+        if request.headers.get('If-None-Match') == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        data = body.encode('utf-8')
+        self.bytes_sent += len(data)
+        return web.Response(body=data, content_type=content_type, charset='utf-8', headers={'ETag': etag})
+
+    async def chat_completions(self, request):
+        """
+        Stub of the OpenAI chat completions API used by analizer.select_product_urls.
+        """
+        self.llm_calls += 1
+        payload = await request.json()
+        prompt = payload['messages'][-1]['content']
+        # The items are the JSON list at the end of the prompt
+        items = json.loads(prompt[prompt.rindex('\n[') + 1:])
+        self.llm_items += len(items)
+        products = [item['id'] for item in items if item['path'].startswith('/product/')]
+        others = [item['id'] for item in items if not item['path'].startswith('/product/')]
+        content = json.dumps({'productos': products, 'otros': others})
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        return web.json_response({
+            'id': f'chatcmpl-mock-{self.llm_calls}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'mock'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        app.router.add_get('/{path:.*}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}'
+        return self
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def product_urls(self):
+        return [f'{self.url}/product/{i}' for i in range(self.products)]
+
+    def report(self):
+        return (f"{self.requests} requests, {self.throttled} throttled (429), {self.not_modified} not modified (304), "
+                f"{self.bytes_sent / 1024 / 1024:.1f} MB sent, {self.llm_calls} LLM calls for {self.llm_items} items")
+
+
+def add_shop_arguments(parser):
+    parser.add_argument("--products", type=int, default=1000, help="Products of the catalog")
+    parser.add_argument("--fanout", type=int, default=20, help="Products per category page")
+    parser.add_argument("--page-kb", type=int, default=60, help="Size of a product page")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean seconds before each answer")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with a 429")
+    parser.add_argument("--js-ratio", type=float, default=0.0, help="Share of products only rendered by JavaScript")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def shop_from_arguments(args):
+    return MockShop(args.products, args.fanout, args.page_kb, args.latency, args.throttle_rate, args.js_ratio, args.seed)
+
+
+async def serve(shop, port):
+    await shop.start(port=port)
+    print(f"Mock shop with {shop.products} products on {shop.url} (Ctrl+C to stop)")
+    print(f"Point analizer at the stub LLM with OPENAI_BASE_URL={shop.url}/v1")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        print(shop.report())
+        await shop.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_shop_arguments(parser)
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(shop_from_arguments(args), args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
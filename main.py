@@ -4,10 +4,24 @@ import src.crawler as crawler
 import src.fetcher as fetcher
 import src.analizer as analizer
 import src.results as results
+import src.pipeline as pipeline
+from src.url_filter import load_url_filter
+from src.sitemap import iter_sitemap_urls
+from src.classifier import UrlPatternClassifier
+from src.router import FetchRouter
+import os
+from src.http_client import HttpClient
+from src.http_cache import HttpCache
+from src.rate_limiter import RateLimiter
+from src.retry import RetryPolicy
+from src.incremental import IncrementalState, find_previous_execution
+from src.checkpoint import Checkpoint
+from src.pages import PageStore
+from src.parse_pool import ParsePool, LoopLagMonitor
 import time
 from colorama import init, Fore, Style
 from dotenv import load_dotenv
-from CONFIG import ROOT_URL, LLM_BATCH_SIZE, TARGET_PRODUCTS_N, CONCURRENT_REQUESTS, GENERAL_BATCH_SIZE, IGNORE_URLS_WITH
+from CONFIG import ROOT_URL, LLM_BATCH_SIZE, TARGET_PRODUCTS_N, CONCURRENT_REQUESTS, GENERAL_BATCH_SIZE, PAGE_STORE_MAX_PAGES, PIPELINE_QUEUE_SIZE, PIPELINE_REPORT_INTERVAL, DISCOVERY_MODE, SITEMAP_PRODUCTS_ONLY, USE_URL_CLASSIFIER, USE_LLM_CACHE, FETCH_MODE, HTTP_CACHE_MODE, USE_RATE_LIMIT, INCREMENTAL, RESUME_FROM_CHECKPOINT
 import signal
 
 load_dotenv()
@@ -54,37 +68,48 @@ logging.basicConfig(level=logging.INFO,
 logging.getLogger('httpcore').setLevel(logging.WARNING)
 logging.getLogger('httpx').setLevel(logging.WARNING)
 
-def filter_urls(urls, results_manager):
-    # get the set of processed URLs
-    processed_urls = results_manager.get_processed_urls()
+def filter_urls(urls, results_manager, url_filter):
+    # filter out processed URLs and duplicates
+    filtered_urls = []
+    for url in dict.fromkeys(urls):
+        if not results_manager.is_processed_url(url):
+            filtered_urls.append(url)
 
-    # filter out processed URLs
-    filtered_urls = [url for url in urls if url not in processed_urls]
-
-    # remove duplicates
-    filtered_urls = list(set(filtered_urls))
-
-    # IGNORE_URLS_WITH
-    filtered_urls = [url for url in filtered_urls if not IGNORE_URLS_WITH in url]
+    # ignore_links.txt rules and IGNORE_URLS_WITH
+    filtered_urls = url_filter.filter(filtered_urls)
 
     return filtered_urls
 
 def filter_titles(urls_titles, results_manager):
-    # get the set of processed URLs
-    processed_titles = results_manager.get_processed_titles()
-
-    # filter out processed URLs
-    filtered_urls_titles = [url_title for url_title in urls_titles if url_title["title"] not in processed_titles]
-
-    # remove duplicates
-    filtered_urls_titles_copy = filtered_urls_titles.copy()
+    # filter out processed titles and duplicates
     filtered_urls_titles = []
-    for url_title in filtered_urls_titles_copy:
-        if url_title["title"] not in processed_titles:
-            filtered_urls_titles.append(url_title)
+    batch_titles = set()
+    for url_title in urls_titles:
+        if url_title["title"] in batch_titles or results_manager.is_processed_title(url_title["title"]):
+            continue
+        batch_titles.add(url_title["title"])
+        filtered_urls_titles.append(url_title)
 
     return filtered_urls_titles
 
+async def seed_from_sitemaps(crawler_instance, client):
+    """
+    Seed the crawler frontier with the URLs listed in the sitemaps of the shop.
+
+    :return: Dictionary of the sitemap URLs and their lastmod date (or None).
+    """
+    sitemap_lastmod = {}
+    start_time = time.time()
+    async for url, lastmod in iter_sitemap_urls(client.session, ROOT_URL, SITEMAP_PRODUCTS_ONLY):
+        sitemap_lastmod[url] = lastmod
+        crawler_instance.seed([url])
+    elapsed_time = time.time() - start_time
+    logging.info(Fore.GREEN + f"Found {len(sitemap_lastmod)} URLs in sitemaps in {elapsed_time:.2f} seconds" + Style.RESET_ALL)
+    return sitemap_lastmod
+
+def checkpoint_path(execution_number):
+    return os.path.join('results', results.get_domain_name(ROOT_URL), f'execution_{execution_number}', 'checkpoint.json')
+
 async def main():
     """
     Main function to orchestrate the web scraping process.
@@ -92,71 +117,178 @@ async def main():
     try:
         logging.info("Starting web scraping process...")
 
-        # Check if the domain is JavaScript-driven
-        logging.info(f"Checking if {ROOT_URL} is JavaScript-driven...")
-        is_javascript_driven = await crawler.is_javascript_driven_async(ROOT_URL)
-        is_javascript_driven = True
-        logging.info(f"{ROOT_URL} is {'not ' if not is_javascript_driven else ''}JavaScript-driven.")
-
         # Initialize variables
         total_products_found = 0
         iterations = 0
         processed_urls = set()
         start_time = time.time()
 
-        # import links to ignore from ignore_links.txt
-        with open('ignore_links.txt', 'r') as f:
-            ignore_links = [line.strip() for line in f.readlines()]
+        # compile the links to ignore from ignore_links.txt and IGNORE_URLS_WITH
+        url_filter = load_url_filter('ignore_links.txt')
+
+        # Pages downloaded by the crawler, reused to extract titles and details
+        page_store = PageStore(PAGE_STORE_MAX_PAGES)
+
+        # On-disk HTTP cache shared by executions
+        http_cache = None
+        if HTTP_CACHE_MODE != "off":
+            http_cache = HttpCache(os.path.join('results', results.get_domain_name(ROOT_URL), 'http_cache'))
+            logging.info(f"HTTP cache mode: {HTTP_CACHE_MODE}")
+
+        # HTTP session shared by every stage for the whole run
+        rate_limiter = RateLimiter() if USE_RATE_LIMIT else None
+        client = await HttpClient(cache=http_cache, rate_limiter=rate_limiter).start()
+
+        # Retries of every stage, with a shared budget and a queue of deferred URLs
+        retry_policy = RetryPolicy()
+
+        # Processes for the HTML parsing and event loop lag measurement
+        parse_pool = ParsePool().start()
+        loop_lag = LoopLagMonitor().start()
+
+        # Static or rendered fetches, decided per URL in "auto" mode
+        fetch_mode = FETCH_MODE
+        if HTTP_CACHE_MODE == "offline":
+            # The browser would go to the network
+            fetch_mode = "static"
+        router = None
+        if fetch_mode == "auto":
+            router = FetchRouter(os.path.join('results', results.get_domain_name(ROOT_URL), 'render_routes.json'))
+        logging.info(f"Fetch mode: {fetch_mode}")
 
         # Initialize crawler
-        crawler_instance = crawler.Crawler(ROOT_URL, is_javascript_driven, ignore_links)
+        crawler_instance = crawler.Crawler(ROOT_URL, fetch_mode == "render", url_filter, page_store, client, router=router, parse_pool=parse_pool, retry_policy=retry_policy)
+
+        # Resume the last execution if it was killed, start a new one otherwise
+        execution_number = results.get_execution_number(ROOT_URL, fixed=True)
+        checkpoint = Checkpoint(checkpoint_path(execution_number))
+        resume_state = checkpoint.load() if RESUME_FROM_CHECKPOINT and execution_number > 0 else None
+        if resume_state is None:
+            execution_number = results.get_execution_number(ROOT_URL)
+            checkpoint = Checkpoint(checkpoint_path(execution_number))
+        else:
+            logging.info(f"Resuming execution {execution_number} from its checkpoint")
+
+        # Seed the frontier from the sitemaps
+        sitemap_lastmod = {}
+        if resume_state is not None:
+            crawler_instance.restore(resume_state['crawler'])
+            sitemap_lastmod = resume_state['sitemap_lastmod']
+            processed_urls = set(resume_state['processed_urls'])
+            iterations = resume_state['iterations']
+            total_products_found = resume_state['total_products_found']
+            retry_policy.deferred.restore(resume_state['deferred_retries'])
+            logging.info(f"Frontier: {crawler_instance.urls_to_visit.report()}")
+        elif DISCOVERY_MODE in ("sitemap", "sitemap+crawl"):
+            logging.info(f"Discovering URLs from the sitemaps of {ROOT_URL}...")
+            sitemap_lastmod = await seed_from_sitemaps(crawler_instance, client)
+            if DISCOVERY_MODE == "sitemap":
+                if sitemap_lastmod:
+                    # Only the sitemap URLs are visited, links are not followed
+                    crawler_instance.harvest_links = False
+                else:
+                    logging.warning("No URLs found in sitemaps, falling back to crawling links.")
 
         # Initialize results manager
-        execution_number = results.get_execution_number(ROOT_URL)
         results_manager = results.ResultsManager(ROOT_URL, execution_number)
 
-        # Define a signal handler for graceful shutdown
-        def signal_handler(sig, frame):
-            logging.info('You pressed Ctrl+C! Saving results and exiting...')
-            results_manager.save_results()
-            exit(0)
-        signal.signal(signal.SIGINT, signal_handler)
-
-        while total_products_found < TARGET_PRODUCTS_N:
-            start_iteration_time = time.time()
-            iterations += 1
-            logging.info("")
-            logging.info("")
-            logging.info(Fore.GREEN + Style.BRIGHT + f"############### START ITERATION {iterations} ###############\n" + Style.RESET_ALL)
-            # Fetch a batch of URLs
-            logging.info(f"Fetching a batch of {GENERAL_BATCH_SIZE} URLs from {ROOT_URL}...")
-            start_batch_time = time.time()
-            batch_urls = await crawler_instance.get_next_batch_urls(GENERAL_BATCH_SIZE)
-            elapsed_batch_time = time.time() - start_batch_time
-            logging.info(Fore.GREEN + f"Crawled {len(batch_urls)} URLs in {elapsed_batch_time:.2f} seconds + Style.RESET_ALL")
-
-            if not batch_urls:
-                logging.info("")
-                logging.info("No more URLs to process.")
-                break
-
-            # Remove already processed URLs
-            batch_urls_to_process = [url for url in batch_urls if url not in processed_urls]
-            # Update processed URLs
-            processed_urls.update(batch_urls_to_process)
-
-            # filter urls
-            # batch_urls_to_process = filter_urls(batch_urls_to_process, results_manager)
-
-            if len(batch_urls) > 5:
-                logging.info(f"Last 5 processed URLs:\n\t\t{"\n\t\t".join(batch_urls[-5:])}\n")
+        # URL inventory of the previous execution, only its changed pages are processed again
+        previous_execution = None
+        if INCREMENTAL:
+            previous_execution = find_previous_execution(os.path.join('results', results_manager.domain_name), execution_number)
+        incremental = IncrementalState(previous_execution, http_cache)
+        if resume_state is not None:
+            incremental.restore(resume_state['incremental'])
+        elif INCREMENTAL:
+            if previous_execution is None:
+                logging.info("Incremental mode: no previous execution, processing every page")
             else:
-                logging.info(f"Processed URLs: {"\n\t\t".join(batch_urls)}\n")
+                # Sitemap URLs with the same lastmod are not even downloaded
+                crawler_instance.skip(incremental.skip_by_lastmod(sitemap_lastmod))
+                crawler_instance.seed(incremental.seed_urls())
+                logging.info(f"Incremental mode from {previous_execution}: {incremental.report()}")
+        if INCREMENTAL and HTTP_CACHE_MODE != "revalidate":
+            logging.warning("Incremental mode without conditional requests, only the sitemap lastmod detects unchanged pages")
+
+        # Local classifier shared by every execution on this domain
+        classifier = None
+        if USE_URL_CLASSIFIER:
+            classifier = UrlPatternClassifier(os.path.join('results', results_manager.domain_name, 'url_classifier.json'))
+
+        # Packs the LLM batches by tokens and tunes their size during the run
+        token_batcher = analizer.TokenBatcher()
+
+        # LLM decisions of earlier executions on this domain
+        decision_cache = None
+        if USE_LLM_CACHE:
+            decision_cache = analizer.open_decision_cache(os.path.join('results', results_manager.domain_name, 'llm_cache.sqlite'))
+
+        async def crawl_batches():
+            nonlocal iterations
+            while True:
+                iterations += 1
+                # URLs whose crawl was deferred go back to the frontier
+                crawler_instance.requeue(retry_policy.deferred.pop_ready('crawl'))
+
+                # Fetch a batch of URLs
+                start_batch_time = time.time()
+                batch_urls = await crawler_instance.get_next_batch_urls(GENERAL_BATCH_SIZE)
+                elapsed_batch_time = time.time() - start_batch_time
+                logging.info(Fore.GREEN + f"Batch {iterations}: crawled {len(batch_urls)} URLs in {elapsed_batch_time:.2f} seconds" + Style.RESET_ALL)
+                logging.info(f"Frontier: {crawler_instance.urls_to_visit.report()}")
+                logging.info(f"Event loop: {loop_lag.report()}")
+
+                # URLs whose title or details fetch was deferred are fetched again
+                deferred_urls = retry_policy.deferred.pop_ready('fetch')
+
+                if not batch_urls and not deferred_urls:
+                    if scraping_pipeline.stop_event.is_set():
+                        return
+                    if not scraping_pipeline.idle():
+                        # The stages still running may defer fetches, which this source has to send again
+                        logging.info("Frontier empty, waiting for the pipeline to finish its batches...")
+                        await scraping_pipeline.wait_idle()
+                        continue
+                    next_ready_in = retry_policy.deferred.next_ready_in()
+                    if next_ready_in is not None:
+                        logging.info(f"Waiting {next_ready_in:.0f}s for {len(retry_policy.deferred)} deferred retries...")
+                        await asyncio.sleep(next_ready_in)
+                        continue
+                    logging.info("")
+                    logging.info("No more URLs to process.")
+                    return
+
+                # Remove already processed URLs
+                batch_urls_to_process = [url for url in batch_urls if url not in processed_urls]
+                # Update processed URLs
+                processed_urls.update(batch_urls_to_process)
+                batch_urls_to_process.extend(deferred_urls)
+
+                # filter urls
+                # batch_urls_to_process = filter_urls(batch_urls_to_process, results_manager, url_filter)
+
+                if len(batch_urls) > 5:
+                    logging.info(f"Last 5 processed URLs:\n\t\t{"\n\t\t".join(batch_urls[-5:])}\n")
+                else:
+                    logging.info(f"Processed URLs: {"\n\t\t".join(batch_urls)}\n")
+
+                if batch_urls_to_process:
+                    yield batch_urls_to_process
+
+        async def fetch_titles_stage(batch_urls_to_process):
+            if INCREMENTAL:
+                # Pages answered with a 304 keep the title and product of the previous execution
+                batch_urls_to_process, unchanged = incremental.split_unchanged(batch_urls_to_process, sitemap_lastmod)
+                if unchanged:
+                    logging.info(f"Skipped {len(unchanged)} unchanged pages")
+                    results_manager.save_urls_to_txt(unchanged)
+                    page_store.discard([record["url"] for record in unchanged])
+                if not batch_urls_to_process:
+                    return None
 
             # Fetch Titles
-            logging.info(f"Fetching titles for {len(batch_urls_to_process)} URLs...")
             start_time_fetch_titles = time.time()
-            url_titles = await fetcher.fetch_titles(batch_urls_to_process, max_concurrent_requests=CONCURRENT_REQUESTS)
+            url_titles = await fetcher.fetch_titles(batch_urls_to_process, max_concurrent_requests=CONCURRENT_REQUESTS, page_store=page_store, client=client, parse_pool=parse_pool, retry_policy=retry_policy)
             elapsed_time_fetch_titles = time.time() - start_time_fetch_titles
             logging.info(Fore.GREEN + f"Fetched titles for {len(url_titles)} URLs in {elapsed_time_fetch_titles:.2f} seconds\n" + Style.RESET_ALL)
 
@@ -170,55 +302,135 @@ async def main():
             for url in urls_titles_not_found:
                 all_urls_titles.append({"url": url, "title": "Title not found"})
             results_manager.save_urls_to_txt(all_urls_titles)
-            
-            if len(url_titles) > 5:
-                logging.info(f"Last 5 fetched titles:\n\t\t{"\n\t\t".join([url_title["title"] for url_title in url_titles[-5:]])}\n")
-            else:
-                logging.info(f"Fetched titles:\n\t\t{"\n\t\t".join([url_title["title"] for url_title in url_titles])}\n")
+            incremental.record_titles(all_urls_titles, sitemap_lastmod)
+            page_store.discard(urls_titles_not_found)
+
+            # discard titles of products already saved
+            url_titles = [url_title for url_title in url_titles if not results_manager.is_saved_product(url_title["title"], url_title["url"])]
 
-            # discard existing titles
-            url_titles = [title for title in url_titles if title not in results_manager.seen_titles]
+            return url_titles
 
+        async def select_products_stage(url_titles):
             # Select Product URLs
-            logging.info(f"Selecting product URLs from {len(url_titles)} URLs...")
             start_time_select_products = time.time()
-            product_urls_titles = await analizer.select_product_urls(url_titles, LLM_BATCH_SIZE)
+            product_urls_titles = await analizer.select_product_urls(url_titles, LLM_BATCH_SIZE, classifier=classifier, decision_cache=decision_cache, batcher=token_batcher)
             elapsed_time_select_products = time.time() - start_time_select_products
-            logging.info(Fore.GREEN + f"Selected {len(product_urls_titles)} product URLs in {elapsed_time_select_products:.2f} seconds\n" + Style.RESET_ALL)
-            
-            if len(product_urls_titles) > 5:
-                logging.info(f"Last 5 selected product URLs:\n\t\t{"\n\t\t".join([url_title["title"] for url_title in product_urls_titles[-5:]])}\n")
-            else:
-                logging.info(f"Selected product URLs:\n\t\t{"\n\t\t".join([url_title["title"] for url_title in product_urls_titles])}\n")
+            logging.info(Fore.GREEN + f"Selected {len(product_urls_titles)} product URLs out of {len(url_titles)} in {elapsed_time_select_products:.2f} seconds\n" + Style.RESET_ALL)
 
+            if classifier is not None:
+                classifier.save()
+                logging.info(f"URL classifier: {classifier.report()}")
+            logging.info(f"LLM batches: {token_batcher.report()}")
+
+            # Only the product pages are needed from now on
+            product_urls = set(url_title["url"] for url_title in product_urls_titles)
+            incremental.record_rejected([url_title["url"] for url_title in url_titles if url_title["url"] not in product_urls])
+            page_store.discard([url_title["url"] for url_title in url_titles if url_title["url"] not in product_urls])
+
+            return product_urls_titles
+
+        async def fetch_details_stage(product_urls_titles):
             # Fetch Product Details
-            logging.info(f"Fetching product details for {len(product_urls_titles)} product URLs...")
             start_time_fetch_details = time.time()
-            product_details = await fetcher.fetch_product_details(product_urls_titles, max_concurrent_requests=CONCURRENT_REQUESTS)
+            product_details = await fetcher.fetch_product_details(product_urls_titles, max_concurrent_requests=CONCURRENT_REQUESTS, page_store=page_store, client=client, parse_pool=parse_pool, retry_policy=retry_policy)
             elapsed_time_fetch_details = time.time() - start_time_fetch_details
             logging.info(Fore.GREEN + f"Fetched {len(product_details)} product details in {elapsed_time_fetch_details:.2f} seconds\n" + Style.RESET_ALL)
+            page_store.discard([url_title["url"] for url_title in product_urls_titles])
 
-            # Update total products found
-            total_products_found += len(product_details)
+            return product_details
+
+        async def save_results_stage(product_details):
+            nonlocal total_products_found
+            # Save Results, the duplicates (e.g. of a batch saved again after a resume) are not counted
+            total_products_found += results_manager.append_results(product_details, [])
             logging.info(f"Total products found so far: {total_products_found}")
+            incremental.record_products(product_details)
+            logging.info(Fore.GREEN  + f"Saved {results_manager.total_products} unique products to {results_manager.store_file}\n" + Style.RESET_ALL)
 
-            # Save Results
-            logging.info("Saving results...")
-            start_time_save_results = time.time()
-            results_manager.append_results(product_details, all_urls_titles)
-            elapsed_time_save_results = time.time() - start_time_save_results
-            logging.info(Fore.GREEN  + f"Saved {results_manager.total_products} unique products to {results_manager.results_file}\n" + Style.RESET_ALL)
-            
-            elapsed_iteration_time = time.time() - start_iteration_time
-            logging.info(Fore.GREEN + Style.BRIGHT + f"Completed iteration {iterations} in {elapsed_iteration_time:.2f} seconds" + Style.RESET_ALL)
-            
             # Check if TARGET_PRODUCTS_N is reached
-            if total_products_found >= TARGET_PRODUCTS_N:
+            if total_products_found >= TARGET_PRODUCTS_N and not scraping_pipeline.stop_event.is_set():
                 logging.info(f"Target number of products ({TARGET_PRODUCTS_N}) reached.")
-                break
+                scraping_pipeline.stop()
+
+            return product_details
+
+        # Every stage runs at the same time, connected by bounded queues
+        scraping_pipeline = pipeline.Pipeline([
+            pipeline.Stage("titles", fetch_titles_stage),
+            pipeline.Stage("select", select_products_stage),
+            pipeline.Stage("details", fetch_details_stage),
+            pipeline.Stage("results", save_results_stage),
+        ], queue_size=PIPELINE_QUEUE_SIZE, report_interval=PIPELINE_REPORT_INTERVAL, on_change=checkpoint.request)
+
+        def checkpoint_state():
+            # Everything needed to go on without repeating the work done so far
+            return {
+                'crawler': crawler_instance.state(),
+                'pipeline': scraping_pipeline.pending_batches(),
+                'processed_urls': list(processed_urls),
+                'sitemap_lastmod': sitemap_lastmod,
+                'deferred_retries': retry_policy.deferred.state(),
+                'incremental': incremental.state(),
+                'iterations': iterations,
+                'total_products_found': total_products_found,
+            }
+
+        # Ctrl+C saves a checkpoint and stops the pipeline, a second one quits at once
+        interrupted = False
+        loop = asyncio.get_running_loop()
+        def interrupt():
+            nonlocal interrupted
+            interrupted = True
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            logging.info('You pressed Ctrl+C! Saving a checkpoint and stopping...')
+            checkpoint.save(checkpoint_state())
+            pipeline_task.cancel()
+        signal.signal(signal.SIGINT, lambda sig, frame: loop.call_soon_threadsafe(interrupt))
+
+        checkpoint.start(checkpoint_state)
+        pipeline_task = asyncio.create_task(scraping_pipeline.run(crawl_batches(), resume=resume_state['pipeline'] if resume_state else None))
+        try:
+            await pipeline_task
+        except asyncio.CancelledError:
+            if not interrupted:
+                raise
+        finally:
+            await checkpoint.stop()
+            await crawler_instance.close()
+            await client.close()
+            if http_cache is not None:
+                http_cache.close()
+                logging.info(f"HTTP cache: {http_cache.report()}")
+            await loop_lag.stop()
+            parse_pool.close()
+            if router is not None:
+                router.save()
+                logging.info(f"Fetch router: {router.report()}")
+            if decision_cache is not None:
+                decision_cache.close()
+        logging.info(f"Page store: {page_store.hits} pages reused, {page_store.misses} downloaded again")
+        logging.info(f"HTTP client: {client.report()}")
+        if rate_limiter is not None:
+            logging.info(f"Rate limiter: {rate_limiter.report()}")
+        logging.info(f"Retries: {retry_policy.report()}")
+        logging.info(f"Parse pool: {parse_pool.report()}")
+        logging.info(f"Event loop: {loop_lag.report()}")
+        logging.info(f"Checkpoint: {checkpoint.report()}")
+
+        if interrupted:
+            # The products found so far are exported, the checkpoint is kept to resume
+            results_manager.save_results()
+            logging.info(f"Stopped. Run again to resume execution {execution_number} from {checkpoint.path}")
+            return
 
         # Final save
-        results_manager.save_results()
+        incremental.save_inventory(results_manager.results_folder)
+        if INCREMENTAL:
+            logging.info(f"Incremental mode: {incremental.report()}")
+            results_manager.save_results(incremental.save_catalog(results_manager.results_folder, crawler_instance.gone))
+        else:
+            results_manager.save_results()
+        checkpoint.remove()
 
         total_elapsed_time = time.time() - start_time
         logging.info(Fore.GREEN + Style.BRIGHT + f"Completed web scraping process in {total_elapsed_time:.2f} seconds")
@@ -118,8 +118,8 @@ async def main():
         else:
             logging.info(f"Fetched titles:\n\t\t{"\n\t\t".join([url_title["title"] for url_title in url_titles])}\n")
 
-        # discard existing titles
-        url_titles = [title for title in url_titles if title not in results_manager.seen_titles]
+        # discard titles of products already saved
+        url_titles = [url_title for url_title in url_titles if not results_manager.is_saved_product(url_title["title"], url_title["url"])]
 
         product_urls_titles = url_titles
         
@@ -139,7 +139,7 @@ async def main():
         start_time_save_results = time.time()
         results_manager.append_results(product_details, all_urls_titles)
         elapsed_time_save_results = time.time() - start_time_save_results
-        logging.info(Fore.GREEN  + f"Saved {results_manager.total_products} unique products to {results_manager.results_file}\n" + Style.RESET_ALL)
+        logging.info(Fore.GREEN  + f"Saved {results_manager.total_products} unique products to {results_manager.store_file}\n" + Style.RESET_ALL)
         
         # Final save
         results_manager.save_results()
@@ -1,8 +1,14 @@
 import asyncio
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage
-import ast
-from CONFIG import LLM_MODEL, LLM_TEMPERATURE, PRODUCTS_SOLD, CATEGORIES_EXAMPLES, PRODUCT_EXAMPLES
+import json
+import re
+from urllib.parse import urlparse
+import time
+import tiktoken
+from CONFIG import LLM_MODEL, LLM_TEMPERATURE, PRODUCTS_SOLD, CATEGORIES_EXAMPLES, PRODUCT_EXAMPLES, LLM_CACHE_TTL_DAYS, LLM_CACHE_MAX_ENTRIES
+from CONFIG import LLM_BATCH_TOKEN_BUDGET, LLM_MIN_BATCH_TOKENS, LLM_MAX_BATCH_TOKENS, LLM_MAX_BATCH_ITEMS, LLM_TARGET_LATENCY
+from src.llm_cache import LLMDecisionCache
 import logging
 
 # Generate product examples string
@@ -18,12 +24,12 @@ if len(CATEGORIES_EXAMPLES) > 0:
     categories_examples_str += ''.join(f"       - {example}\n" for example in CATEGORIES_EXAMPLES)
 
 product_selection_prompt = f"""
-A continuación, vas a recibir una lista de elementos en formato de lista de Python, donde cada elemento es un diccionario con las claves "link" y "title". Por ejemplo:
+A continuación, vas a recibir una lista JSON de elementos, donde cada elemento tiene un identificador numérico "id", el "title" de la página y la ruta "path" de su URL. Por ejemplo:
 
 [
-    {{"link": "https://ejemplo.com/producto123", "title": "{PRODUCT_EXAMPLES[0] if len(PRODUCT_EXAMPLES) > 0 else 'Producto 123'}"}},
-    {{"link": "https://ejemplo.com/producto156", "title": "{PRODUCT_EXAMPLES[1] if len(PRODUCT_EXAMPLES) > 1 else 'Producto 156'}"}},
-    {{"link": "https://ejemplo.com/info/envios", "title": "Información de Envíos"}},
+    {{"id": 0, "title": "{PRODUCT_EXAMPLES[0] if len(PRODUCT_EXAMPLES) > 0 else 'Producto 123'}", "path": "/producto123"}},
+    {{"id": 1, "title": "{PRODUCT_EXAMPLES[1] if len(PRODUCT_EXAMPLES) > 1 else 'Producto 156'}", "path": "/producto156"}},
+    {{"id": 2, "title": "Información de Envíos", "path": "/info/envios"}},
     ...
 ]
 
@@ -39,89 +45,267 @@ Tu tarea es la siguiente:
 
 **Instrucciones adicionales:**
 
-- **Salida**: Devuelve una lista en formato de lista de Python que contenga únicamente los enlaces ("link") de las páginas identificadas como productos.
+- **Salida**: Devuelve un objeto JSON con dos listas de identificadores: "productos" con los "id" de las páginas identificadas como productos y "otros" con los "id" del resto. Cada "id" recibido debe aparecer exactamente en una de las dos listas.
 - **Exigencia**: Ante la duda, categoriza una página como producto, ya se filtrará la lista posteriormente.
-- **Formato estricto**: No añadas ninguna indicación extra, texto adicional ni comentarios antes o después de la lista.
+- **Formato estricto**: Devuelve únicamente el objeto JSON, sin texto adicional ni comentarios.
 - **Ejemplo de salida**:
 
-["https://ejemplo.com/producto123", "https://ejemplo.com/producto156"]
+{{"productos": [0, 1], "otros": [2]}}
 
 Esta es la lista de elementos que debes procesar:
 """
 
+def open_decision_cache(path):
+    """
+    Open the on-disk cache of LLM decisions for the current model and prompt.
+    """
+    ttl = LLM_CACHE_TTL_DAYS * 24 * 3600 if LLM_CACHE_TTL_DAYS else None
+    return LLMDecisionCache(path, LLM_MODEL, product_selection_prompt, ttl, LLM_CACHE_MAX_ENTRIES)
+
 def get_llm():
     return ChatOpenAI(
         model_name=LLM_MODEL,
         temperature=LLM_TEMPERATURE
-    )
+    ).bind(response_format={"type": "json_object"})
+
+def format_batch(batch, ids):
+    """
+    Serialize the items of a batch for the prompt, using their position in the
+    batch as a compact identifier and only the path of their URL.
+    """
+    items = []
+    for i in ids:
+        parsed_url = urlparse(batch[i]['url'])
+        path = parsed_url.path + (f"?{parsed_url.query}" if parsed_url.query else "")
+        items.append({"id": i, "title": batch[i]['title'], "path": path or "/"})
+    return json.dumps(items, ensure_ascii=False)
+
+def parse_ids(value):
+    ids = set()
+    for item in value if isinstance(value, list) else []:
+        if isinstance(item, int):
+            ids.add(item)
+        elif isinstance(item, str) and item.strip().isdigit():
+            ids.add(int(item))
+    return ids
+
+def parse_selection(response_text, expected_ids):
+    """
+    Parse the answer of the LLM, tolerating extra text and truncated output.
+
+    :param response_text: Raw answer of the LLM.
+    :param expected_ids: Set of the ids sent in the prompt.
+    :return: Dictionary of id -> is_product for the ids the LLM decided.
+    """
+    products, others = set(), set()
+
+    # Full JSON object, possibly surrounded by text or code fences
+    start, end = response_text.find('{'), response_text.rfind('}')
+    try:
+        parsed = json.loads(response_text[start:end + 1]) if start != -1 and end > start else None
+    except ValueError:
+        parsed = None
+
+    if isinstance(parsed, dict):
+        products = parse_ids(parsed.get("productos"))
+        others = parse_ids(parsed.get("otros"))
+    else:
+        # Salvage the lists that can still be read from a broken answer
+        for key, ids in (("productos", products), ("otros", others)):
+            match = re.search(rf'"{key}"\s*:\s*\[([^\]]*)', response_text)
+            if match:
+                ids.update(int(number) for number in re.findall(r'\d+', match.group(1)))
+
+    decisions = {}
+    for i in expected_ids:
+        # An id in both lists is a product, as the prompt asks in case of doubt. An id in
+        # neither is left undecided: process_batch asks the LLM about it again
+        if i in products:
+            decisions[i] = True
+        elif i in others:
+            decisions[i] = False
+    return decisions
 
 async def process_batch(llm, batch):
+    """
+    Ask the LLM which items of a batch are product pages.
+
+    Items missing from the answer are asked again on their own, up to
+    max_attempts calls in total.
+
+    :return: Dictionary of url -> is_product for the decided items, or None if
+             the LLM did not decide any item.
+    """
     max_attempts = 3
-    attempt = 0
-    llm_processed_links = None
+    decisions = {}
+    pending_ids = list(range(len(batch)))
 
-    while attempt < max_attempts:
-        attempt += 1
+    for attempt in range(1, max_attempts + 1):
         try:
             # Prepare the prompt
-            prompt = f"{product_selection_prompt}\n\n{str(batch)}"
-
+            prompt = f"{product_selection_prompt}\n\n{format_batch(batch, pending_ids)}"
             messages = [HumanMessage(content=prompt)]
-            # print(f"Attempt: {attempt}")
-            # print(f"Prompt: {prompt}")
 
             # Use the asynchronous method directly
             response = await llm.ainvoke(messages)
 
-            response_text = response.content.strip()
-            # print(f"Response: {response_text}")
-
-            # Try to parse response_text as a Python list
-            try:
-                llm_processed_links = ast.literal_eval(response_text)
-                if isinstance(llm_processed_links, list):
-                    # Parsed a list correctly
-                    break
-                else:
-                    print(f"Attempt {attempt}: The LLM response is not a list.")
-            except Exception as e:
-                print(f"Attempt {attempt}: Error parsing the LLM response as list: {e}")
+            decisions.update(parse_selection(response.content.strip(), set(pending_ids)))
         except Exception as e:
-            print(f"Attempt {attempt}: Error during LLM invocation: {e}")
+            logging.warning(f"Attempt {attempt}: Error during LLM invocation: {e}")
 
-    if llm_processed_links is None or not isinstance(llm_processed_links, list):
-        print("Error: The LLM did not return a valid list after 3 attempts.")
-        # Handle the error as needed, e.g., return an empty list or raise an exception
-        return []
-    else:
-        return llm_processed_links
+        pending_ids = [i for i in pending_ids if i not in decisions]
+        if not pending_ids:
+            break
+        logging.warning(f"Attempt {attempt}: The LLM did not decide {len(pending_ids)} of {len(batch)} items.")
+
+    if not decisions:
+        logging.error(f"The LLM did not return valid decisions after {max_attempts} attempts.")
+        return None
+    return {batch[i]['url']: is_product for i, is_product in decisions.items()}
+
+class TokenBatcher:
+    """
+    Packs items into LLM batches by token count instead of a fixed number of
+    items, and tunes the token budget of a batch from the observed requests.
 
-async def select_product_urls(urls_titles, llm_batch_size, max_concurrent_requests=5):
+    The budget grows additively while requests are fast and complete, shrinks
+    when they are slower than target_latency, and is halved when a request
+    fails or leaves items undecided (rate limits, truncated output, ...).
+    """
+    def __init__(self, token_budget=LLM_BATCH_TOKEN_BUDGET, min_tokens=LLM_MIN_BATCH_TOKENS,
+                 max_tokens=LLM_MAX_BATCH_TOKENS, max_items=LLM_MAX_BATCH_ITEMS, target_latency=LLM_TARGET_LATENCY):
+        self.token_budget = token_budget
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.max_items = max_items
+        self.target_latency = target_latency
+        try:
+            self.encoding = tiktoken.encoding_for_model(LLM_MODEL)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # The encoding files are downloaded on first use, estimate tokens if offline
+            logging.warning(f"Could not load the tiktoken encoding, estimating tokens from characters: {e}")
+            self.encoding = None
+        self.prompt_tokens = self.text_tokens(product_selection_prompt)
+        self.requests = 0
+        self.errors = 0
+
+    def text_tokens(self, text):
+        if self.encoding is None:
+            return len(text) // 4 + 1
+        return len(self.encoding.encode(text))
+
+    def count_tokens(self, url_titles):
+        return self.text_tokens(format_batch([url_titles], [0]))
+
+    def make_batches(self, urls_titles):
+        """
+        Split the items in batches of at most token_budget tokens (and max_items items).
+        """
+        batches = []
+        batch, batch_tokens = [], 0
+        for url_titles in urls_titles:
+            tokens = self.count_tokens(url_titles)
+            if batch and (batch_tokens + tokens > self.token_budget or len(batch) >= self.max_items):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(url_titles)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def record(self, latency, complete):
+        """
+        Update the token budget after a request.
+
+        :param latency: Seconds the batch took.
+        :param complete: Whether the LLM decided every item of the batch.
+        """
+        self.requests += 1
+        if not complete:
+            self.errors += 1
+            self.token_budget = max(self.min_tokens, self.token_budget // 2)
+        elif latency > self.target_latency:
+            self.token_budget = max(self.min_tokens, int(self.token_budget * 0.8))
+        else:
+            self.token_budget = min(self.max_tokens, self.token_budget + self.min_tokens)
+
+    def report(self):
+        return (f"token budget {self.token_budget} (+{self.prompt_tokens} prompt), "
+                f"{self.requests} requests, {self.errors} incomplete")
+
+async def select_product_urls(urls_titles, llm_batch_size, max_concurrent_requests=5, classifier=None, decision_cache=None, batcher=None):
     product_urls = []
 
-    # Create a single LLM instance
-    llm = get_llm()
+    # Reuse the decisions of the LLM from earlier executions
+    cached_decisions = {}
+    urls_titles_to_decide = urls_titles
+    if decision_cache is not None:
+        cached_decisions = decision_cache.get_many(urls_titles)
+        urls_titles_to_decide = [url_titles for url_titles in urls_titles if url_titles['url'] not in cached_decisions]
+        logging.info(f"LLM cache answered {len(cached_decisions)} of {len(urls_titles)} items")
+
+    # Let the local classifier decide the items it is confident about
+    local_products = []
+    if classifier is not None:
+        local_products, urls_titles_for_llm = classifier.split(urls_titles_to_decide)
+        logging.info(f"URL classifier decided {len(urls_titles_to_decide) - len(urls_titles_for_llm)} of {len(urls_titles_to_decide)} items locally")
+    else:
+        urls_titles_for_llm = urls_titles_to_decide
+
+    # Every audit of the classifier is consumed by learn() or dropped, whatever happens to its batch
+    try:
+        # Create a single LLM instance
+        llm = get_llm()
+
+        semaphore = asyncio.Semaphore(max_concurrent_requests)
+
+        async def process_batch_semaphore(batch):
+            async with semaphore:
+                start_time = time.time()
+                batch_decisions = await process_batch(llm, batch)
+                if batcher is not None:
+                    batcher.record(time.time() - start_time, batch_decisions is not None and len(batch_decisions) == len(batch))
+                return batch_decisions
+
+        # Pack the items by tokens, or by a fixed number of items without a batcher
+        if batcher is not None:
+            batches = batcher.make_batches(urls_titles_for_llm)
+        else:
+            batches = [urls_titles_for_llm[i:i + llm_batch_size] for i in range(0, len(urls_titles_for_llm), llm_batch_size)]
 
-    semaphore = asyncio.Semaphore(max_concurrent_requests)
+        # Create tasks for all batches
+        tasks = []
+        for i, batch in enumerate(batches):
+            logging.debug(f"Processing batch {i + 1} of {len(batch)} items")
+            task = asyncio.create_task(process_batch_semaphore(batch))
+            tasks.append(task)
 
-    async def process_batch_semaphore(batch):
-        async with semaphore:
-            return await process_batch(llm, batch)
+        # Execute tasks concurrently with concurrency limit
+        result_batches = await asyncio.gather(*tasks)
 
-    # Create tasks for all batches
-    tasks = []
-    for i in range(0, len(urls_titles), llm_batch_size):
-        batch = urls_titles[i:i + llm_batch_size]
-        logging.debug(f"Processing batch {i // llm_batch_size + 1}")
-        task = asyncio.create_task(process_batch_semaphore(batch))
-        tasks.append(task)
+        # Accumulate the results
+        for batch, batch_decisions in zip(batches, result_batches):
+            if batch_decisions is None:
+                continue
+            product_urls.extend(url for url, is_product in batch_decisions.items() if is_product)
 
-    # Execute tasks concurrently with concurrency limit
-    result_batches = await asyncio.gather(*tasks)
+            # Learn from the decisions of the LLM
+            decided = [url_titles for url_titles in batch if url_titles['url'] in batch_decisions]
+            if classifier is not None:
+                for url_titles in decided:
+                    classifier.learn(url_titles['url'], url_titles['title'], batch_decisions[url_titles['url']])
+            if decision_cache is not None:
+                decision_cache.put_many([(url_titles['url'], url_titles['title'], batch_decisions[url_titles['url']]) for url_titles in decided])
+    finally:
+        if classifier is not None:
+            classifier.drop_audits(url_titles['url'] for url_titles in urls_titles_for_llm)
 
-    # Accumulate the results
-    for result_batch in result_batches:
-        product_urls.extend(result_batch)
+    product_urls = set(product_urls)
+    product_urls.update(url_titles['url'] for url_titles in local_products)
+    product_urls.update(url for url, is_product in cached_decisions.items() if is_product)
 
     # get the titles back for each url
     product_urls_titles = []
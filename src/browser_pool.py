@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+from playwright.async_api import async_playwright
+from CONFIG import BROWSER_POOL_SIZE, BROWSER_MAX_NAVIGATIONS
+
+# Collects the links of a page in a single round trip: resolved against the
+# document base, without fragment, on the site host and not ignored by the rules
+EXTRACT_LINKS_JS = """
+([host, rules]) => {
+    const links = new Set();
+    for (const anchor of document.querySelectorAll('a[href]')) {
+        let url;
+        try {
+            url = new URL(anchor.getAttribute('href'), document.baseURI);
+        } catch (e) {
+            continue;
+        }
+        if (!url.protocol.startsWith('http') || url.host !== host) {
+            continue;
+        }
+        url.hash = '';
+        const href = url.href;
+        if (rules && (rules.exact.includes(href)
+                || rules.prefixes.some(prefix => href.startsWith(prefix))
+                || rules.suffixes.some(suffix => href.endsWith(suffix))
+                || rules.substrings.some(substring => href.includes(substring)))) {
+            continue;
+        }
+        links.add(href);
+    }
+    return Array.from(links);
+}
+"""
+
+
+async def extract_links(page, site_url, url_filter=None):
+    """
+    Harvest the links of a loaded page with one evaluate call instead of one
+    get_attribute round trip per anchor.
+
+    :param page: Playwright page.
+    :param site_url: Only links on the host of this URL are returned.
+    :param url_filter: Optional UrlFilter; its plain rules are applied in the page
+        and the regular expressions afterwards.
+    :return: List of unique absolute URLs without fragment.
+    """
+    host = urlparse(site_url).netloc
+    rules = url_filter.page_rules() if url_filter is not None else None
+    links = await page.evaluate(EXTRACT_LINKS_JS, [host, rules])
+    if url_filter is not None and url_filter.regex is not None:
+        links = [link for link in links if not url_filter.regex.search(link)]
+    return links
+
+
+class PageSlot:
+    """
+    A browser context with its page, reused for many navigations.
+    """
+    def __init__(self, context, page):
+        self.context = context
+        self.page = page
+        self.navigations = 0
+        self.crashed = False
+        page.on("crash", self.on_crash)
+
+    def on_crash(self, page):
+        self.crashed = True
+
+
+class BrowserPool:
+    """
+    Long-lived Chromium with a fixed number of reusable contexts and pages.
+
+    Pages are checked out from a queue with `async with pool.page() as page`.
+    A slot is recycled (new context and page) after max_navigations uses, and
+    immediately if its page crashed or was closed. The browser is relaunched
+    if it disconnects. Every context is routed through the RenderProfile.
+    """
+    def __init__(self, render_profile, size=BROWSER_POOL_SIZE, max_navigations=BROWSER_MAX_NAVIGATIONS, user_agent=None):
+        self.render_profile = render_profile
+        self.size = size
+        self.max_navigations = max_navigations
+        self.user_agent = user_agent
+        self.playwright = None
+        self.browser = None
+        self.slots = asyncio.Queue()
+        self.browser_lock = asyncio.Lock()
+
+        self.navigations = 0
+        self.recycles = 0
+        self.crashes = 0
+        self.latencies = deque(maxlen=10000)  # Seconds each page was checked out
+
+    async def start(self):
+        self.playwright = await async_playwright().start()
+        await self.launch_browser()
+        for _ in range(self.size):
+            self.slots.put_nowait(await self.new_slot())
+        return self
+
+    async def launch_browser(self):
+        self.browser = await self.playwright.chromium.launch(headless=True)
+
+    async def new_slot(self):
+        async with self.browser_lock:
+            if not self.browser.is_connected():
+                logging.warning("Browser disconnected, launching a new one")
+                await self.launch_browser()
+        context = await self.browser.new_context(user_agent=self.user_agent)
+        await self.render_profile.install(context)
+        page = await context.new_page()
+        return PageSlot(context, page)
+
+    async def recycle(self, slot):
+        self.recycles += 1
+        try:
+            await slot.context.close()
+        except Exception:
+            # The context dies with a crashed browser
+            pass
+        return await self.new_slot()
+
+    async def navigate(self, page, url):
+        """
+        Load a page with the render profile of the pool.
+        """
+        return await self.render_profile.navigate(page, url)
+
+    @asynccontextmanager
+    async def page(self):
+        """
+        Check out a page of the pool for one navigation.
+        """
+        slot = await self.slots.get()
+        start_time = time.time()
+        try:
+            yield slot.page
+        finally:
+            self.latencies.append(time.time() - start_time)
+            self.navigations += 1
+            slot.navigations += 1
+            if slot.crashed or slot.page.is_closed():
+                self.crashes += 1
+            if slot.crashed or slot.page.is_closed() or slot.navigations >= self.max_navigations:
+                try:
+                    slot = await self.recycle(slot)
+                except Exception as e:
+                    logging.error(f"Could not recycle a browser page: {e}")
+                    # Retry the recycle on the next checkout
+                    slot.crashed = True
+            self.slots.put_nowait(slot)
+
+    async def close(self):
+        while not self.slots.empty():
+            slot = self.slots.get_nowait()
+            try:
+                await slot.context.close()
+            except Exception:
+                pass
+        if self.browser is not None:
+            await self.browser.close()
+        if self.playwright is not None:
+            await self.playwright.stop()
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        p50 = latencies[len(latencies) // 2] if latencies else 0
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+        return (f"{self.navigations} navigations, {self.recycles} recycles, {self.crashes} crashes, "
+                f"page latency p50 {p50:.2f}s p95 {p95:.2f}s, {self.render_profile.report()}")
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from CONFIG import CHECKPOINT_INTERVAL, CHECKPOINT_MIN_INTERVAL
+
+
+class Checkpoint:
+    """
+    State of a run saved to a JSON file so a killed run resumes where it stopped.
+
+    The file is written to a temporary file, flushed to disk and renamed over
+    the previous checkpoint, so a crash while saving leaves the previous one
+    intact. The state is taken by a function called on the event loop
+    thread, which sees every component at the same instant; only the write
+    happens on a worker thread.
+
+    Besides every interval seconds, a save is due as soon as request() is
+    called (e.g. when a batch moves to the next stage of the pipeline); the
+    requests of the next min_interval seconds are written together.
+    """
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL, min_interval=CHECKPOINT_MIN_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.min_interval = min_interval
+        self.changed = asyncio.Event()
+        self.task = None
+
+        self.saves = 0
+        self.save_time = 0  # Seconds spent serializing and writing
+        self.last_size = 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """
+        :return: The saved state, or None if there is no valid checkpoint.
+        """
+        if not self.exists():
+            return None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+        logging.info(f"Loaded checkpoint of {time.ctime(state.get('saved_at', 0))} from {self.path}")
+        return state
+
+    def serialize(self, state):
+        state = dict(state, saved_at=time.time())
+        return json.dumps(state, ensure_ascii=False, default=list).encode('utf-8')
+
+    def write(self, data):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def save(self, state):
+        """
+        Save a state now, blocking (e.g. from a signal handler).
+        """
+        start_time = time.perf_counter()
+        data = self.serialize(state)
+        self.write(data)
+        self.record(data, start_time)
+
+    async def save_async(self, state):
+        start_time = time.perf_counter()
+        data = self.serialize(state)
+        await asyncio.to_thread(self.write, data)
+        self.record(data, start_time)
+
+    def record(self, data, start_time):
+        self.saves += 1
+        self.save_time += time.perf_counter() - start_time
+        self.last_size = len(data)
+
+    def request(self):
+        """
+        Ask for a save of the state soon, because it changed.
+        """
+        self.changed.set()
+
+    def start(self, get_state):
+        """
+        Save the state returned by get_state() when requested, and every interval seconds.
+        """
+        self.task = asyncio.create_task(self.save_periodically(get_state))
+        return self
+
+    async def save_periodically(self, get_state):
+        while True:
+            try:
+                await asyncio.wait_for(self.changed.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.changed.clear()
+            try:
+                await self.save_async(get_state())
+            except Exception as e:
+                logging.exception(f"Could not save the checkpoint: {e}")
+            await asyncio.sleep(self.min_interval)
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def remove(self):
+        """
+        Delete the checkpoint of a run that finished.
+        """
+        for path in (self.path, self.path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def report(self):
+        mean_time = self.save_time / self.saves * 1000 if self.saves else 0
+        return f"{self.saves} saves, {mean_time:.0f} ms per save, last {self.last_size / 1024:.0f} KiB"
@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import random
+import re
+from urllib.parse import urlparse
+from CONFIG import CLASSIFIER_MIN_SUPPORT, CLASSIFIER_MIN_PURITY, CLASSIFIER_AUDIT_RATE
+
+WORD_RE = re.compile(r'\w{4,}')
+
+
+def url_path_shape(url):
+    """
+    Generalize the path of a URL so that pages built from the same template
+    share the same shape, e.g. /products/camiseta-roja -> /products/*
+    and /p/1234 -> /p/#.
+    """
+    path = urlparse(url).path.lower().strip('/')
+    segments = path.split('/') if path else []
+    shape = []
+    for index, segment in enumerate(segments):
+        if segment.isdigit():
+            shape.append('#')
+        elif segment.isalpha() and len(segment) <= 15 and index < len(segments) - 1:
+            # Short words before the last segment are usually fixed template parts
+            shape.append(segment)
+        else:
+            shape.append('*')
+    return '/' + '/'.join(shape)
+
+
+def url_tail_shape(url):
+    """
+    Generalize the end of the last path segment, e.g. camiseta-p-1234.html -> p-#.html.
+    """
+    segment = urlparse(url).path.lower().rstrip('/').rsplit('/', 1)[-1]
+    tokens = []
+    for token in segment.split('-')[-2:]:
+        token = re.sub(r'\d+', '#', token)
+        tokens.append(token if len(token) <= 2 or not token.isalpha() else 'w')
+    return '-'.join(tokens)
+
+
+def url_features(url):
+    return [f"shape:{url_path_shape(url)}", f"tail:{url_tail_shape(url)}"]
+
+
+def title_features(title):
+    return [f"word:{word}" for word in set(WORD_RE.findall(title.lower()))]
+
+
+class UrlPatternClassifier:
+    """
+    Local product classifier learned from the decisions of the LLM.
+
+    For every URL shape, URL tail and title word it counts how many pages were
+    products and how many were not. A page is classified locally only when a
+    URL feature seen at least min_support times is at least min_purity pure
+    and no other confident feature disagrees; anything else is left to the
+    LLM. A small fraction of the local decisions is still sent to the LLM to
+    measure their agreement.
+    """
+    def __init__(self, path=None, min_support=CLASSIFIER_MIN_SUPPORT,
+                 min_purity=CLASSIFIER_MIN_PURITY, audit_rate=CLASSIFIER_AUDIT_RATE):
+        self.path = path
+        self.min_support = min_support
+        self.min_purity = min_purity
+        self.audit_rate = audit_rate
+        self.counts = {}  # feature -> [products, non products]
+
+        self.local_hits = 0     # Items classified locally
+        self.llm_misses = 0     # Items that had to be sent to the LLM
+        self.audited = 0        # Local decisions checked against the LLM
+        self.audit_agreements = 0
+        self.pending_audits = {}  # url -> local decision
+
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.counts = json.load(f)
+            logging.info(f"Loaded URL classifier with {len(self.counts)} features from {path}")
+
+    def feature_vote(self, feature):
+        """
+        :return: True (product), False (not a product) or None if not confident.
+        """
+        products, non_products = self.counts.get(feature, (0, 0))
+        total = products + non_products
+        if total < self.min_support:
+            return None
+        if products / total >= self.min_purity:
+            return True
+        if non_products / total >= self.min_purity:
+            return False
+        return None
+
+    def classify(self, url, title):
+        """
+        :return: True (product), False (not a product) or None if ambiguous.
+        """
+        url_votes = set(self.feature_vote(feature) for feature in url_features(url)) - {None}
+        if len(url_votes) != 1:
+            return None
+        decision = url_votes.pop()
+
+        # Title words can only veto a decision
+        for feature in title_features(title):
+            vote = self.feature_vote(feature)
+            if vote is not None and vote != decision:
+                return None
+        return decision
+
+    def split(self, urls_titles):
+        """
+        Split the items between those decided locally and those for the LLM.
+
+        :param urls_titles: List of dictionaries with 'url' and 'title'.
+        :return: (list of local product items, list of items for the LLM)
+        """
+        local_products = []
+        for_llm = []
+        for url_title in urls_titles:
+            decision = self.classify(url_title['url'], url_title['title'])
+            if decision is None:
+                self.llm_misses += 1
+                for_llm.append(url_title)
+            elif random.random() < self.audit_rate:
+                self.pending_audits[url_title['url']] = decision
+                for_llm.append(url_title)
+            else:
+                self.local_hits += 1
+                if decision:
+                    local_products.append(url_title)
+        return local_products, for_llm
+
+    def learn(self, url, title, is_product):
+        """
+        Record a decision of the LLM.
+        """
+        audited_decision = self.pending_audits.pop(url, None)
+        if audited_decision is not None:
+            self.audited += 1
+            self.audit_agreements += audited_decision == is_product
+
+        for feature in url_features(url) + title_features(title):
+            counts = self.counts.setdefault(feature, [0, 0])
+            counts[0 if is_product else 1] += 1
+
+    def drop_audits(self, urls):
+        """
+        Forget the audits of items the LLM did not answer (failed or dropped batch).
+        """
+        for url in urls:
+            self.pending_audits.pop(url, None)
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.counts, f)
+
+    def report(self):
+        total = self.local_hits + self.llm_misses
+        hit_rate = self.local_hits / total * 100 if total else 0
+        agreement = self.audit_agreements / self.audited * 100 if self.audited else 0
+        return (f"{self.local_hits} classified locally, {self.llm_misses} sent to the LLM "
+                f"({hit_rate:.1f}% hit rate), {agreement:.1f}% agreement on {self.audited} audits")
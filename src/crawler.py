@@ -1,21 +1,42 @@
 import asyncio
 import logging
 import aiohttp
-import random
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, urljoin
-from playwright.async_api import async_playwright
+from urllib.parse import urlparse
 import logging
-from urllib.parse import urlparse, urljoin
-from CONFIG import IGNORE_URLS_WITH, USE_RATE_LIMIT, REQUEST_TIMEOUT
+from urllib.parse import urlparse
+from CONFIG import CONCURRENT_REQUESTS
+from src.pages import normalize_url
+from src.frontier import Frontier
+from src.url_filter import UrlFilter
+from src.browser_pool import BrowserPool, extract_links
+from src.render_profile import RenderProfile
+from src.http_client import client_session
+from src.http_cache import CacheMiss
+from src.rate_limiter import limited
+from src.retry import RetryPolicy, raise_for_retry
+from playwright.async_api import Error as PlaywrightError
+from src.router import needs_rendering
+from src.parse_pool import run_parser, parse_links
+
+# Statuses meaning the page was removed from the site
+GONE_STATUSES = (404, 410)
 
 def is_same_domain(domain, url):
     return urlparse(domain).netloc == urlparse(url).netloc
 
-async def is_javascript_driven_async(domain):
-    # Implement your logic to determine if a site is JavaScript-driven
-    # For this example, we'll assume it's not JavaScript-driven
-    return False
+async def is_javascript_driven_async(domain, client=None):
+    """
+    Check whether the home page of a site needs to be rendered, with a single static request.
+    """
+    try:
+        async with client_session(client) as session:
+            async with session.get(domain, timeout=10) as response:
+                if response.status != 200:
+                    return True
+                return needs_rendering(await response.read())
+    except (aiohttp.ClientError, asyncio.TimeoutError, CacheMiss) as e:
+        logging.warning(f"Could not check if {domain} is JavaScript-driven: {e}")
+        return True
 
 def is_html_page(url):
     """
@@ -36,31 +57,84 @@ def is_html_page(url):
     return True
 
 class Crawler:
-    def __init__(self, domain, is_javascript_driven=False, ignore_links=[]):
+    def __init__(self, domain, is_javascript_driven=False, ignore_links=None, page_store=None, client=None, browser_pool=None, router=None, parse_pool=None, retry_policy=None):
         self.domain = domain
         self.is_javascript_driven = is_javascript_driven
         self.visited = set()
-        self.urls_to_visit = [domain]
-        self.ignore_links = ignore_links
-        self.use_rate_limit = USE_RATE_LIMIT
-        self.rate_limit = 1  # Max requests per second
-        self.concurrent_requests = 5  # Max concurrent requests
-        self.lock = asyncio.Lock()
+        self.urls_to_visit = Frontier([domain])
+        # UrlFilter with the URLs to ignore (a list of rules is compiled into one)
+        if not isinstance(ignore_links, UrlFilter):
+            ignore_links = UrlFilter.from_rules(ignore_links or [])
+        self.url_filter = ignore_links
+        self.concurrent_requests = CONCURRENT_REQUESTS  # Upper bound, the rate limiter adapts below it
+        self.page_store = page_store  # Keeps the crawled HTML for title and detail extraction
+        self.client = client          # Shared HttpClient of the run
+        # Per-host limiter of the client, also used for the browser navigations
+        self.rate_limiter = client.rate_limiter if client is not None else None
+        self.headers = {'User-Agent': 'YourCrawler/1.0'}
+        self.harvest_links = True     # Enqueue the links found on crawled pages
+        self.browser_pool = browser_pool  # Shared BrowserPool (started on first use if None)
+        self.owns_browser_pool = False
+        self.router = router          # FetchRouter deciding static or rendered fetches per URL
+        self.parse_pool = parse_pool  # ParsePool for the link extraction (parsed inline if None)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.gone = set()             # URLs answered with 404 or 410
+
+    def seed(self, urls):
+        """
+        Add URLs discovered elsewhere (e.g. sitemaps) to the frontier.
+
+        :return: Number of new URLs enqueued.
+        """
+        added = 0
+        for url in urls:
+            if is_same_domain(self.domain, url) and not self.url_filter.is_ignored(url):
+                added += self.urls_to_visit.push(url)
+        return added
+
+    def skip(self, urls):
+        """
+        Mark URLs as visited without fetching them (e.g. unchanged since the previous execution).
+        """
+        for url in urls:
+            self.visited.add(normalize_url(url))
 
     async def get_next_batch_urls(self, batch_size):
-        if self.is_javascript_driven:
-            return await self.get_next_batch_urls_pyw(batch_size)
+        if self.router is not None:
+            batch_urls = await self.get_next_batch_urls_routed(batch_size)
+        elif self.is_javascript_driven:
+            batch_urls = await self.get_next_batch_urls_pyw(batch_size)
         else:
-            return await self.get_next_batch_urls_bfs(batch_size)
+            batch_urls = await self.get_next_batch_urls_bfs(batch_size)
+        self.urls_to_visit.commit()
+        return batch_urls
+
+    def state(self):
+        """
+        Frontier and visited URLs for a checkpoint.
+        """
+        in_flight = set(normalize_url(url) for url in self.urls_to_visit.in_flight)
+        return {
+            'frontier': self.urls_to_visit.state(),
+            'visited': [url for url in self.visited if url not in in_flight],
+            'gone': list(self.gone),
+            'harvest_links': self.harvest_links,
+        }
+
+    def restore(self, state):
+        self.urls_to_visit.restore(state['frontier'])
+        self.visited = set(state['visited'])
+        self.gone = set(state['gone'])
+        self.harvest_links = state['harvest_links']
 
     async def get_next_batch_urls_bfs(self, batch_size):
         batch_urls = []
         semaphore = asyncio.Semaphore(self.concurrent_requests)
 
-        async with aiohttp.ClientSession(headers={'User-Agent': 'YourCrawler/1.0'}) as session:
+        async with client_session(self.client) as session:
             tasks = []
             while self.urls_to_visit and len(batch_urls) < batch_size:
-                current_url = self.urls_to_visit.pop(0)
+                current_url = self.urls_to_visit.pop()
                 tasks.append(self.process_url(session, current_url, batch_urls, semaphore))
 
                 if len(tasks) >= self.concurrent_requests:
@@ -72,184 +146,158 @@ class Crawler:
 
         return batch_urls
 
-    async def process_url(self, session, current_url, batch_urls, semaphore):
-        async with semaphore:
-            parsed_url = urlparse(current_url)
-            normalized_url = parsed_url._replace(fragment='').geturl()
+    async def get_next_batch_urls_routed(self, batch_size):
+        """
+        Fetch pages statically and render only the ones the router sends to the browser.
+        """
+        batch_urls = []
+        to_render = []
+        semaphore = asyncio.Semaphore(self.concurrent_requests)
 
-            # Ignore URLs with specific query parameters
-            if IGNORE_URLS_WITH in parsed_url.query:
-                return
+        async with client_session(self.client) as session:
+            tasks = []
+            while self.urls_to_visit and len(batch_urls) + len(to_render) < batch_size:
+                current_url = self.urls_to_visit.pop()
+                if self.router.should_render(current_url):
+                    if self.claim_url(current_url):
+                        to_render.append(current_url)
+                else:
+                    tasks.append(self.process_url(session, current_url, batch_urls, semaphore, to_render))
+
+                if len(tasks) >= self.concurrent_requests:
+                    await asyncio.gather(*tasks)
+                    tasks = []
+
+            if tasks:
+                await asyncio.gather(*tasks)
 
-            if normalized_url not in self.visited:
-                self.visited.add(normalized_url)
+        if to_render:
+            browser_pool = await self.get_browser_pool()
+            await asyncio.gather(*(self.render_url(url, batch_urls, semaphore, browser_pool) for url in to_render))
+
+        return batch_urls
 
-                # Skip non-HTML URLs
-                if not is_html_page(current_url):
-                    logging.info(f"Skipping non-HTML URL: {current_url}")
+    async def process_url(self, session, current_url, batch_urls, semaphore, to_render=None):
+        """
+        Fetch a URL statically and enqueue its links.
+
+        :param to_render: With a router, pages that need the browser are appended here instead.
+        """
+        # Ignore visited URLs, URLs matching the ignore rules and non-HTML URLs
+        if not self.claim_url(current_url):
+            return
+
+        async def attempt():
+            async with session.get(current_url, timeout=10, headers=self.headers) as response:
+                raise_for_retry(response.status, response.headers.get('Retry-After'))
+                if response.status in GONE_STATUSES:
+                    self.gone.add(current_url)
+                if response.status != 200 or 'text/html' not in response.headers.get('Content-Type', ''):
+                    logging.error(f"Failed to load {current_url}, status code: {response.status}")
+                    return
+                content = await response.text()
+            if to_render is not None and self.router.check(current_url, content):
+                # The content is built by JavaScript, render the page instead
+                to_render.append(current_url)
+                return
+            if self.page_store is not None:
+                self.page_store.put(current_url, content)
+            # Extract and enqueue new URLs
+            links = await run_parser(self.parse_pool, parse_links, content, current_url) if self.harvest_links else []
+            for full_url in links:
+                if is_same_domain(self.domain, full_url) and full_url not in self.visited and not self.url_filter.is_ignored(full_url):
+                    self.urls_to_visit.push(full_url)
+            # After processing the current URL, add it to batch_urls
+            batch_urls.append(current_url)
+
+        await self.retry_policy.run(attempt, semaphore, defer=('crawl', current_url))
+
+    async def get_browser_pool(self):
+        # The browser is started on first use and kept for the whole run
+        if self.browser_pool is None:
+            self.browser_pool = await BrowserPool(RenderProfile(self.domain), user_agent=self.headers['User-Agent']).start()
+            self.owns_browser_pool = True
+        return self.browser_pool
+
+    async def close(self):
+        if self.owns_browser_pool and self.browser_pool is not None:
+            logging.info(f"Browser pool: {self.browser_pool.report()}")
+            await self.browser_pool.close()
+            self.browser_pool = None
+
+    def claim_url(self, current_url):
+        """
+        Mark a URL as visited.
+
+        :return: False if it was already visited, is ignored or is not an HTML page.
+        """
+        if self.url_filter.is_ignored(current_url):
+            return False
+        normalized_url = normalize_url(current_url)
+        if normalized_url in self.visited:
+            return False
+        self.visited.add(normalized_url)
+        if not is_html_page(current_url):
+            logging.info(f"Skipping non-HTML URL: {current_url}")
+            return False
+        return True
+
+    async def render_url(self, current_url, batch_urls, semaphore, browser_pool):
+        async def attempt():
+            async with browser_pool.page() as page:
+                # Load the page with the render profile (blocked resources, wait conditions)
+                async with limited(self.rate_limiter, current_url) as slot:
+                    response = await browser_pool.navigate(page, current_url)
+                    status = response.status if response is not None else None
+                    retry_after = response.headers.get('retry-after') if response is not None else None
+                    slot.done(status, retry_after)
+                raise_for_retry(status, retry_after)
+                if status in GONE_STATUSES:
+                    self.gone.add(current_url)
+                if status != 200:
+                    logging.error(f"Failed to load {current_url}, status code: {status}")
                     return
 
-                retry_count = 0
-                max_retries = 5
-                backoff_factor = 1
-
-                while retry_count <= max_retries:
-                    try:
-                        # Rate limiting: wait if necessary
-                        if self.use_rate_limit:
-                            async with self.lock:
-                                await asyncio.sleep(random.uniform(1 / self.rate_limit, 2 / self.rate_limit))
-
-                        async with session.get(current_url, timeout=10) as response:
-                            if response.status == 200 and 'text/html' in response.headers.get('Content-Type', ''):
-                                content = await response.text()
-                                soup = BeautifulSoup(content, 'html.parser')
-                                # Extract and enqueue new URLs
-                                for link in soup.find_all('a', href=True):
-                                    href = link['href']
-                                    full_url = urljoin(self.domain, href)
-                                    full_url = urlparse(full_url)._replace(fragment='').geturl()
-                                    if is_same_domain(self.domain, full_url) and full_url not in self.visited and full_url not in self.ignore_links:
-                                        self.urls_to_visit.append(full_url)
-                                # After processing the current URL, add it to batch_urls
-                                batch_urls.append(current_url)
-                                break  # Exit retry loop on success
-                            elif response.status == 429:
-                                if self.use_rate_limit:
-                                    retry_after = response.headers.get('Retry-After')
-                                    if retry_after:
-                                        wait_time = int(retry_after)
-                                    else:
-                                        wait_time = backoff_factor * (2 ** retry_count)
-                                    logging.warning(f"Received 429 for {current_url}, retrying after {wait_time} seconds")
-                                    await asyncio.sleep(wait_time)
-                                    retry_count += 1
-                                else:
-                                    logging.error(f"Received 429 for {current_url}, but rate limiting is disabled.")
-                                    break  # Do not retry if rate limiting is disabled
-                            else:
-                                logging.error(f"Failed to load {current_url}, status code: {response.status}")
-                                break  # Don't retry other status codes
-                    except Exception as e:
-                        logging.exception(f"Error accessing {current_url}: {e}")
-                        if self.use_rate_limit:
-                            retry_count += 1
-                            wait_time = backoff_factor * (2 ** retry_count)
-                            await asyncio.sleep(wait_time)
-                        else:
-                            break  # Do not retry if rate limiting is disabled
-                else:
-                    if self.use_rate_limit:
-                        logging.error(f"Exceeded max retries for {current_url}")
+                # Extract all links from the page
+                links = await extract_links(page, self.domain, self.url_filter) if self.harvest_links else []
+                for full_url in links:
+                    if full_url not in self.visited:
+                        self.urls_to_visit.push(full_url)
+                if self.page_store is not None:
+                    self.page_store.put(current_url, await page.content())
+                # After processing the current URL, add it to batch_urls
+                batch_urls.append(current_url)
+
+        await self.retry_policy.run(attempt, semaphore, defer=('crawl', current_url), retry_on=(PlaywrightError,))
+
+    def requeue(self, urls):
+        """
+        Crawl again URLs whose fetch was deferred.
+        """
+        for url in urls:
+            self.visited.discard(normalize_url(url))
+            self.urls_to_visit.requeue(url)
 
     async def get_next_batch_urls_pyw(self, batch_size):
         batch_urls = []
         semaphore = asyncio.Semaphore(self.concurrent_requests)
-        backoff_factor = 1
-        max_retries = 5
-
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context(user_agent='YourCrawler/1.0')
-
-            async def process_url(current_url):
-                async with semaphore:
-                    normalized_url = urlparse(current_url)._replace(fragment='').geturl()
-
-                    if normalized_url not in self.visited:
-                        self.visited.add(normalized_url)
-
-                        # Skip non-HTML URLs
-                        if not is_html_page(current_url):
-                            logging.info(f"Skipping non-HTML URL: {current_url}")
-                            return
-
-                        retry_count = 0
-
-                        while retry_count <= max_retries:
-                            try:
-                                # Rate limiting
-                                if self.use_rate_limit:
-                                    async with self.lock:
-                                        await asyncio.sleep(random.uniform(1 / self.rate_limit, 2 / self.rate_limit))
-
-                                page = await context.new_page()
-
-                                # # Block unnecessary resources to speed up loading
-                                # async def block_unnecessary_resources(route, request):
-                                #     if request.resource_type in ['image', 'media', 'font']:
-                                #         await route.continue_()
-                                #     else:
-                                #         await route.abort()
-
-                                # await page.route("**/*", block_unnecessary_resources)
-
-                                # Set a reduced timeout
-                                response = await page.goto(current_url, timeout=10000)  # 10 seconds timeout
-
-                                # Check for 429 status code
-                                if response.status == 429:
-                                    if self.use_rate_limit:
-                                        retry_after = response.headers.get('Retry-After')
-                                        if retry_after:
-                                            wait_time = int(retry_after)
-                                        else:
-                                            wait_time = backoff_factor * (2 ** retry_count)
-                                        logging.warning(f"Received 429 for {current_url}, retrying after {wait_time} seconds")
-                                        await page.close()
-                                        await asyncio.sleep(wait_time)
-                                        retry_count += 1
-                                        continue
-                                    else:
-                                        logging.error(f"Received 429 for {current_url}, but rate limiting is disabled.")
-                                        await page.close()
-                                        break  # Do not retry if rate limiting is disabled
-                                elif response.status != 200:
-                                    logging.error(f"Failed to load {current_url}, status code: {response.status}")
-                                    await page.close()
-                                    break  # Don't retry other status codes
-
-                                # Wait for the page to load necessary content
-                                await page.wait_for_selector("a", state='attached', timeout=REQUEST_TIMEOUT*1000)
-
-                                # Extract all links from the page
-                                links = await page.query_selector_all("a")
-                                for link in links:
-                                    href = await link.get_attribute("href")
-                                    if href:
-                                        full_url = urljoin(self.domain, href)
-                                        full_url = urlparse(full_url)._replace(fragment='').geturl()
-                                        if is_same_domain(self.domain, full_url) and full_url not in self.visited and full_url not in self.ignore_links:
-                                            self.urls_to_visit.append(full_url)
-                                await page.close()
-                                # After processing the current URL, add it to batch_urls
-                                batch_urls.append(current_url)
-                                break  # Exit retry loop on success
-                            except Exception as e:
-                                logging.exception(f"Error accessing {current_url}: {e}")
-                                if self.use_rate_limit:
-                                    retry_count += 1
-                                    wait_time = backoff_factor * (2 ** retry_count)
-                                    await asyncio.sleep(wait_time)
-                                else:
-                                    break  # Do not retry if rate limiting is disabled
-                        else:
-                            if self.use_rate_limit:
-                                logging.error(f"Exceeded max retries for {current_url}")
-
-            # Process URLs concurrently
-            tasks = []
-            while self.urls_to_visit and len(batch_urls) < batch_size:
-                current_url = self.urls_to_visit.pop(0)
-                tasks.append(process_url(current_url))
+        browser_pool = await self.get_browser_pool()
 
-                if len(tasks) >= self.concurrent_requests:
-                    await asyncio.gather(*tasks)
-                    tasks = []
+        async def process_url(current_url):
+            if self.claim_url(current_url):
+                await self.render_url(current_url, batch_urls, semaphore, browser_pool)
 
-            if tasks:
+        # Process URLs concurrently
+        tasks = []
+        while self.urls_to_visit and len(batch_urls) < batch_size:
+            current_url = self.urls_to_visit.pop()
+            tasks.append(process_url(current_url))
+
+            if len(tasks) >= self.concurrent_requests:
                 await asyncio.gather(*tasks)
+                tasks = []
 
-            await browser.close()
+        if tasks:
+            await asyncio.gather(*tasks)
 
         return batch_urls
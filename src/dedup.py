@@ -0,0 +1,107 @@
+import hashlib
+import os
+import re
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+# Query parameters that do not change the page
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', '_ga')
+
+# Kinds of keys in the index file
+PROCESSED_URL = 'u'
+PROCESSED_TITLE = 't'
+PRODUCT_URL = 'q'
+PRODUCT_TITLE = 'p'
+
+
+def normalize_title(title):
+    """
+    Case-insensitive title with collapsed whitespace.
+    """
+    return re.sub(r'\s+', ' ', str(title)).strip().casefold()
+
+
+def canonical_url(url):
+    """
+    URL without fragment, tracking parameters or trailing slash, with a
+    lowercase host and sorted query parameters.
+    """
+    parsed = urlparse(url.strip())
+    query = sorted((key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+                   if not key.lower().startswith(TRACKING_PARAMS))
+    path = parsed.path.rstrip('/') or '/'
+    return parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower(),
+                           path=path, query=urlencode(query), fragment='').geturl()
+
+
+def key_hash(value):
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class DedupIndex:
+    """
+    Hash index of the URLs and titles already processed and of the products
+    already saved, with O(1) lookups.
+
+    Every new key is appended to an index file next to the results, so a
+    restarted run loads the index with a single read instead of rebuilding it
+    from the Excel or text outputs.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.keys = {PROCESSED_URL: set(), PROCESSED_TITLE: set(), PRODUCT_URL: set(), PRODUCT_TITLE: set()}
+        self.loaded = os.path.exists(path)
+        if self.loaded:
+            with open(path, 'r') as f:
+                for line in f:
+                    kind, _, digest = line.strip().partition('\t')
+                    if kind in self.keys and digest:
+                        self.keys[kind].add(digest)
+
+    def add(self, entries):
+        """
+        Add keys to the index and append the new ones to the index file.
+
+        :param entries: List of (kind, url or title) tuples.
+        """
+        new_lines = []
+        for kind, value in entries:
+            digest = key_hash(canonical_url(value) if kind in (PROCESSED_URL, PRODUCT_URL) else normalize_title(value))
+            if digest not in self.keys[kind]:
+                self.keys[kind].add(digest)
+                new_lines.append(f"{kind}\t{digest}\n")
+        if new_lines:
+            with open(self.path, 'a') as f:
+                f.writelines(new_lines)
+
+    def has_processed_url(self, url):
+        return key_hash(canonical_url(url)) in self.keys[PROCESSED_URL]
+
+    def has_processed_title(self, title):
+        return key_hash(normalize_title(title)) in self.keys[PROCESSED_TITLE]
+
+    def has_product(self, title, url=None):
+        """
+        Whether a product with the same normalized title or canonical URL was already saved.
+        """
+        if key_hash(normalize_title(title)) in self.keys[PRODUCT_TITLE]:
+            return True
+        return url is not None and key_hash(canonical_url(url)) in self.keys[PRODUCT_URL]
+
+    def add_products(self, products):
+        entries = []
+        for product in products:
+            entries.append((PRODUCT_TITLE, product.get('title', '')))
+            if product.get('url'):
+                entries.append((PRODUCT_URL, product['url']))
+        self.add(entries)
+
+    def add_processed(self, urls_titles):
+        entries = []
+        for url_title in urls_titles:
+            entries.append((PROCESSED_URL, url_title['url']))
+            if url_title['title'] != "Title not found":
+                entries.append((PROCESSED_TITLE, url_title['title']))
+        self.add(entries)
+
+    def products_count(self):
+        return len(self.keys[PRODUCT_TITLE])
@@ -0,0 +1,163 @@
+import re
+from lxml import etree, html as lxml_html
+from urllib.parse import urljoin, urldefrag
+from CONFIG import IMAGE_CLASSES, TITLE_TAGS, DESCRIPTION_TAGS, PRICE_TAGS, NO_OG_IMAGE, NO_OG_DESCRIPTION, NO_OG_TITLE
+
+HEAD_END_RE = re.compile(r'</head\s*>', re.IGNORECASE)
+HEAD_END_BYTES_RE = re.compile(rb'</head\s*>', re.IGNORECASE)
+HTML_PARSER = lxml_html.HTMLParser(encoding='utf-8')
+
+META_XPATH = etree.XPath("//meta[@property=$name]/@content")
+LINKS_XPATH = etree.XPath("//a/@href")
+
+
+def class_predicate(class_name):
+    """
+    XPath predicate with the semantics of BeautifulSoup's class_ argument:
+    a single class matches any of the classes of the element, several
+    classes must match the whole attribute.
+    """
+    if not class_name:
+        return ""
+    if ' ' in class_name.strip():
+        return f"[normalize-space(@class)='{class_name.strip()}']"
+    return f"[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+
+
+def compile_tag_xpaths(entries):
+    """
+    Compile a list of {"tag", "class"} entries from CONFIG.py into XPath
+    expressions returning the first matching element, in order.
+    """
+    return [etree.XPath(f"(//{entry['tag']}{class_predicate(entry.get('class'))})[1]") for entry in entries]
+
+
+def parse_html(content):
+    """
+    Parse a page with lxml.
+
+    :param content: HTML as str or bytes (bytes are decoded with the charset declared in the page).
+    """
+    if not content or not content.strip():
+        # lxml refuses empty documents
+        content = "<html></html>"
+    if isinstance(content, str):
+        return lxml_html.fromstring(content.encode('utf-8', 'ignore'), parser=HTML_PARSER)
+    return lxml_html.fromstring(content)
+
+
+def head_prefix(content):
+    """
+    Part of a page up to the end of its <head>, or None if it is not there.
+    """
+    match = (HEAD_END_RE if isinstance(content, str) else HEAD_END_BYTES_RE).search(content)
+    if match is None:
+        return None
+    return content[:match.end()]
+
+
+def element_text(element, strip_pieces=False):
+    if strip_pieces:
+        return "".join(piece.strip() for piece in element.itertext())
+    return "".join(element.itertext()).strip()
+
+
+class HtmlExtractor:
+    """
+    Title and product details extraction with lxml and XPath expressions
+    compiled once from TITLE_TAGS, DESCRIPTION_TAGS, PRICE_TAGS and
+    IMAGE_CLASSES.
+
+    Open Graph meta tags are read from the <head> alone when possible, so
+    most titles never parse the body. The results match the BeautifulSoup
+    functions of the fetcher.
+    """
+    def __init__(self, title_tags=TITLE_TAGS, description_tags=DESCRIPTION_TAGS,
+                 price_tags=PRICE_TAGS, image_classes=IMAGE_CLASSES):
+        self.title_xpaths = compile_tag_xpaths(title_tags)
+        self.description_xpaths = compile_tag_xpaths(description_tags)
+        self.price_xpaths = compile_tag_xpaths(price_tags)
+        self.image_xpaths = compile_tag_xpaths([{"tag": "img", "class": image_class} for image_class in image_classes])
+
+    def meta(self, tree, name):
+        values = META_XPATH(tree, name=name)
+        return values[0] if values else None
+
+    def first_text(self, tree, xpaths, strip_pieces=False):
+        for xpath in xpaths:
+            elements = xpath(tree)
+            if elements:
+                text = element_text(elements[0], strip_pieces)
+                if text or strip_pieces:
+                    return text
+        return None
+
+    def title(self, content):
+        """
+        :param content: Page HTML, str or bytes.
+        :return: The title, or None if it was not found.
+        """
+        tree = None
+        if not NO_OG_TITLE:
+            # og:title is in the head, only that part is parsed when it is complete
+            prefix = head_prefix(content)
+            if prefix is None:
+                tree = parse_html(content)
+            title = self.meta(tree if tree is not None else parse_html(prefix), "og:title")
+            if title:
+                return title
+        if tree is None:
+            tree = parse_html(content)
+        return self.first_text(tree, self.title_xpaths, strip_pieces=True)
+
+    def details(self, content):
+        """
+        :param content: Page HTML, str or bytes.
+        :return: A dictionary with 'image', 'description', and 'price'.
+        """
+        tree = parse_html(content)
+
+        image = None
+        if not NO_OG_IMAGE:
+            image = (self.meta(tree, "og:image") or "").strip() or None
+        if not image:
+            for xpath in self.image_xpaths:
+                elements = xpath(tree)
+                if elements:
+                    image = (elements[0].get("src") or "").strip()
+                    if image:
+                        break
+            else:
+                image = "Image not found"
+
+        description = None
+        if not NO_OG_DESCRIPTION:
+            description = (self.meta(tree, "og:description") or "").strip() or None
+        if not description:
+            description = self.first_text(tree, self.description_xpaths) or "Description not found"
+
+        price = self.first_text(tree, self.price_xpaths)
+        if price is None:
+            price = "Price not found"
+        else:
+            # Format price
+            formatted_price = price.replace("€", "").replace(",", ".").strip()
+            try:
+                price = f"{float(formatted_price):.2f}€"
+            except ValueError:
+                pass
+
+        return {"image": image, "description": description, "price": price}
+
+
+def html_links(content, base_url):
+    """
+    Absolute URLs without fragment of the links of a page.
+    """
+    links = []
+    for href in LINKS_XPATH(parse_html(content)):
+        links.append(urldefrag(urljoin(base_url, href.strip()))[0])
+    return links
+
+
+EXTRACTOR = HtmlExtractor()
@@ -1,99 +1,131 @@
 import asyncio
 import logging
 import time
-from bs4 import BeautifulSoup
 import aiohttp
-from CONFIG import IMAGE_CLASSES, TITLE_TAGS, DESCRIPTION_TAGS, PRICE_TAGS, NO_OG_IMAGE, NO_OG_DESCRIPTION, NO_OG_TITLE, REQUEST_TIMEOUT
+from src.http_client import client_session
+from src.parse_pool import run_parser, parse_title, parse_details
+from src.retry import RetryPolicy, raise_for_retry
+from CONFIG import NO_OG_TITLE, REQUEST_TIMEOUT
 import re
 
 
-async def fetch_title(session, url, semaphore, max_retries=3):
+STREAM_CHUNK_SIZE = 16 * 1024
+HEAD_END_RE = re.compile(rb'</head\s*>', re.IGNORECASE)
+OG_TITLE_RE = re.compile(rb'<meta\s[^>]*og:title[^>]*>', re.IGNORECASE)
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+
+async def read_head(response, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Read the body of a response in chunks until the og:title meta tag or the
+    end of the <head> arrives.
+
+    :return: (bytes read, whether the whole body was read)
     """
-    Asynchronously fetch the title of a web page, with retries on timeout.
+    data = bytearray()
+    async for chunk in response.content.iter_chunked(chunk_size):
+        # A tag may be split between chunks
+        start = max(0, len(data) - 1024)
+        data += chunk
+        if OG_TITLE_RE.search(data, start) or HEAD_END_RE.search(data, start):
+            return bytes(data), response.content.at_eof()
+    return bytes(data), True
+
+
+def decode_html(response, data):
+    """
+    Decode a body with the charset of the Content-Type header, or of the
+    <meta> tag of the page, or UTF-8.
+    """
+    charset = response.charset
+    if not charset:
+        match = META_CHARSET_RE.search(data, 0, 4096)
+        charset = match.group(1).decode('ascii') if match else 'utf-8'
+    try:
+        return data.decode(charset, errors='replace')
+    except LookupError:
+        return data.decode('utf-8', errors='replace')
+
+
+async def fetch_title(session, url, semaphore, page_store=None, parse_pool=None, retry_policy=None):
+    """
+    Asynchronously fetch the title of a web page, with retries.
 
     :param session: The aiohttp client session.
     :param url: The URL to fetch.
     :param semaphore: Semaphore to limit concurrent requests.
-    :param max_retries: Maximum number of retries on timeout.
-    :return: A dictionary with 'url' and 'title'.
+    :param page_store: Optional PageStore with the HTML already downloaded by the crawler.
+    :param parse_pool: Optional ParsePool to parse the page off the event loop.
+    :param retry_policy: RetryPolicy of the run. Failed URLs are deferred as ('fetch', url).
+    :return: A dictionary with 'url' and 'title', or None if the page could not be fetched.
     """
-    async with semaphore:
-        # Remove the initial fixed delay as we handle delays during retries
-        # await asyncio.sleep(0.5)
-        for attempt in range(1, max_retries + 1):
-            try:
-                # Custom headers to mimic a real browser
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
-                                  'AppleWebKit/537.36 (KHTML, like Gecko) '
-                                  'Chrome/85.0.4183.83 Safari/537.36',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                    'Connection': 'keep-alive'
-                }
-                timeout = aiohttp.ClientTimeout(total=5)  # Total timeout of 5 seconds
-
-                async with session.get(url, timeout=timeout, headers=headers) as response:
-                    if response.status != 200:
-                        return {'url': url, 'title': f"Status code: {response.status}"}
-
-                    content = await response.text()
-
-                    # Parse the HTML content efficiently
-                    soup = BeautifulSoup(content, 'lxml')
-
-                    # Try to extract the Open Graph title
+    # Reuse the page downloaded by the crawler if available
+    if page_store is not None:
+        content = page_store.get(url)
+        if content is not None:
+            title = await run_parser(parse_pool, parse_title, content)
+            return {'url': url, 'title': "Title not found" if not title else title}
+
+    async def attempt():
+        timeout = aiohttp.ClientTimeout(total=5)  # Total timeout of 5 seconds
+
+        async with session.get(url, timeout=timeout) as response:
+            raise_for_retry(response.status, response.headers.get('Retry-After'))
+            if response.status != 200:
+                return {'url': url, 'title': f"Status code: {response.status}"}
+
+            title = None
+            if NO_OG_TITLE:
+                # The title tags are in the body
+                content = decode_html(response, await response.read())
+            else:
+                # Stop reading as soon as og:title or the end of the head arrives
+                data, complete = await read_head(response)
+                content = decode_html(response, data)
+                title = await run_parser(parse_pool, parse_title, content)
+                if title and not complete:
+                    # Drop the connection instead of downloading the rest of the page
+                    response.close()
+                    return {'url': url, 'title': title}
+                if not complete:
+                    # No og:title, the title tags are in the body
+                    content = decode_html(response, data + await response.read())
                     title = None
-                    if not NO_OG_TITLE:
-                        og_title = soup.find("meta", property="og:title")
-                        if og_title and og_title.get("content"):
-                            title = og_title.get("content")
-
-                    # try other title tags
-                    if not title:
-                        # Iterate through each specified tag and attribute in TITLE_TAGS
-                        for entry in TITLE_TAGS:
-                            # Use ** to unpack dictionary entries as keyword arguments
-                            title = soup.find(entry["tag"], class_=entry.get("class"))
-                            if title:
-                                # Extract text and strip any excess whitespace
-                                title = title.get_text(strip=True)
-                                break
-
-                    return {'url': url, 'title': "Title not found" if not title else title}
-            except asyncio.TimeoutError:
-                logging.warning(f"Attempt {attempt}: Timed out fetching {url}")
-                if attempt < max_retries:
-                    # Exponential backoff delay
-                    delay = 2 ** attempt  # e.g., 2, 4, 8 seconds
-                    logging.info(f"Retrying {url} in {delay} seconds...")
-                    await asyncio.sleep(delay)
-                else:
-                    logging.error(f"Failed to fetch {url} after {max_retries} attempts due to timeout.")
-                    return None
-            except Exception as e:
-                #logging.exception(f"Attempt {attempt}: Error fetching title from {url}: {e}")
-                return None
-            
+
+        # Keep the page for the product details extraction
+        if page_store is not None:
+            page_store.put(url, content)
+
+        if not title:
+            title = await run_parser(parse_pool, parse_title, content)
+
+        return {'url': url, 'title': "Title not found" if not title else title}
+
+    retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+    return await retry_policy.run(attempt, semaphore, defer=('fetch', url))
+
 def format_title(title):
     if not title:
         return None
     title = re.split(r'\s[-|]\s', title)[0]
     return title
 
-async def fetch_titles(urls, max_concurrent_requests=10):
+async def fetch_titles(urls, max_concurrent_requests=10, page_store=None, client=None, parse_pool=None, retry_policy=None):
     """
     Asynchronously fetch titles for a list of URLs.
 
     :param urls: List of URLs to fetch titles from.
     :param max_concurrent_requests: Maximum number of concurrent requests.
+    :param page_store: Optional PageStore with the HTML already downloaded by the crawler.
+    :param client: Shared HttpClient of the run. A temporary one is used if not given.
+    :param parse_pool: Optional ParsePool to parse the pages off the event loop.
+    :param retry_policy: Optional RetryPolicy shared by the run.
     :return: List of dictionaries with 'url' and 'title'.
     """
     semaphore = asyncio.Semaphore(max_concurrent_requests)
-    connector = aiohttp.TCPConnector(limit_per_host=max_concurrent_requests)
 
-    async with aiohttp.ClientSession(connector=connector) as session:
-        tasks = [fetch_title(session, url, semaphore) for url in urls]
+    async with client_session(client) as session:
+        tasks = [fetch_title(session, url, semaphore, page_store=page_store, parse_pool=parse_pool, retry_policy=retry_policy) for url in urls]
         results = await asyncio.gather(*tasks)
 
     # Manage Exceptions and remove urls with duplicated titles
@@ -115,76 +147,19 @@ async def fetch_titles(urls, max_concurrent_requests=10):
 
     return filtered_results
 
-def fetch_product_details_from_soup(soup):
+def build_product(url, title, details):
     """
-    Fetch product details from BeautifulSoup object.
-
-    :param soup: BeautifulSoup object.
-    :return: A dictionary with 'image', 'description', and 'price'.
+    Build the product dictionary from the details of a product page.
     """
-
-    # Extract image URL
-    image = None
-    if not NO_OG_IMAGE:
-        meta_image = soup.find("meta", property="og:image")
-        if meta_image:
-            image = meta_image.get("content", "").strip()
-
-    if not image:
-        for img_class in IMAGE_CLASSES:
-            img_tag = soup.find("img", class_=img_class)
-            if img_tag:
-                image = img_tag.get("src", "").strip()
-                if image:
-                    break
-        else:
-            image = "Image not found"
-
-    # Extract description
-    description = None
-    if not NO_OG_DESCRIPTION:
-        meta_description = soup.find("meta", property="og:description")
-        if meta_description:
-            description = meta_description.get("content", "").strip()
-
-    if not description:
-        for desc_tag in DESCRIPTION_TAGS:
-            tag = soup.find(desc_tag["tag"], class_=desc_tag["class"])
-            if tag:
-                description = tag.get_text().strip()
-                if description:
-                    break
-        else:
-            description = "Description not found"
-
-    # Extract price
-    price = None
-    for price_tag in PRICE_TAGS:
-        tag = soup.find(price_tag["tag"], class_=price_tag["class"])
-        if tag:
-            price = tag.get_text().strip()
-            if price:
-                break
-    else:
-        price = "Price not found"
-
-    if price != "Price not found":
-        # Format price
-        formatted_price = price.replace("€", "").replace(",", ".").strip()
-        try:
-            price_value = float(formatted_price)
-            formatted_price = f"{price_value:.2f}€"
-            price = formatted_price
-        except ValueError:
-            pass
-
     return {
-        "image": image,
-        "description": description,
-        "price": price
+        "url": url,
+        "title": title,
+        "image": details["image"],
+        "description": details["description"],
+        "price": details["price"]
     }
 
-async def fetch_details(session, url, title, semaphore):
+async def fetch_details(session, url, title, semaphore, page_store=None, parse_pool=None, retry_policy=None):
     """
     Asynchronously fetch product details for a URL.
 
@@ -192,61 +167,53 @@ async def fetch_details(session, url, title, semaphore):
     :param url: The URL to fetch.
     :param title: The title of the product.
     :param semaphore: Semaphore to limit concurrent requests.
+    :param page_store: Optional PageStore with the HTML already downloaded by the crawler.
+    :param parse_pool: Optional ParsePool to parse the page off the event loop.
+    :param retry_policy: RetryPolicy of the run. Failed URLs are deferred as ('fetch', url).
     :return: A dictionary with 'url', 'title', and 'details'.
     """
-    async with semaphore:
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
-                              'AppleWebKit/537.36 (KHTML, like Gecko) '
-                              'Chrome/85.0.4183.83 Safari/537.36',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Connection': 'keep-alive'
-            }
-            timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)  # Total timeout of 5 seconds
-
-            async with session.get(url, timeout=timeout, headers=headers) as response:
-                if response.status != 200:
-                    logging.error(f"Failed to fetch {url}, status code: {response.status}")
-                    return None
-
-                content = await response.text()
-
-                # Parse the HTML content efficiently
-                soup = BeautifulSoup(content, 'lxml')
-
-                details = fetch_product_details_from_soup(soup)
-
-                #logging.info(f"Fetched details for {url}: {details}")
-
-                return {
-                    "url": url,
-                    "title": title,
-                    "image": details["image"],
-                    "description": details["description"],
-                    "price": details["price"]
-                }
-
-        except Exception as e:
-            logging.error(f"Error fetching details for {url}: {e}")
-            return None
-
-async def fetch_product_details(urls_titles, max_concurrent_requests=10):
+    # Reuse the page downloaded by the crawler if available
+    if page_store is not None:
+        content = page_store.get(url)
+        if content is not None:
+            return build_product(url, title, await run_parser(parse_pool, parse_details, content))
+
+    async def attempt():
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+
+        async with session.get(url, timeout=timeout) as response:
+            raise_for_retry(response.status, response.headers.get('Retry-After'))
+            if response.status != 200:
+                logging.error(f"Failed to fetch {url}, status code: {response.status}")
+                return None
+
+            content = await response.text()
+
+        #logging.info(f"Fetched details for {url}: {details}")
+
+        return build_product(url, title, await run_parser(parse_pool, parse_details, content))
+
+    retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+    return await retry_policy.run(attempt, semaphore, defer=('fetch', url))
+
+async def fetch_product_details(urls_titles, max_concurrent_requests=10, page_store=None, client=None, parse_pool=None, retry_policy=None):
     """
     Asynchronously fetch product details for a list of URLs.
 
     :param urls_titles: List of dictionaries with 'url' and 'title'.
     :param max_concurrent_requests: Maximum number of concurrent requests.
+    :param page_store: Optional PageStore with the HTML already downloaded by the crawler.
+    :param client: Shared HttpClient of the run. A temporary one is used if not given.
+    :param parse_pool: Optional ParsePool to parse the pages off the event loop.
+    :param retry_policy: Optional RetryPolicy shared by the run.
     :return: List of dictionaries with 'url', 'title', and 'details'.
     """
     semaphore = asyncio.Semaphore(max_concurrent_requests)
-    connector = aiohttp.TCPConnector(limit_per_host=max_concurrent_requests)
 
-    async with aiohttp.ClientSession(connector=connector) as session:
+    async with client_session(client) as session:
         tasks = []
         for url_titles in urls_titles:
-            tasks.append(fetch_details(session, url_titles["url"], url_titles["title"], semaphore))
+            tasks.append(fetch_details(session, url_titles["url"], url_titles["title"], semaphore, page_store=page_store, parse_pool=parse_pool, retry_policy=retry_policy))
         results = await asyncio.gather(*tasks)
 
         logging.info(f"Found {len(results)} product details")
@@ -264,7 +231,7 @@ if __name__ == "__main__":
         logging.basicConfig(level=logging.INFO)
 
         # Single URL title fetching
-        async with aiohttp.ClientSession() as session:
+        async with client_session() as session:
             semaphore = asyncio.Semaphore(1)  # Only one request at a time
             title_result = await fetch_title(session, test_url, semaphore)
             print(f"Fetched title for {test_url}: {title_result}")
@@ -0,0 +1,70 @@
+from collections import deque
+from src.pages import normalize_url
+
+
+class Frontier:
+    """
+    FIFO queue of URLs waiting to be crawled.
+
+    Every URL is enqueued at most once per run: the normalized URLs that have
+    ever been pushed are kept in a set, so pushes and pops are O(1) and
+    duplicates are rejected instead of growing the queue.
+    """
+    def __init__(self, urls=()):
+        self.queue = deque()
+        self.enqueued = set()
+        self.in_flight = []  # URLs popped by the batch being crawled
+        self.duplicates_rejected = 0
+        for url in urls:
+            self.push(url)
+
+    def push(self, url):
+        """
+        Enqueue a URL unless it was already enqueued.
+
+        :return: True if the URL was added.
+        """
+        key = normalize_url(url)
+        if key in self.enqueued:
+            self.duplicates_rejected += 1
+            return False
+        self.enqueued.add(key)
+        self.queue.append(url)
+        return True
+
+    def requeue(self, url):
+        """
+        Enqueue again a URL that was already popped (e.g. a deferred retry).
+        """
+        self.enqueued.add(normalize_url(url))
+        self.queue.append(url)
+
+    def pop(self):
+        url = self.queue.popleft()
+        self.in_flight.append(url)
+        return url
+
+    def commit(self):
+        """
+        Forget the URLs popped so far: their batch was crawled.
+        """
+        self.in_flight = []
+
+    def state(self):
+        # URLs of an unfinished batch are crawled again after a resume
+        return {'queue': self.in_flight + list(self.queue), 'enqueued': list(self.enqueued)}
+
+    def restore(self, state):
+        self.queue = deque(state['queue'])
+        self.enqueued = set(state['enqueued'])
+        self.in_flight = []
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __contains__(self, url):
+        return normalize_url(url) in self.enqueued
+
+    def report(self):
+        return (f"{len(self.queue)} URLs queued, {len(self.enqueued)} enqueued in total, "
+                f"{self.duplicates_rejected} duplicates rejected")
@@ -0,0 +1,334 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from multidict import CIMultiDict
+from CONFIG import HTTP_CACHE_MODE, HTTP_CACHE_MAX_MB
+
+# Response headers kept with the cached bodies
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+# Stores committed to the index at once (and between evictions)
+COMMIT_EVERY = 100
+
+
+class CacheMiss(Exception):
+    """
+    Raised in offline mode for a URL that is not cached. Unlike a 504, the
+    retry policy does not retry it.
+    """
+    def __init__(self, url):
+        super().__init__(f"{url} is not in the HTTP cache")
+        self.url = url
+
+
+class CachedContent:
+    """
+    Stand-in for aiohttp's StreamReader over a body read from the cache.
+    """
+    def __init__(self, body):
+        self.body = body
+        self.position = 0
+
+    async def iter_chunked(self, chunk_size):
+        while self.position < len(self.body):
+            chunk = self.body[self.position:self.position + chunk_size]
+            self.position += len(chunk)
+            yield chunk
+
+    async def read(self):
+        chunk = self.body[self.position:]
+        self.position = len(self.body)
+        return chunk
+
+    def at_eof(self):
+        return self.position >= len(self.body)
+
+
+class StoringContent:
+    """
+    aiohttp StreamReader that keeps a copy of the chunks the caller reads,
+    so the body can be stored once the caller read all of it.
+    """
+    def __init__(self, content):
+        self.content = content
+        self.chunks = []
+        self.complete = False  # The whole body went through this reader
+
+    async def iter_chunked(self, chunk_size):
+        async for chunk in self.content.iter_chunked(chunk_size):
+            self.chunks.append(chunk)
+            # Before the caller can stop on the last chunk and close the response
+            self.complete = self.content.at_eof()
+            yield chunk
+        self.complete = True
+
+    async def read(self):
+        chunk = await self.content.read()
+        self.chunks.append(chunk)
+        self.complete = True
+        return chunk
+
+    def at_eof(self):
+        return self.content.at_eof()
+
+    @property
+    def body(self):
+        return b''.join(self.chunks)
+
+
+class CachedResponse:
+    """
+    Response with the body already in memory, with the parts of the aiohttp
+    ClientResponse interface used by the crawler and the fetcher.
+    """
+    def __init__(self, url, status, headers, body, from_cache=False):
+        self.url = url
+        self.status = status
+        self.headers = CIMultiDict(headers)
+        self.content = CachedContent(body)
+        self.from_cache = from_cache
+
+    @property
+    def charset(self):
+        content_type = self.headers.get('Content-Type', '')
+        for parameter in content_type.split(';')[1:]:
+            name, _, value = parameter.strip().partition('=')
+            if name.lower() == 'charset':
+                return value.strip('"\' ').lower()
+        return None
+
+    async def read(self):
+        # Like aiohttp, read() returns what iter_chunked has not consumed yet
+        return await self.content.read()
+
+    async def text(self, encoding=None, errors='replace'):
+        body = self.content.body
+        try:
+            return body.decode(encoding or self.charset or 'utf-8', errors=errors)
+        except LookupError:
+            return body.decode('utf-8', errors=errors)
+
+    def close(self):
+        pass
+
+    def release(self):
+        pass
+
+
+class StoringResponse(CachedResponse):
+    """
+    Response streamed from the network, copied to the cache as it is read.
+
+    A caller that stops early (e.g. once the <head> of the page arrived)
+    closes the response as usual and nothing is stored.
+    """
+    def __init__(self, url, response):
+        super().__init__(url, response.status, response.headers, b'')
+        self.response = response
+        self.content = StoringContent(response.content)
+
+    async def text(self, encoding=None, errors='replace'):
+        await self.content.read()
+        return await super().text(encoding, errors)
+
+    def close(self):
+        self.response.close()
+
+    def release(self):
+        self.response.release()
+
+
+class HttpCache:
+    """
+    On-disk cache of HTTP responses with conditional revalidation.
+
+    Bodies are stored gzip-compressed next to a SQLite index with their ETag,
+    Last-Modified and Content-Type. Modes:
+
+        "revalidate"  send If-None-Match / If-Modified-Since and serve 304s from disk
+        "offline"     never touch the network, serve only what is cached (CacheMiss otherwise)
+        "off"         no cache
+
+    The bodies are capped to max_bytes, evicting the least recently used first.
+    The index queries and the body reads and writes run on worker threads
+    (the *_async methods), which share the index under a lock; it is
+    committed every COMMIT_EVERY stores.
+    """
+    def __init__(self, folder, mode=HTTP_CACHE_MODE, max_bytes=HTTP_CACHE_MAX_MB * 1024 * 1024):
+        self.folder = folder
+        self.mode = mode
+        self.max_bytes = max_bytes
+
+        self.revalidated = 0  # 304 answers served from disk
+        self.not_modified = set()  # URLs answered with a 304 in this run
+        self.replayed = 0     # Responses served from disk without a request (offline)
+        self.stored = 0       # Full responses written to the cache
+        self.uncommitted = 0  # Stores not committed to the index yet
+        self.misses = 0       # Offline requests that were not cached
+        self.bytes_saved = 0  # Body bytes not downloaded thanks to the cache
+
+        os.makedirs(folder, exist_ok=True)
+        # Used by the worker threads of the *_async methods, one at a time
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(folder, 'index.sqlite'), check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                headers TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.connection.commit()
+
+    def body_path(self, url):
+        return os.path.join(self.folder, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.gz')
+
+    def lookup(self, url):
+        """
+        :return: The cached headers of a URL, or None if it is not cached.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT headers FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None or not os.path.exists(self.body_path(url)):
+            return None
+        return json.loads(row[0])
+
+    def response(self, url, headers):
+        """
+        Build a response from the cached body of a URL.
+        """
+        with open(self.body_path(url), 'rb') as f:
+            body = gzip.decompress(f.read())
+        with self.lock:
+            self.connection.execute("UPDATE responses SET accessed = ? WHERE url = ?", (time.time(), url))
+            self.bytes_saved += len(body)
+        return CachedResponse(url, 200, headers, body, from_cache=True)
+
+    async def lookup_async(self, url):
+        return await asyncio.to_thread(self.lookup, url)
+
+    async def response_async(self, url, headers):
+        """
+        response() on a worker thread, so the read and the decompression do not block the event loop.
+        """
+        return await asyncio.to_thread(self.response, url, headers)
+
+    def store(self, url, headers, body):
+        headers = {name: headers[name] for name in STORED_HEADERS if name in headers}
+        compressed = gzip.compress(body, compresslevel=6)
+        with open(self.body_path(url), 'wb') as f:
+            f.write(compressed)
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (url, json.dumps(headers), len(compressed), now, now),
+            )
+            self.stored += 1
+            self.uncommitted += 1
+            if self.uncommitted >= COMMIT_EVERY:
+                self.evict()
+
+    async def store_async(self, url, headers, body):
+        """
+        store() on a worker thread, so the compression and the writes do not block the event loop.
+        """
+        headers = {name: headers[name] for name in STORED_HEADERS if name in headers}
+        await asyncio.to_thread(self.store, url, headers, body)
+
+    def evict(self):
+        """
+        Delete the least recently used bodies until the cache fits in max_bytes,
+        and commit the index. Called with the lock held.
+        """
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            rows = self.connection.execute("SELECT url, size FROM responses ORDER BY accessed").fetchall()
+            evicted = []
+            for url, size in rows:
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(self.body_path(url))
+                except FileNotFoundError:
+                    pass
+                evicted.append((url,))
+                total -= size
+            self.connection.executemany("DELETE FROM responses WHERE url = ?", evicted)
+            logging.info(f"HTTP cache: evicted {len(evicted)} responses")
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        with self.lock:
+            self.evict()
+            self.connection.close()
+
+    def report(self):
+        return (f"{self.revalidated} revalidated (304), {self.replayed} replayed offline, {self.stored} stored, "
+                f"{self.misses} offline misses, {self.bytes_saved / 1024 / 1024:.1f} MB not downloaded")
+
+
+class CachedSession:
+    """
+    Wraps an aiohttp ClientSession so that every GET goes through an HttpCache.
+
+    Successful responses are streamed to the callers as a StoringResponse and
+    stored if they read the whole body, so the offline mode can replay them.
+    Only the ones with an ETag or a Last-Modified are revalidated; the others
+    are downloaded again in revalidate mode. Other responses are passed
+    through.
+    """
+    def __init__(self, session, cache):
+        self.session = session
+        self.cache = cache
+
+    @property
+    def closed(self):
+        return self.session.closed
+
+    async def close(self):
+        await self.session.close()
+
+    @asynccontextmanager
+    async def get(self, url, headers=None, **kwargs):
+        url = str(url)
+        cached_headers = await self.cache.lookup_async(url)
+
+        if self.cache.mode == "offline":
+            if cached_headers is None:
+                self.cache.misses += 1
+                raise CacheMiss(url)
+            else:
+                self.cache.replayed += 1
+                yield await self.cache.response_async(url, cached_headers)
+            return
+
+        headers = dict(headers or {})
+        if cached_headers is not None:
+            if 'ETag' in cached_headers:
+                headers['If-None-Match'] = cached_headers['ETag']
+            if 'Last-Modified' in cached_headers:
+                headers['If-Modified-Since'] = cached_headers['Last-Modified']
+
+        async with self.session.get(url, headers=headers, **kwargs) as response:
+            if response.status == 304 and cached_headers is not None:
+                self.cache.revalidated += 1
+                self.cache.not_modified.add(url)
+                yield await self.cache.response_async(url, cached_headers)
+            elif response.status == 200:
+                storing_response = StoringResponse(url, response)
+                yield storing_response
+                if storing_response.content.complete:
+                    await self.cache.store_async(url, response.headers, storing_response.content.body)
+            else:
+                yield response
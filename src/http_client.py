@@ -0,0 +1,120 @@
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+import aiohttp
+from src.http_cache import CachedSession
+from src.rate_limiter import RateLimitedSession
+from CONFIG import HTTP_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT
+
+# Custom headers to mimic a real browser
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+                  'AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/85.0.4183.83 Safari/537.36',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Connection': 'keep-alive'
+}
+
+
+class HttpClient:
+    """
+    Long-lived aiohttp session shared by the crawler and the fetcher.
+
+    It is created once per run so keep-alive connections, DNS lookups and TLS
+    sessions are reused between batches. Connection reuse and the latency to
+    the response headers are measured through aiohttp trace hooks. With a RateLimiter every GET waits for its host
+    limiter, and with an HttpCache it goes through the cache first.
+    """
+    def __init__(self, limit=HTTP_LIMIT, limit_per_host=HTTP_LIMIT_PER_HOST,
+                 dns_cache_ttl=HTTP_DNS_CACHE_TTL, keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT, cache=None, rate_limiter=None):
+        self.limit = limit                          # Max open connections
+        self.limit_per_host = limit_per_host        # Max open connections per host
+        self.dns_cache_ttl = dns_cache_ttl          # Seconds to keep resolved hosts
+        self.keepalive_timeout = keepalive_timeout  # Seconds to keep idle connections open
+        self.cache = cache                          # Optional HttpCache
+        self.rate_limiter = rate_limiter            # Optional RateLimiter
+        self.session = None
+
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.latencies = deque(maxlen=10000)  # Seconds to the response headers of the last requests
+
+    async def start(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self.on_request_start)
+        trace_config.on_request_end.append(self.on_request_end)
+        trace_config.on_connection_create_end.append(self.on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self.on_connection_reuseconn)
+
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+            enable_cleanup_closed=True,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=DEFAULT_HEADERS,
+            trace_configs=[trace_config],
+        )
+        if self.rate_limiter is not None:
+            self.session = RateLimitedSession(self.session, self.rate_limiter)
+        if self.cache is not None:
+            self.session = CachedSession(self.session, self.cache)
+        return self
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def on_request_start(self, session, context, params):
+        self.requests += 1
+        context.start_time = time.monotonic()
+
+    async def on_request_end(self, session, context, params):
+        self.latencies.append(time.monotonic() - context.start_time)
+
+    def latency_percentile(self, percentile):
+        """
+        :return: Seconds to the response headers at a percentile (0-100) of the last requests.
+        """
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return 0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    async def on_connection_create_end(self, session, context, params):
+        self.new_connections += 1
+
+    async def on_connection_reuseconn(self, session, context, params):
+        self.reused_connections += 1
+
+    def report(self):
+        connections = self.new_connections + self.reused_connections
+        reuse_rate = self.reused_connections / connections * 100 if connections else 0
+        return (f"{self.requests} requests, {self.new_connections} new connections, "
+                f"{self.reused_connections} reused ({reuse_rate:.1f}% reuse), "
+                f"latency p50 {self.latency_percentile(50) * 1000:.0f} ms, p95 {self.latency_percentile(95) * 1000:.0f} ms")
+
+
+@asynccontextmanager
+async def client_session(client=None):
+    """
+    Yield the session of the shared client, or of a temporary client when
+    none is given (scripts that call the fetcher directly).
+    """
+    if client is not None:
+        yield client.session
+    else:
+        async with HttpClient() as temporary_client:
+            yield temporary_client.session
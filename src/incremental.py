@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import re
+from src.dedup import canonical_url
+
+# Files of an execution folder read by the next incremental execution
+INVENTORY_FILE = 'inventory.jsonl'
+CATALOG_FILE = 'catalog.jsonl'
+DELTA_FILE = 'delta.json'
+
+
+def read_jsonl(path):
+    records = []
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Last line of an interrupted write
+                    logging.warning(f"Skipping invalid line in {path}")
+    return records
+
+
+def write_jsonl(path, records):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+def find_previous_execution(domain_folder, execution_number):
+    """
+    Latest execution before execution_number that processed URLs.
+
+    :return: The folder of that execution, or None.
+    """
+    if not os.path.isdir(domain_folder):
+        return None
+    numbers = []
+    for name in os.listdir(domain_folder):
+        match = re.fullmatch(r'execution_(\d+)', name)
+        if match and int(match.group(1)) < execution_number:
+            numbers.append(int(match.group(1)))
+    for number in sorted(numbers, reverse=True):
+        folder = os.path.join(domain_folder, f'execution_{number}')
+        if any(os.path.exists(os.path.join(folder, name)) for name in (INVENTORY_FILE, 'processed_urls.txt')):
+            return folder
+    return None
+
+
+def load_inventory(folder):
+    """
+    URL inventory of an execution: canonical URL -> {'url', 'title', 'lastmod', 'product'}.
+
+    Executions made before the incremental mode have no inventory file; it
+    is rebuilt from their processed URLs and products (without lastmod).
+    """
+    inventory = {}
+    if os.path.exists(os.path.join(folder, INVENTORY_FILE)):
+        for record in read_jsonl(os.path.join(folder, INVENTORY_FILE)):
+            inventory[canonical_url(record['url'])] = record
+        return inventory
+
+    processed_urls_file = os.path.join(folder, 'processed_urls.txt')
+    if os.path.exists(processed_urls_file):
+        with open(processed_urls_file, 'r') as f:
+            for line in f:
+                title, _, url = line.strip().rpartition(': ')
+                if url:
+                    inventory[canonical_url(url)] = {'url': url, 'title': title, 'lastmod': None, 'product': False}
+    for product in read_jsonl(os.path.join(folder, 'products.jsonl')):
+        record = inventory.setdefault(canonical_url(product['url']), {'url': product['url'], 'title': product['title'], 'lastmod': None})
+        record['product'] = True
+    return inventory
+
+
+def load_catalog(folder):
+    """
+    Products of an execution: its merged catalog, or its products if it was not incremental.
+
+    :return: Dictionary of canonical URL -> product.
+    """
+    path = os.path.join(folder, CATALOG_FILE)
+    if not os.path.exists(path):
+        path = os.path.join(folder, 'products.jsonl')
+    return {canonical_url(product['url']): product for product in read_jsonl(path)}
+
+
+class IncrementalState:
+    """
+    What the previous execution saw, and what changed since then.
+
+    A page is unchanged when its sitemap lastmod is the same as in the
+    previous execution (the page is not even downloaded) or when the HTTP
+    cache got a 304 for it. Unchanged pages keep their previous title and
+    product, so they skip the title fetch, the LLM and the details fetch.
+    Only the new or changed pages go through the pipeline; at the end the
+    previous catalog is merged with their products.
+    """
+    def __init__(self, previous_folder, http_cache=None):
+        self.previous_folder = previous_folder
+        self.http_cache = http_cache
+        self.previous = load_inventory(previous_folder) if previous_folder else {}
+        self.previous_catalog = load_catalog(previous_folder) if previous_folder else {}
+
+        self.inventory = {}             # Canonical URL -> record of this execution
+        self.products = {}              # Canonical URL -> product extracted in this execution
+        self.unchanged_by_lastmod = set()
+        self.carried = 0                # Unchanged URLs that skipped the pipeline
+
+    def seed_urls(self):
+        """
+        URLs of the previous inventory to revalidate, previous products first.
+        """
+        records = sorted(self.previous.values(), key=lambda record: not record.get('product'))
+        return [record['url'] for record in records if canonical_url(record['url']) not in self.unchanged_by_lastmod]
+
+    def skip_by_lastmod(self, sitemap_lastmod):
+        """
+        Find the sitemap URLs whose lastmod did not change and keep their previous records.
+
+        :param sitemap_lastmod: Dictionary of the sitemap URLs of this execution and their lastmod.
+        :return: The unchanged URLs, which do not need to be downloaded.
+        """
+        unchanged = []
+        for url, lastmod in sitemap_lastmod.items():
+            key = canonical_url(url)
+            previous = self.previous.get(key)
+            if lastmod and previous is not None and previous.get('lastmod') == lastmod:
+                self.unchanged_by_lastmod.add(key)
+                self.inventory[key] = previous
+                unchanged.append(url)
+        self.carried += len(unchanged)
+        return unchanged
+
+    def split_unchanged(self, urls, sitemap_lastmod=None):
+        """
+        Separate the crawled URLs answered with a 304 and already known from the rest.
+
+        The unchanged ones keep their previous record and leave the pipeline here.
+
+        :return: (URLs to process, previous records of the unchanged URLs)
+        """
+        not_modified = self.http_cache.not_modified if self.http_cache is not None else ()
+        to_process = []
+        unchanged = []
+        for url in urls:
+            key = canonical_url(url)
+            previous = self.previous.get(key)
+            if previous is not None and url in not_modified:
+                self.inventory[key] = dict(previous, lastmod=(sitemap_lastmod or {}).get(url, previous.get('lastmod')))
+                unchanged.append(previous)
+            else:
+                to_process.append(url)
+        self.carried += len(unchanged)
+        return to_process, unchanged
+
+    def record_titles(self, urls_titles, sitemap_lastmod=None):
+        for url_title in urls_titles:
+            key = canonical_url(url_title['url'])
+            # Whether it is a product is known after the LLM selection
+            self.inventory[key] = {'url': url_title['url'], 'title': url_title['title'],
+                                   'lastmod': (sitemap_lastmod or {}).get(url_title['url']), 'product': None}
+
+    def record_rejected(self, urls):
+        """
+        Mark the URLs the selection did not keep as products.
+        """
+        for url in urls:
+            record = self.inventory.get(canonical_url(url))
+            if record is not None:
+                record['product'] = False
+
+    def record_products(self, products):
+        for product in products:
+            if product is None:
+                continue
+            key = canonical_url(product['url'])
+            self.products[key] = product
+            self.inventory.setdefault(key, {'url': product['url'], 'title': product['title'], 'lastmod': None})['product'] = True
+
+    def merge(self, gone_urls=()):
+        """
+        Merge the previous catalog with the products of this execution.
+
+        Previous products that were processed again and are no longer
+        products, or whose page is gone, are removed; the ones not visited in
+        this execution are kept.
+
+        :return: (merged catalog, delta)
+        """
+        gone = set(canonical_url(url) for url in gone_urls)
+        catalog = dict(self.previous_catalog)
+        added, changed, removed = [], [], []
+        for key, product in self.products.items():
+            if key not in catalog:
+                added.append(product)
+            elif catalog[key] != product:
+                changed.append(product)
+            catalog[key] = product
+        for key in list(catalog):
+            if key in self.products:
+                continue
+            record = self.inventory.get(key)
+            if key in gone or (record is not None and record.get('product') is False):
+                removed.append(catalog.pop(key)['url'])
+        delta = {
+            'previous_execution': os.path.basename(self.previous_folder) if self.previous_folder else None,
+            'unchanged': self.carried,
+            'added': added,
+            'changed': changed,
+            'removed': removed,
+        }
+        return list(catalog.values()), delta
+
+    def save_inventory(self, results_folder):
+        """
+        Write the URL inventory of this execution, read by the next incremental one.
+        """
+        # URLs of the previous inventory not visited this time stay for the next execution
+        inventory = dict(self.previous)
+        inventory.update(self.inventory)
+        write_jsonl(os.path.join(results_folder, INVENTORY_FILE), inventory.values())
+
+    def save_catalog(self, results_folder, gone_urls=()):
+        """
+        Write the merged catalog and the delta of this execution.
+
+        :return: The merged catalog.
+        """
+        catalog, delta = self.merge(gone_urls)
+        write_jsonl(os.path.join(results_folder, CATALOG_FILE), catalog)
+        with open(os.path.join(results_folder, DELTA_FILE), 'w', encoding='utf-8') as f:
+            json.dump(delta, f, ensure_ascii=False, indent=2)
+        logging.info(f"Incremental: {len(delta['added'])} added, {len(delta['changed'])} changed, "
+                     f"{len(delta['removed'])} removed, {delta['unchanged']} unchanged; catalog of {len(catalog)} products")
+        return catalog
+
+    def state(self):
+        return {
+            'inventory': list(self.inventory.values()),
+            'products': list(self.products.values()),
+            'unchanged_by_lastmod': list(self.unchanged_by_lastmod),
+            'carried': self.carried,
+        }
+
+    def restore(self, state):
+        self.inventory = {canonical_url(record['url']): record for record in state['inventory']}
+        self.products = {canonical_url(product['url']): product for product in state['products']}
+        self.unchanged_by_lastmod = set(state['unchanged_by_lastmod'])
+        self.carried = state['carried']
+
+    def report(self):
+        return (f"{len(self.previous)} URLs in the previous inventory, {len(self.unchanged_by_lastmod)} unchanged by lastmod, "
+                f"{self.carried} unchanged in total, {len(self.products)} products extracted again")
@@ -0,0 +1,98 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+
+class LLMDecisionCache:
+    """
+    On-disk SQLite cache of the product / not product decisions of the LLM.
+
+    Decisions are keyed by (model, prompt hash, url, title), so changing the
+    model or the prompt in CONFIG.py does not reuse stale answers. Entries
+    older than ttl seconds are ignored and evicted; the table is also capped
+    to max_entries rows, dropping the oldest ones first.
+    """
+    def __init__(self, path, model, prompt, ttl=None, max_entries=None):
+        self.path = path
+        self.model = model
+        self.prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS decisions (
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                url TEXT NOT NULL,
+                title TEXT NOT NULL,
+                is_product INTEGER NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (model, prompt_hash, url, title)
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS decisions_created ON decisions (created)")
+        self.connection.commit()
+        self.evict()
+
+    def get_many(self, urls_titles):
+        """
+        Look up the cached decisions of a list of items.
+
+        :param urls_titles: List of dictionaries with 'url' and 'title'.
+        :return: Dictionary of url -> is_product for the cached items.
+        """
+        min_created = time.time() - self.ttl if self.ttl else 0
+        decisions = {}
+        for url_title in urls_titles:
+            row = self.connection.execute(
+                "SELECT is_product FROM decisions WHERE model = ? AND prompt_hash = ? AND url = ? AND title = ? AND created >= ?",
+                (self.model, self.prompt_hash, url_title['url'], url_title['title'], min_created),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                decisions[url_title['url']] = bool(row[0])
+        return decisions
+
+    def put_many(self, decisions):
+        """
+        Store decisions of the LLM.
+
+        :param decisions: List of (url, title, is_product) tuples.
+        """
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO decisions VALUES (?, ?, ?, ?, ?, ?)",
+            [(self.model, self.prompt_hash, url, title, int(is_product), now) for url, title, is_product in decisions],
+        )
+        self.connection.commit()
+
+    def evict(self):
+        """
+        Delete expired entries and keep at most max_entries rows.
+        """
+        if self.ttl:
+            self.connection.execute("DELETE FROM decisions WHERE created < ?", (time.time() - self.ttl,))
+        if self.max_entries:
+            self.connection.execute(
+                "DELETE FROM decisions WHERE rowid IN (SELECT rowid FROM decisions ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        self.connection.commit()
+
+    def close(self):
+        self.evict()
+        self.connection.close()
+        logging.info(f"LLM cache: {self.report()}")
+
+    def report(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0
+        return f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate)"
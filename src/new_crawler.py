@@ -1,13 +1,18 @@
 import asyncio
-import aiohttp
-from aiohttp import ClientSession
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urldefrag, urlparse
-import re
+from src.http_client import HttpClient
+from src.url_filter import UrlFilter
+from urllib.parse import urlparse
 import time
 import pickle
 import os
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import Error as PlaywrightError
+from src.browser_pool import BrowserPool, extract_links
+from src.render_profile import RenderProfile
+from src.router import FetchRouter
+from src.rate_limiter import limited
+from src.retry import RetryPolicy, raise_for_retry
+from src.parse_pool import run_parser, parse_links
+from src.checkpoint import Checkpoint
 # import matplotlib to save to file a simple plot
 import matplotlib.pyplot as plt
 
@@ -60,29 +65,36 @@ logging.getLogger('httpcore').setLevel(logging.WARNING)
 logging.getLogger('httpx').setLevel(logging.WARNING)
 
 class NewCrawler:
-    def __init__(self, root_url, concurrency=100, batch_size=10, n_retries=3, timeout=10, use_last_state = False):
+    def __init__(self, root_url, concurrency=100, batch_size=10, n_retries=3, timeout=10, use_last_state = False, client=None, url_filter=None, browser_pool=None, router=None, parse_pool=None, retry_policy=None):
         # logging.info(f"Initializing crawler for {root_url} with {concurrency} concurrency and {batch_size} batch size")
         self.root_url = root_url                # Root URL to crawl
         self.concurrency = concurrency          # Max concurrent fetches (Semaphore: total tasks)
         self.batch_size = batch_size            # URLs to retrieve per batch
         self.use_last_state = use_last_state    # Use last state if exists
-        self.n_retries = n_retries              # Max number of retries
+        self.n_retries = n_retries              # Max number of attempts per URL
         self.timeout = timeout                  # Timeout for HTTP requests
+        self.url_filter = url_filter if url_filter is not None else UrlFilter.from_rules([])  # URLs to ignore
 
         self.visited_urls = set()               # Set of visited URLs
         self.seen_urls = set()                  # Set of seen URLs (used for deduplication)
         self.urls_to_visit = asyncio.Queue()    # Queue of URLs to visit
         self.urls_to_visit.put_nowait(root_url) # Add root to queue
         self.discovered_urls = asyncio.Queue()  # Queue of newly discovered URLs
+        self.in_progress = set()                # URLs being fetched
         self.total_urls_batched = 0             # Total number of URLs batched
         self.total_batches = 0                  # Total number of batches
         self.mean_batching_time = 0             # Mean time to batch URLs
 
         self.historical_batches_mean_batching_time = []
 
-        self.session = None     # aiohttp ClientSession
-        self.playwright = None  # Playwright instance (for JS-heavy pages)
-        self.browser = None     # Chromium browser    (for JS-heavy pages)
+        self.client = client    # Shared HttpClient (own client if None)
+        self.owns_client = client is None
+        self.session = None     # aiohttp ClientSession of the client
+        self.browser_pool = browser_pool         # Pooled Chromium pages (for JS-heavy pages)
+        self.owns_browser_pool = browser_pool is None
+        self.router = router if router is not None else FetchRouter()  # Static or rendered fetch per URL
+        self.parse_pool = parse_pool             # ParsePool for the link extraction (parsed inline if None)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(max_attempts=n_retries)
 
         self.crawling_task = None       # Crawler task
         self.save_state_interval = 10  # Save state every x seconds
@@ -91,26 +103,33 @@ class NewCrawler:
         current_root_folder = os.path.dirname(os.path.abspath(__file__))
         self.root_folder = os.path.join(current_root_folder, '..')
 
+        # Frontier, seen and visited URLs, saved every save_state_interval seconds
+        self.checkpoint = Checkpoint(os.path.join(self.root_folder, 'crawler_status', 'checkpoint.json'), self.save_state_interval)
+
         # Load state if exists
         if self.use_last_state:
             self.load_state()
 
     async def start(self):
         # logging.info(f"Starting crawler: async playwright, chromium browser and http client session")
-        self.session = ClientSession()
-        self.playwright = await async_playwright().start()
-        self.browser = await self.playwright.chromium.launch(headless=True)
+        if self.owns_client:
+            self.client = await HttpClient(limit_per_host=self.concurrency).start()
+        self.session = self.client.session
+        if self.owns_browser_pool:
+            self.browser_pool = await BrowserPool(RenderProfile(self.root_url)).start()
         self.crawling_task = asyncio.create_task(self.crawl())
-        # logging.info(f"Crawler started:\n\tPlaywright: {self.playwright}\n\tBrowser: {self.browser}\n\tSession: {self.session}")
+        # logging.info(f"Crawler started:\n\tBrowser pool: {self.browser_pool}\n\tSession: {self.session}")
 
         # Start periodic state saving
         asyncio.create_task(self.periodic_state_save())
+        asyncio.create_task(self.requeue_deferred())
 
     async def stop(self):
         self.crawling_task.cancel()
-        await self.session.close()
-        await self.browser.close()
-        await self.playwright.stop()
+        if self.owns_client:
+            await self.client.close()
+        if self.owns_browser_pool:
+            await self.browser_pool.close()
         self.save_state()
 
     async def crawl(self):
@@ -131,7 +150,10 @@ class NewCrawler:
                     continue
                 # logging.info(f"Visiting {url}")
                 self.visited_urls.add(url) # Mark URL as visited
-                tasks.append(asyncio.create_task(self.fetch(url, semaphore))) # Add task to queue to fetch sub-pages
+                self.in_progress.add(url)
+                task = asyncio.create_task(self.fetch(url, semaphore)) # Add task to queue to fetch sub-pages
+                task.add_done_callback(lambda _, url=url: self.in_progress.discard(url))
+                tasks.append(task)
 
                 if len(tasks) >= self.concurrency: # If queue is full, wait for tasks to complete
                     await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
@@ -141,90 +163,71 @@ class NewCrawler:
 
     async def fetch(self, url, semaphore):
         # logging.info(f"Fetching {url}")
-        async with semaphore:
-            for attempt in range(5):
-                # logging.info(f"Attempt {attempt + 1} for {url}")
-                try:
-                    async with self.session.get(url, timeout=10) as response:
-                        if response.status != 200:
-                            logging.error(f"\tFailed to fetch {url} with status code {response.status}")
-                            return
-                        content_type = response.headers.get('Content-Type', '')
-                        if 'text/html' not in content_type:
-                            # logging.info(f"\tSkipping non-HTML URL: {url}")
-                            return
-                        text = await response.text()
-
-                        # logging.info(f"\tSuccessfully fetched {url}:\n{text[:100]}...")
-
-                        # Heuristic to detect JS-heavy pages
-                        if self.is_javascript_heavy(text):
-                            # logging.info(f"\tDetected JS-heavy page: {url}")
-                            await self.fetch_with_playwright(url)
-                        else:
-                            # logging.info(f"\tDetected non-JS-heavy page: {url}")
-                            await self.parse_and_enqueue(url, text)
-                        return
-                except (aiohttp.ClientError, asyncio.TimeoutError):
-                    await asyncio.sleep(2 ** attempt)
-            # Log failure after retries
-            print(f"Failed to fetch {url} after retries")
-
-   
-    def is_javascript_heavy(self,html):
-        # logging.info(f"\tChecking if url is JS-heavy")
-        soup = BeautifulSoup(html, 'lxml')
-        
-        # Check for heavy script content
-        scripts = soup.find_all('script')
-        external_scripts = [script for script in scripts if script.get('src')]
-        inline_scripts = [script for script in scripts if not script.get('src')]
-        
-        # Calculate total script size for inline scripts
-        inline_script_content = ''.join(script.text for script in inline_scripts)
-        inline_script_size = len(inline_script_content)
-        
-        # Heuristics to detect JS frameworks
-        js_framework_patterns = {
-            'React': r'data-reactroot|data-reactid',
-            'Angular': r'ng-app|ng-controller',
-            'Vue': r'v-bind|v-model'
-        }
-        
-        # Check for framework-specific attributes or large inline scripts
-        framework_detected = any(re.search(pattern, html) for pattern in js_framework_patterns.values())
-        heavy_script_use = len(external_scripts) > 5 or inline_script_size > 20000  # Example thresholds
-
-        return framework_detected or heavy_script_use
-
-    async def fetch_with_playwright(self, url):
+        if self.router.should_render(url):
+            await self.fetch_with_playwright(url, semaphore)
+            return
+
+        async def attempt():
+            async with self.session.get(url, timeout=self.timeout) as response:
+                raise_for_retry(response.status, response.headers.get('Retry-After'))
+                if response.status != 200:
+                    logging.error(f"\tFailed to fetch {url} with status code {response.status}")
+                    return False
+                content_type = response.headers.get('Content-Type', '')
+                if 'text/html' not in content_type:
+                    # logging.info(f"\tSkipping non-HTML URL: {url}")
+                    return False
+                text = await response.text()
+
+            # logging.info(f"\tSuccessfully fetched {url}:\n{text[:100]}...")
+
+            # Cheap check of whether the links are built by JavaScript
+            if self.router.check(url, text):
+                # logging.info(f"\tDetected JS-heavy page: {url}")
+                return True
+            # logging.info(f"\tDetected non-JS-heavy page: {url}")
+            await self.parse_and_enqueue(url, text)
+            return False
+
+        if await self.retry_policy.run(attempt, semaphore, defer=('crawl', url)):
+            await self.fetch_with_playwright(url, semaphore)
+
+    async def fetch_with_playwright(self, url, semaphore):
         # logging.info(f"\tFetching {url} with Playwright")
-        for attempt in range(5):
-            # logging.info(f"\tAttempt {attempt + 1} for {url}")
-            try:
-                context = await self.browser.new_context()
-                page = await context.new_page()
-                await page.goto(url, timeout=10000)
-                content = await page.content()
-                # logging.info(f"\t\tSuccessfully fetched {url} with Playwright, head:\n{content[:100]}...")
-                await self.parse_and_enqueue(url, content)
-                await context.close()
-                return
-            except (PlaywrightTimeoutError, Exception):
-                await asyncio.sleep(2 ** attempt)
-            finally:
-                await context.close()
-        print(f"Failed to fetch {url} with Playwright after retries")
+        async def attempt():
+            async with self.browser_pool.page() as page:
+                async with limited(self.client.rate_limiter, url) as slot:
+                    response = await self.browser_pool.navigate(page, url)
+                    status = response.status if response is not None else None
+                    retry_after = response.headers.get('retry-after') if response is not None else None
+                    slot.done(status, retry_after)
+                raise_for_retry(status, retry_after)
+                links = await extract_links(page, self.root_url, self.url_filter)
+            await self.enqueue_links(links)
+
+        await self.retry_policy.run(attempt, semaphore, defer=('crawl', url), retry_on=(PlaywrightError,))
+
+    async def requeue_deferred(self):
+        # Put back in the queue the URLs whose retries were deferred
+        while True:
+            for url in self.retry_policy.deferred.pop_ready('crawl'):
+                self.visited_urls.discard(url)
+                await self.urls_to_visit.put(url)
+            await asyncio.sleep(self.retry_policy.deferred.delay / 4)
 
     async def parse_and_enqueue(self, base_url, html):
-        soup = BeautifulSoup(html, 'lxml')
-        for link_tag in soup.find_all('a', href=True):
-            href = link_tag.get('href')
-            href = urljoin(base_url, href)
-            href, _ = urldefrag(href)  # Remove URL fragments
+        links = []
+        for href in await run_parser(self.parse_pool, parse_links, html, base_url):  # Absolute, without fragment
             parsed_href = urlparse(href)
             if parsed_href.netloc != urlparse(self.root_url).netloc:
                 continue
+            if self.url_filter.is_ignored(href):
+                continue
+            links.append(href)
+        await self.enqueue_links(links)
+
+    async def enqueue_links(self, links):
+        for href in links:
             if href not in self.seen_urls:  # Check if URL is already seen
                 self.seen_urls.add(href)    # Mark it as seen
                 await self.urls_to_visit.put(href)
@@ -285,48 +288,49 @@ class NewCrawler:
         plt.savefig(os.path.join(path, 'mean_batching_time.png'))
         plt.close()
 
+    def state(self):
+        # URLs being fetched are fetched again after a resume
+        in_progress = set(self.in_progress)
+        return {
+            'visited_urls': [url for url in self.visited_urls if url not in in_progress],
+            'seen_urls': list(self.seen_urls),
+            'urls_to_visit': list(in_progress) + list(self.urls_to_visit._queue),
+            'discovered_urls': list(self.discovered_urls._queue),
+        }
+
     def save_state(self):
-        # save also visited_urls and urls_to_visit_list to file txt
-        path = os.path.join(self.root_folder, 'crawler_status')
-        if not os.path.exists(path):
-            os.makedirs(path)
-        with open(os.path.join(path, 'visited_urls.txt'), 'w') as f:
-            for url in self.visited_urls:
-                f.write(url + '\n')
-        with open(os.path.join(path, 'urls_to_visit_list.txt'), 'w') as f:
-            for url in self.urls_to_visit._queue:
-                f.write(url + '\n')
+        self.checkpoint.save(self.state())
 
         # plot mean batching times
         self.plot_mean_batching_times()
 
     def load_state(self):
-        # open the urls_to_visit.txt and _visited_urls.txt files
-        path = os.path.join(self.root_folder, 'crawler_status')
-        
-        # load the urls_to_visit_variable
-        with open(os.path.join(path, 'urls_to_visit_list.txt'), 'r') as f:
-            urls_to_visit_list = [line.strip() for line in f.readlines()]
+        state = self.checkpoint.load()
+        if state is None:
+            logging.info(f"No crawler state in {self.checkpoint.path}, starting from {self.root_url}")
+            return
+
+        self.visited_urls = set(state['visited_urls'])
+        self.seen_urls = set(state['seen_urls'])
         self.urls_to_visit = asyncio.Queue()
-        for url in urls_to_visit_list:
+        for url in state['urls_to_visit']:
             self.urls_to_visit.put_nowait(url)
-
-        # load the visited_urls_variable
-        with open(os.path.join(path, 'visited_urls.txt'), 'r') as f:
-            visited_urls = [line.strip() for line in f.readlines()]
-        self.visited_urls = visited_urls
+        self.discovered_urls = asyncio.Queue()
+        for url in state['discovered_urls']:
+            self.discovered_urls.put_nowait(url)
 
     async def periodic_state_save(self):
         while True:
             await asyncio.sleep(self.save_state_interval)
-            self.save_state()
+            await self.checkpoint.save_async(self.state())
+            self.plot_mean_batching_times()
 
     def __del__(self):
         # Ensure resources are cleaned up
-        if not self.session.closed:
+        if self.owns_client and self.session and not self.session.closed:
             asyncio.create_task(self.session.close())
-        if self.playwright:
-            asyncio.create_task(self.playwright.stop())
+        if self.owns_browser_pool and self.browser_pool:
+            asyncio.create_task(self.browser_pool.close())
 
 # Example usage
 async def main():
@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+def normalize_url(url):
+    """
+    Normalize a URL so the same page always maps to the same key.
+
+    :param url: The URL to normalize.
+    :return: The URL without its fragment.
+    """
+    return urlparse(url)._replace(fragment='').geturl()
+
+
+class PageStore:
+    """
+    In-memory store of the HTML downloaded by the crawler, keyed by normalized URL.
+
+    The crawler puts every page it fetches here so that title and detail
+    extraction can read the same HTML instead of downloading the page again.
+    The oldest pages are evicted once max_pages is reached.
+    """
+    def __init__(self, max_pages=500):
+        self.max_pages = max_pages
+        self.pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, url, html):
+        key = normalize_url(url)
+        self.pages[key] = html
+        self.pages.move_to_end(key)
+        while len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+
+    def get(self, url):
+        html = self.pages.get(normalize_url(url))
+        if html is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return html
+
+    def discard(self, urls):
+        """
+        Drop the pages of URLs that no longer need to be extracted.
+        """
+        for url in urls:
+            self.pages.pop(normalize_url(url), None)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __contains__(self, url):
+        return normalize_url(url) in self.pages
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import signal
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from src.extract import EXTRACTOR, html_links
+from CONFIG import PARSE_WORKERS, PARSE_MAX_PENDING, LOOP_LAG_INTERVAL
+
+
+# Worker functions: page content in, plain data out (both cross the process boundary)
+def parse_title(content):
+    return EXTRACTOR.title(content)
+
+
+def parse_details(content):
+    return EXTRACTOR.details(content)
+
+
+def parse_links(content, base_url):
+    return html_links(content, base_url)
+
+
+class ParsePool:
+    """
+    Process pool for the CPU-bound HTML parsing, so the event loop keeps
+    serving sockets while pages are parsed on other cores.
+
+    At most max_pending parses are submitted at a time; the callers wait for
+    a free place instead of piling up pages in memory. With 0 workers pages
+    are parsed on the event loop thread.
+    """
+    def __init__(self, workers=PARSE_WORKERS, max_pending=PARSE_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = None
+        self.pending = asyncio.Semaphore(max_pending)
+
+        self.parsed = 0
+        self.parse_time = 0  # Seconds from submission to result
+
+    def start(self):
+        if self.workers > 0:
+            # Ctrl+C is handled by the main process, which saves a checkpoint before stopping the workers
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=signal.signal,
+                                                initargs=(signal.SIGINT, signal.SIG_IGN))
+        return self
+
+    async def run(self, function, *args):
+        """
+        Run a worker function of this module on the pool.
+        """
+        async with self.pending:
+            start_time = time.perf_counter()
+            if self.executor is None:
+                result = function(*args)
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+            self.parse_time += time.perf_counter() - start_time
+            self.parsed += 1
+            return result
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def report(self):
+        mean_time = self.parse_time / self.parsed * 1000 if self.parsed else 0
+        return f"{self.parsed} pages parsed by {self.workers} workers, {mean_time:.1f} ms per page (queueing included)"
+
+
+async def run_parser(parse_pool, function, *args):
+    """
+    Run a worker function on the pool, or inline when there is no pool.
+    """
+    if parse_pool is None:
+        return function(*args)
+    return await parse_pool.run(function, *args)
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task that sleeps interval
+    seconds. A loop busy parsing pages shows up as a high lag.
+    """
+    def __init__(self, interval=LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.lags = deque(maxlen=10000)  # Seconds late of each wake-up
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.monitor())
+        return self
+
+    async def monitor(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start_time = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - start_time - self.interval
+            self.lags.append(max(lag, 0))
+            if lag > 1:
+                logging.warning(f"Event loop blocked for {lag:.2f}s")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def report(self):
+        lags = sorted(self.lags)
+        if not lags:
+            return "no samples"
+        p50 = lags[len(lags) // 2] * 1000
+        p95 = lags[int(len(lags) * 0.95)] * 1000
+        return f"lag p50 {p50:.1f} ms, p95 {p95:.1f} ms, max {lags[-1] * 1000:.1f} ms"
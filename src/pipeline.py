@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+
+# Marks the end of the stream in the stage queues
+END_OF_STREAM = object()
+
+
+class Stage:
+    """
+    A step of the pipeline.
+
+    The handler is a coroutine function that receives a batch (a list) and
+    returns the batch for the next stage, or None to drop it.
+    """
+    def __init__(self, name, handler, workers=1):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = None
+        self.pending = {}  # Batches queued for or being handled by this stage, by id
+        self.batches_in = 0
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_time = 0
+        self.active_workers = 0
+
+    def report(self, elapsed):
+        depth = f"{self.queue.qsize()}/{self.queue.maxsize}" if self.queue else "-"
+        throughput = self.items_in / elapsed if elapsed > 0 else 0
+        return (f"{self.name}: queue {depth}, {self.batches_in} batches, "
+                f"{self.items_in} in / {self.items_out} out, "
+                f"{throughput:.2f} items/s, busy {self.busy_time:.1f}s")
+
+
+class Pipeline:
+    """
+    Runs the scraping stages concurrently with bounded queues between them.
+
+    A source async generator produces batches that flow through every stage in
+    order. Each stage has its own input queue of at most queue_size batches, so
+    a slow stage makes the previous ones wait instead of piling up work.
+
+    Every batch is pending in a stage from the moment it is queued for it
+    until the stage hands its result to the next one, so pending_batches()
+    is the work left to do at any instant and run(resume=...) starts again
+    from it. on_change, if given, is called every time a batch is queued for
+    a stage or leaves one, to save pending_batches() at the stage boundaries.
+    """
+    def __init__(self, stages, queue_size=2, report_interval=30, on_change=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.on_change = on_change
+        self.stop_event = asyncio.Event()
+        self.start_time = None
+        self.source_batches = 0
+
+    def stop(self):
+        """
+        Stop pulling new batches from the source. Batches already in the
+        pipeline are still processed.
+        """
+        self.stop_event.set()
+
+    def pending_batches(self):
+        """
+        :return: Dictionary of stage name -> batches waiting for or being handled by the stage.
+        """
+        return {stage.name: list(stage.pending.values()) for stage in self.stages}
+
+    def idle(self):
+        """
+        True when no stage has a batch queued or in progress.
+        """
+        return not any(stage.pending for stage in self.stages)
+
+    async def wait_idle(self, interval=0.5):
+        while not self.idle():
+            await asyncio.sleep(interval)
+
+    def changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    async def put(self, stage, batch):
+        stage.pending[id(batch)] = batch
+        self.changed()
+        await stage.queue.put(batch)
+
+    async def run(self, source, resume=None):
+        """
+        :param resume: Optional pending_batches() of an earlier run, handled before the new batches.
+        """
+        self.start_time = time.time()
+        for stage in self.stages:
+            stage.queue = asyncio.Queue(maxsize=self.queue_size)
+            stage.pending = {}
+
+        workers = []
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            stage.active_workers = stage.workers
+            for _ in range(stage.workers):
+                workers.append(asyncio.create_task(self.run_stage(stage, next_stage)))
+
+        reporter = asyncio.create_task(self.report_periodically())
+        try:
+            if resume:
+                # The last stages first, so they make room for the batches of the previous ones
+                for stage in reversed(self.stages):
+                    for batch in resume.get(stage.name, []):
+                        await self.put(stage, batch)
+            await self.feed(source)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+            self.log_report()
+
+    async def feed(self, source):
+        first_stage = self.stages[0]
+        try:
+            async for batch in source:
+                self.source_batches += 1
+                await self.put(first_stage, batch)
+                if self.stop_event.is_set():
+                    break
+        except Exception as e:
+            logging.exception(f"Pipeline source failed: {e}")
+        finally:
+            await source.aclose()
+            await first_stage.queue.put(END_OF_STREAM)
+
+    async def run_stage(self, stage, next_stage):
+        while True:
+            batch = await stage.queue.get()
+            if batch is END_OF_STREAM:
+                stage.active_workers -= 1
+                if stage.active_workers > 0:
+                    # Let the other workers of this stage see the end too
+                    await stage.queue.put(END_OF_STREAM)
+                elif next_stage is not None:
+                    await next_stage.queue.put(END_OF_STREAM)
+                return
+
+            stage.batches_in += 1
+            stage.items_in += len(batch)
+            start = time.time()
+            try:
+                result = await stage.handler(batch)
+            except Exception as e:
+                logging.exception(f"Stage {stage.name} failed on a batch of {len(batch)} items: {e}")
+                result = None
+            stage.busy_time += time.time() - start
+
+            if result is not None:
+                stage.items_out += len(result)
+                if next_stage is not None and result:
+                    await self.put(next_stage, result)
+            stage.pending.pop(id(batch), None)
+            self.changed()
+
+    async def report_periodically(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.log_report()
+
+    def log_report(self):
+        elapsed = time.time() - self.start_time
+        logging.info(f"Pipeline status after {elapsed:.1f} seconds ({self.source_batches} batches crawled):")
+        for stage in self.stages:
+            logging.info(f"\t{stage.report(elapsed)}")
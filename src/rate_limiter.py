@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from CONFIG import (RATE_LIMIT_INITIAL_RPS, RATE_LIMIT_MIN_RPS, RATE_LIMIT_MAX_RPS, RATE_LIMIT_INITIAL_CONCURRENCY,
+                    RATE_LIMIT_MAX_CONCURRENCY, RATE_LIMIT_TARGET_LATENCY, RATE_LIMIT_MAX_BACKOFF)
+
+# Statuses meaning the server wants fewer requests
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait from a Retry-After header (seconds or HTTP date), or None.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    """
+    Token bucket and AIMD concurrency window of one host.
+
+    Requests take a token (refilled at rate per second) and a place in the
+    window. Like TCP, both grow exponentially until the first sign of
+    trouble (slow start), then healthy answers add about one request per
+    round trip to the window and one request per second to the rate. Slow
+    answers shrink the window a little, errors a bit more, and 429/503 halve
+    both and pause the host for Retry-After seconds (or an exponential back off).
+
+    Like TCP's once per round trip cut, the answers of a burst of requests
+    throttled together count as one event: 429/503 received during the
+    pause, or for requests sent before the last cut, only extend the pause
+    to their Retry-After.
+    """
+    def __init__(self, host, rate=RATE_LIMIT_INITIAL_RPS, concurrency=RATE_LIMIT_INITIAL_CONCURRENCY,
+                 min_rate=RATE_LIMIT_MIN_RPS, max_rate=RATE_LIMIT_MAX_RPS, max_concurrency=RATE_LIMIT_MAX_CONCURRENCY,
+                 target_latency=RATE_LIMIT_TARGET_LATENCY, max_backoff=RATE_LIMIT_MAX_BACKOFF):
+        self.host = host
+        self.rate = rate
+        self.concurrency = concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.max_backoff = max_backoff
+
+        self.tokens = 1
+        self.last_refill = time.monotonic()
+        self.in_flight = 0
+        self.blocked_until = 0
+        self.consecutive_throttles = 0
+        self.last_decrease = None  # Time of the last throttle cut
+        self.slow_start = True
+        self.condition = asyncio.Condition()
+
+        self.requests = 0
+        self.throttled = 0
+        self.throttle_events = 0  # Cuts of the rate and the window
+        self.errors = 0
+        self.latencies = deque(maxlen=1000)  # Seconds until the response headers
+
+    def refill(self, now):
+        self.tokens = min(max(self.rate, 1), self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self):
+        async with self.condition:
+            while True:
+                now = time.monotonic()
+                wait = None
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.in_flight < max(1, int(self.concurrency)):
+                    self.refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.in_flight += 1
+                        self.requests += 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                # Without a wait time, the window is full until a release
+                try:
+                    await asyncio.wait_for(self.condition.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, status=None, latency=None, retry_after=None):
+        """
+        Free the place of a request and adapt the rate and the window.
+
+        :param status: HTTP status, or None if the request failed.
+        :param latency: Seconds until the response headers.
+        :param retry_after: Value of the Retry-After header.
+        """
+        async with self.condition:
+            self.in_flight -= 1
+            if status in THROTTLE_STATUSES:
+                self.slow_start = False
+                self.throttled += 1
+                now = time.monotonic()
+                backoff = parse_retry_after(retry_after)
+                if self.is_new_throttle(now, now - latency if latency is not None else now):
+                    self.throttle_events += 1
+                    self.consecutive_throttles += 1
+                    self.last_decrease = now
+                    self.concurrency = max(1, self.concurrency / 2)
+                    self.rate = max(self.min_rate, self.rate / 2)
+                    if backoff is None:
+                        backoff = min(self.max_backoff, 2 ** self.consecutive_throttles)
+                    logging.warning(f"{self.host} throttled ({status}), pausing {backoff:.0f}s, "
+                                    f"window {self.concurrency:.1f}, {self.rate:.1f} req/s")
+                if backoff is not None:
+                    self.blocked_until = max(self.blocked_until, now + backoff)
+            elif status is None:
+                self.slow_start = False
+                self.errors += 1
+                self.concurrency = max(1, self.concurrency * 0.75)
+            else:
+                self.consecutive_throttles = 0
+                if latency is not None:
+                    self.latencies.append(latency)
+                if latency is not None and latency > self.target_latency:
+                    self.slow_start = False
+                    self.concurrency = max(1, self.concurrency * 0.9)
+                elif self.slow_start:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                    self.rate = min(self.max_rate, self.rate * 1.1)
+                else:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                    self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+            self.condition.notify_all()
+
+    def is_new_throttle(self, now, sent_at):
+        """
+        Whether a 429/503 received now is a new congestion event and not
+        the answer of a request sent before the last cut.
+
+        :param sent_at: When the throttled request was sent.
+        """
+        if now < self.blocked_until:
+            return False
+        return self.last_decrease is None or sent_at >= self.last_decrease
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        p50 = latencies[len(latencies) // 2] if latencies else 0
+        return (f"{self.host}: {self.requests} requests, {self.throttled} throttled ({self.throttle_events} cuts), {self.errors} errors, "
+                f"window {self.concurrency:.1f}, {self.rate:.1f} req/s, latency p50 {p50:.2f}s")
+
+
+class RequestSlot:
+    """
+    Place of one request in a HostLimiter; done() records its outcome.
+    """
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.status = None
+        self.latency = None
+        self.retry_after = None
+
+    def done(self, status, retry_after=None):
+        self.status = status
+        self.latency = time.monotonic() - self.start_time
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Per-host limiters shared by every request of the run (aiohttp and browser).
+    """
+    def __init__(self, **host_settings):
+        self.host_settings = host_settings
+        self.hosts = {}
+
+    def host_limiter(self, url):
+        host = urlparse(str(url)).netloc.lower()
+        if host not in self.hosts:
+            self.hosts[host] = HostLimiter(host, **self.host_settings)
+        return self.hosts[host]
+
+    @asynccontextmanager
+    async def request(self, url):
+        """
+        Wait for a place for a request to url. Call slot.done(status, retry_after)
+        when the response arrives; a slot left without status counts as an error.
+        """
+        limiter = self.host_limiter(url)
+        await limiter.acquire()
+        slot = RequestSlot()
+        try:
+            yield slot
+        finally:
+            await limiter.release(slot.status, slot.latency, slot.retry_after)
+
+    def report(self):
+        return "; ".join(limiter.report() for limiter in self.hosts.values()) or "no requests"
+
+
+@asynccontextmanager
+async def limited(rate_limiter, url):
+    """
+    RateLimiter.request when there is a limiter, a slot that records nothing otherwise.
+    """
+    if rate_limiter is None:
+        yield RequestSlot()
+    else:
+        async with rate_limiter.request(url) as slot:
+            yield slot
+
+
+class RateLimitedSession:
+    """
+    Wraps an aiohttp ClientSession so that every GET waits for its host limiter.
+    """
+    def __init__(self, session, rate_limiter):
+        self.session = session
+        self.rate_limiter = rate_limiter
+
+    @property
+    def closed(self):
+        return self.session.closed
+
+    async def close(self):
+        await self.session.close()
+
+    @asynccontextmanager
+    async def get(self, url, **kwargs):
+        async with self.rate_limiter.request(url) as slot:
+            async with self.session.get(url, **kwargs) as response:
+                slot.done(response.status, response.headers.get('Retry-After'))
+                yield response
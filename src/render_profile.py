@@ -0,0 +1,110 @@
+import logging
+from urllib.parse import urlparse
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from CONFIG import RENDER_PROFILE
+
+DEFAULT_RENDER_PROFILE = {
+    # Resource types that are never downloaded
+    "block_resource_types": ["image", "media", "font"],
+    # Hosts (and their subdomains) that are never contacted
+    "block_domains": [
+        "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+        "facebook.net", "facebook.com", "hotjar.com", "clarity.ms", "tiktok.com", "pinterest.com",
+        "criteo.com", "klaviyo.com", "trustpilot.com", "cookiebot.com", "onetrust.com",
+    ],
+    # Block every other host than the shop, except the ones in allow_domains
+    "block_third_party": True,
+    "allow_domains": [
+        "cdn.shopify.com", "shopifycdn.net", "cloudfront.net", "jsdelivr.net", "unpkg.com",
+        "cdnjs.cloudflare.com", "ajax.googleapis.com", "wp.com",
+    ],
+    # Navigation: "commit", "domcontentloaded", "load" or "networkidle"
+    "wait_until": "domcontentloaded",
+    # Optional selector to wait for after the navigation (None to skip)
+    "wait_for_selector": "a",
+    # Seconds to wait for network idle after the navigation (0 to skip)
+    "network_idle_timeout": 0,
+    # Seconds for the navigation and the selector
+    "timeout": 10,
+}
+
+
+def host_matches(host, domains):
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+
+class RenderProfile:
+    """
+    How headless pages are loaded: which requests are blocked and what
+    the navigation waits for.
+
+    The defaults block images, media, fonts, analytics and third-party hosts
+    and wait for DOMContentLoaded and the first link. RENDER_PROFILE in
+    CONFIG.py overrides any of the keys of DEFAULT_RENDER_PROFILE for the
+    site being scraped.
+    """
+    def __init__(self, site_url, overrides=RENDER_PROFILE):
+        settings = dict(DEFAULT_RENDER_PROFILE)
+        settings.update(overrides or {})
+        self.settings = settings
+        self.site_domain = urlparse(site_url).netloc.lower().removeprefix('www.')
+        self.block_resource_types = set(settings["block_resource_types"])
+        self.block_domains = settings["block_domains"]
+        self.block_third_party = settings["block_third_party"]
+        self.allow_domains = [self.site_domain] + list(settings["allow_domains"])
+        self.blocked_requests = 0
+        self.allowed_requests = 0
+
+    def should_block(self, request):
+        # Never block the page itself
+        if request.is_navigation_request():
+            return False
+        if request.resource_type in self.block_resource_types:
+            return True
+        host = urlparse(request.url).netloc.lower().split(':')[0]
+        if not host:
+            return False
+        if host_matches(host, self.block_domains):
+            return True
+        return self.block_third_party and not host_matches(host, self.allow_domains)
+
+    async def handle_route(self, route):
+        if self.should_block(route.request):
+            self.blocked_requests += 1
+            await route.abort()
+        else:
+            self.allowed_requests += 1
+            await route.continue_()
+
+    async def install(self, context):
+        """
+        Route every request of a browser context through the profile.
+        """
+        await context.route("**/*", self.handle_route)
+
+    async def navigate(self, page, url):
+        """
+        Load a page and wait for the conditions of the profile.
+
+        :return: The Playwright response of the navigation.
+        """
+        timeout = self.settings["timeout"] * 1000
+        response = await page.goto(url, timeout=timeout, wait_until=self.settings["wait_until"])
+        if response is None or response.status != 200:
+            return response
+
+        if self.settings["wait_for_selector"]:
+            await page.wait_for_selector(self.settings["wait_for_selector"], state='attached', timeout=timeout)
+
+        if self.settings["network_idle_timeout"]:
+            try:
+                await page.wait_for_load_state("networkidle", timeout=self.settings["network_idle_timeout"] * 1000)
+            except PlaywrightTimeoutError:
+                # Pages with long polling never go idle, the cap is enough
+                logging.debug(f"Network not idle after {self.settings['network_idle_timeout']}s on {url}")
+        return response
+
+    def report(self):
+        total = self.blocked_requests + self.allowed_requests
+        blocked_rate = self.blocked_requests / total * 100 if total else 0
+        return f"{self.blocked_requests} of {total} requests blocked ({blocked_rate:.1f}%)"
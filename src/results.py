@@ -1,8 +1,10 @@
 import os
+import json
 import pandas as pd
 import shutil
 import logging
 from CONFIG import ROOT_URL
+from src.dedup import DedupIndex
 import logging
 
 class ResultsManager:
@@ -12,20 +14,28 @@ class ResultsManager:
         self.domain_name = self.get_domain_name(root_url)
         self.results_folder = os.path.join('results', self.domain_name, f'execution_{execution_number}')
         os.makedirs(self.results_folder, exist_ok=True)
+        # Append-only store of every product, products.xlsx and products.txt are exported from it
+        self.store_file = os.path.join(self.results_folder, 'products.jsonl')
         self.results_file = os.path.join(self.results_folder, 'products.xlsx')
         self.products = []
         self.total_products = 0
-        self.seen_titles = []
 
         # Copy CONFIG.py to results folder
         shutil.copy('CONFIG.py', self.results_folder)
 
-        # Load existing product titles to avoid duplicates
-        if os.path.exists(self.results_file):
+        # Move the products of an Excel file from an older version to the store
+        if not os.path.exists(self.store_file) and os.path.exists(self.results_file):
             existing_df = pd.read_excel(self.results_file)
-            self.existing_titles = set(existing_df['name'].astype(str).tolist())
-        else:
-            self.existing_titles = set()
+            existing_df.rename(columns={'name': 'title', 'image_url': 'image'}, inplace=True)
+            self.products = existing_df[['url', 'title', 'image', 'description', 'price']].astype(str).to_dict('records')
+            self.save_to_store()
+            self.total_products = 0
+
+        # Index of the processed URLs and titles and of the saved products
+        self.index = DedupIndex(os.path.join(self.results_folder, 'dedup_index.txt'))
+        if not self.index.loaded:
+            self.rebuild_index()
+        self.total_products = self.index.products_count()
 
     def get_domain_name(self, url):
         from urllib.parse import urlparse
@@ -33,32 +43,77 @@ class ResultsManager:
 
     def append_results(self, product_details, batch_processed_urls_titles):
         """
-        Append new product details to the results list, ensuring no duplicates.
+        Append new product details to the results store, ensuring no duplicates.
+
+        :return: Number of products added, without the duplicates.
         """
         new_products = []
         # remove None from product_details
         product_details = [product for product in product_details if product is not None]
         for product in product_details:
             title = str(product.get('title', '')).strip()
-            if title not in self.existing_titles:
+            if not self.index.has_product(title, product.get('url')):
                 new_products.append(product)
-                self.existing_titles.add(title)
+                self.index.add_products([product])
             else:
                 logging.info(f"Duplicate product found and skipped: {title}")
 
         if new_products:
             self.products.extend(new_products)
-            # Save to both Excel and TXT before clearing the products list
-            self.save_to_txt()
-            self.save_to_excel()
+            self.save_to_store()
         else:
             logging.info("No new unique products to save.")
         self.save_urls_to_txt(batch_processed_urls_titles)
-    
+        return len(new_products)
+
+    def save_to_store(self):
+        """
+        Append the pending products to the JSONL store. Only the new products
+        are written, the store is never rewritten.
+        """
+        with open(self.store_file, 'a', encoding='utf-8') as f:
+            for product in self.products:
+                f.write(json.dumps(product, ensure_ascii=False) + "\n")
+        self.total_products += len(self.products)
+
+        # Clear the products list after saving
+        self.products = []
+
+    def load_products(self):
+        """
+        Read every product of the store.
+        """
+        products = []
+        if os.path.exists(self.store_file):
+            with open(self.store_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        products.append(json.loads(line))
+                    except ValueError:
+                        # Last line of an interrupted write
+                        logging.warning(f"Skipping invalid line in {self.store_file}")
+        return products
+
+    def rebuild_index(self):
+        """
+        Build the index from the outputs of a results folder created without one.
+        """
+        self.index.add_products(self.load_products())
+        processed_urls_titles = []
+        processed_urls_file = os.path.join(self.results_folder, 'processed_urls.txt')
+        if os.path.exists(processed_urls_file):
+            with open(processed_urls_file, 'r') as f:
+                for line in f:
+                    title, _, url = line.strip().rpartition(': ')
+                    if url:
+                        processed_urls_titles.append({'url': url, 'title': title})
+        self.index.add_processed(processed_urls_titles)
+
     def save_urls_to_txt(self, batch_processed_urls_titles):
         """
-        Save the processed URLs to a text file.
+        Save the processed URLs to a text file and to the index.
         """
+        self.index.add_processed(batch_processed_urls_titles)
         with open(os.path.join(self.results_folder, 'processed_urls.txt'), 'a') as f:
             for url_title in batch_processed_urls_titles:
                 f.write(f"{url_title["title"]}: {url_title['url']}\n")
@@ -68,12 +123,12 @@ class ResultsManager:
                 if url_title["title"] != "Title not found":
                     f.write(f"{url_title['title']}\n")
 
-    def save_to_excel(self):
+    def save_to_excel(self, products):
         """
-        Save the products list to an Excel file, ensuring no duplicates, and add a 'keywords' column.
+        Export the products to an Excel file, ensuring no duplicates, and add a 'keywords' column.
         """
         # Rename columns
-        df = pd.DataFrame(self.products)
+        df = pd.DataFrame(products, columns=['title', 'description', 'price', 'url', 'image'])
         df.rename(columns={'title': 'name', 'image': 'image_url'}, inplace=True)
 
         # Reorder columns
@@ -82,81 +137,55 @@ class ResultsManager:
         # Add the 'keywords' column with the same content as 'name'
         df['keywords'] = df['name']
 
-        if os.path.exists(self.results_file):
-            # Read existing data
-            existing_df = pd.read_excel(self.results_file)
-            # Rename and reorder existing data to match the new format
-            existing_df.rename(columns={'title': 'name', 'image': 'image_url'}, inplace=True)
-            existing_df = existing_df[['name', 'description', 'price', 'url', 'image_url']]
-            
-            # Add the 'keywords' column to existing data as well
-            existing_df['keywords'] = existing_df['name']
-
-            # Combine new and existing data
-            combined_df = pd.concat([existing_df, df], ignore_index=True)
-            # Drop duplicates based on 'name'
-            combined_df.drop_duplicates(subset=['name'], inplace=True)
-
-            # Sort alphabetically by 'name'
-            combined_df = combined_df.sort_values(by='name')
-            
-            # Save combined data back to Excel
-            combined_df.to_excel(self.results_file, index=False)
-            self.total_products = len(combined_df)
-            self.seen_titles = combined_df['name'].astype(str).tolist()
-        else:
-            # Drop duplicates in current batch based on 'name'
-            df.drop_duplicates(subset=['name'], inplace=True)
-
-            # Sort alphabetically by 'name'
-            df = df.sort_values(by='name')
-            
-            df.to_excel(self.results_file, index=False)
-            self.total_products = len(df)
-            self.seen_titles = df['name'].astype(str).tolist()
+        # Drop duplicates based on 'name'
+        df.drop_duplicates(subset=['name'], inplace=True)
 
-        logging.info(f"Saved {self.total_products} products.")
+        # Sort alphabetically by 'name'
+        df = df.sort_values(by='name')
 
-        # Clear the products list after saving
-        self.products = []
+        df.to_excel(self.results_file, index=False)
+        logging.info(f"Exported {len(df)} products to {self.results_file}.")
 
-    def save_to_txt(self):
+    def save_to_txt(self, products):
         """
-        Save the products list to a text file.
+        Export the products to a text file.
         """
-        with open(os.path.join(self.results_folder, 'products.txt'), 'a') as f:
-            for product in self.products:
+        with open(os.path.join(self.results_folder, 'products.txt'), 'w') as f:
+            for product in products:
                 f.write(f"{product['title']}\n")
                 f.write(f"Precio: {product['price']}\n\n")
                 f.write(f"{product['description']}\n\n")
                 f.write(f"Información extraída de [{product['title']}]({product['url']})\n\n")
                 f.write("-------\n\n")
 
-    def save_results(self):
+    def export(self, products=None):
+        """
+        Produce products.xlsx and products.txt from the store, or from the given products.
+        """
+        if products is None:
+            products = self.load_products()
+        if products:
+            self.save_to_excel(products)
+            self.save_to_txt(products)
+
+    def save_results(self, catalog=None):
         """
         Final save of results.
+
+        :param catalog: Products to export instead of the store (the merged catalog of an incremental execution).
         """
         if self.products:
-            self.save_to_excel()
-            self.save_to_txt()
-
-    def get_processed_urls(self):
-        # load them from the txt file if file doesn't exist return empty list
-        if os.path.exists(os.path.join(self.results_folder, 'processed_urls.txt')):
-            with open(os.path.join(self.results_folder, 'processed_urls.txt'), 'r') as f:
-                processed_urls = [line.strip() for line in f.readlines()]
-            return processed_urls
-        else:
-            return []
-        
-    def get_processed_titles(self):
-        # load them from the txt file if file doesn't exist return empty list
-        if os.path.exists(os.path.join(self.results_folder, 'processed_titles.txt')):
-            with open(os.path.join(self.results_folder, 'processed_titles.txt'), 'r') as f:
-                processed_titles = [line.strip() for line in f.readlines()]
-            return processed_titles
-        else:
-            return []
+            self.save_to_store()
+        self.export(catalog)
+
+    def is_processed_url(self, url):
+        return self.index.has_processed_url(url)
+
+    def is_processed_title(self, title):
+        return self.index.has_processed_title(title)
+
+    def is_saved_product(self, title, url=None):
+        return self.index.has_product(title, url)
 
 def get_execution_number(root_url, fixed=False):
     """
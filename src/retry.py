@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import nullcontext
+import aiohttp
+from src.rate_limiter import parse_retry_after
+from CONFIG import (RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_BUDGET_RATIO, RETRY_MIN_BUDGET,
+                    RETRY_DEFER_DELAY, RETRY_MAX_DEFERRALS)
+
+# Statuses worth retrying: timeouts, throttling and temporary server errors
+RETRY_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+RETRY_EXCEPTIONS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class RetryableError(Exception):
+    """
+    Raised by an attempt that got a response worth retrying.
+    """
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"status code {status}")
+        self.status = status
+        self.retry_after = parse_retry_after(retry_after)
+
+
+def raise_for_retry(status, retry_after=None):
+    if status in RETRY_STATUSES:
+        raise RetryableError(status, retry_after)
+
+
+class DeferredRetryQueue:
+    """
+    Items whose retries were exhausted, retried again after delay seconds by
+    a later batch instead of holding the current one. An item is deferred at
+    most max_deferrals times.
+    """
+    def __init__(self, delay=RETRY_DEFER_DELAY, max_deferrals=RETRY_MAX_DEFERRALS):
+        self.delay = delay
+        self.max_deferrals = max_deferrals
+        self.waiting = {}     # kind -> list of (ready time, item)
+        self.deferrals = {}   # (kind, item) -> times deferred
+        self.dropped = 0
+
+    def add(self, kind, item):
+        """
+        :return: False if the item was already deferred max_deferrals times.
+        """
+        deferrals = self.deferrals.get((kind, item), 0) + 1
+        if deferrals > self.max_deferrals:
+            self.dropped += 1
+            logging.error(f"Giving up on {item} after {self.max_deferrals} deferred retries")
+            return False
+        self.deferrals[(kind, item)] = deferrals
+        self.waiting.setdefault(kind, []).append((time.monotonic() + self.delay, item))
+        return True
+
+    def pop_ready(self, kind):
+        """
+        Remove and return the items of a kind whose delay has passed.
+        """
+        now = time.monotonic()
+        waiting = self.waiting.get(kind, [])
+        ready = [item for ready_time, item in waiting if ready_time <= now]
+        self.waiting[kind] = [(ready_time, item) for ready_time, item in waiting if ready_time > now]
+        return ready
+
+    def next_ready_in(self):
+        """
+        Seconds until the next item is ready, or None if nothing is waiting.
+        """
+        ready_times = [ready_time for waiting in self.waiting.values() for ready_time, _ in waiting]
+        if not ready_times:
+            return None
+        return max(0, min(ready_times) - time.monotonic())
+
+    def __len__(self):
+        return sum(len(waiting) for waiting in self.waiting.values())
+
+    def state(self):
+        return {
+            'waiting': {kind: [item for _, item in waiting] for kind, waiting in self.waiting.items()},
+            'deferrals': [[kind, item, deferrals] for (kind, item), deferrals in self.deferrals.items()],
+        }
+
+    def restore(self, state):
+        # Deferred items are retried as soon as the run resumes
+        now = time.monotonic()
+        self.waiting = {kind: [(now, item) for item in items] for kind, items in state['waiting'].items()}
+        self.deferrals = {(kind, item): deferrals for kind, item, deferrals in state['deferrals']}
+
+
+class RetryPolicy:
+    """
+    Retry policy shared by every fetch of the run.
+
+    Attempts run inside the caller's semaphore, but the back off between
+    attempts waits outside it so other URLs keep the slot busy. Delays use
+    decorrelated jitter (a random delay between base_delay and three times
+    the previous one, at least the Retry-After of the answer). Retries are
+    limited by a budget of min_budget plus budget_ratio times the requests of
+    the run, so a failing site does not multiply the load. Items that run out
+    of attempts go to the deferred queue.
+    """
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 budget_ratio=RETRY_BUDGET_RATIO, min_budget=RETRY_MIN_BUDGET, deferred=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.min_budget = min_budget
+        self.deferred = deferred if deferred is not None else DeferredRetryQueue()
+
+        self.requests = 0
+        self.retries = 0
+        self.budget_exhausted = 0
+        self.failures = 0  # Items that ran out of attempts
+
+    def next_delay(self, previous_delay, retry_after=None):
+        delay = min(self.max_delay, random.uniform(self.base_delay, previous_delay * 3))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def take_retry(self):
+        if self.retries >= self.min_budget + self.budget_ratio * self.requests:
+            self.budget_exhausted += 1
+            return False
+        self.retries += 1
+        return True
+
+    async def run(self, attempt, semaphore=None, defer=None, retry_on=()):
+        """
+        Run an attempt until it succeeds, fails for good or runs out of retries.
+
+        :param attempt: Coroutine function without arguments. It raises RetryableError
+            or a retryable exception to be retried; other exceptions are final.
+        :param semaphore: Held during each attempt, released while backing off.
+        :param defer: Optional (kind, item) sent to the deferred queue when the attempts run out.
+        :param retry_on: More exception types to retry (e.g. Playwright errors).
+        :return: The result of the attempt, or None if it failed.
+        """
+        delay = self.base_delay
+        for attempt_number in range(1, self.max_attempts + 1):
+            self.requests += 1
+            retry_after = None
+            try:
+                async with semaphore if semaphore is not None else nullcontext():
+                    return await attempt()
+            except RetryableError as e:
+                error = e
+                retry_after = e.retry_after
+            except RETRY_EXCEPTIONS + tuple(retry_on) as e:
+                error = e
+            except Exception as e:
+                logging.error(f"Error fetching {defer[1] if defer else 'a URL'}: {e}")
+                return None
+
+            if attempt_number == self.max_attempts or not self.take_retry():
+                break
+            delay = self.next_delay(delay, retry_after)
+            logging.debug(f"Attempt {attempt_number} failed ({error!r}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+        self.failures += 1
+        if defer is not None and self.deferred.add(*defer):
+            logging.warning(f"Deferring {defer[1]} after {attempt_number} attempts: {error!r}")
+        return None
+
+    def report(self):
+        return (f"{self.retries} retries for {self.requests} requests, {self.budget_exhausted} refused by the budget, "
+                f"{self.failures} items out of attempts, {len(self.deferred)} deferred waiting, "
+                f"{self.deferred.dropped} given up")
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import random
+import re
+from src.classifier import url_path_shape
+from CONFIG import ROUTER_MIN_LINKS, ROUTER_MIN_SAMPLES, ROUTER_MIN_AGREEMENT, ROUTER_PROBE_RATE
+
+LINK_RE = re.compile(rb'<a\s[^>]*?href\s*=', re.IGNORECASE)
+# Structured product data that is already in the static HTML
+PRODUCT_MARKUP_RE = re.compile(
+    rb'og:type["\']?\s+content=["\']?product|schema\.org/Product|"@type"\s*:\s*"Product"|itemprop=["\']?price',
+    re.IGNORECASE,
+)
+# Empty mount points of single page apps and "enable JavaScript" notices
+APP_SHELL_RE = re.compile(
+    rb'<div\s+id=["\']?(?:root|app|__next|__nuxt)["\']?\s*>\s*</div>|<noscript[^>]*>[^<]*enable javascript',
+    re.IGNORECASE,
+)
+
+
+def needs_rendering(html, min_links=ROUTER_MIN_LINKS):
+    """
+    Cheap check of whether the static HTML of a page is enough or the page
+    has to be rendered in the browser. Only regular expressions are used, the
+    page is not parsed.
+
+    :param html: Page HTML, str or bytes.
+    :param min_links: Fewer links than this means the content is built by JavaScript.
+    """
+    if isinstance(html, str):
+        html = html.encode('utf-8', 'ignore')
+    if PRODUCT_MARKUP_RE.search(html):
+        return False
+    if APP_SHELL_RE.search(html):
+        return True
+    links = 0
+    for _ in LINK_RE.finditer(html):
+        links += 1
+        if links >= min_links:
+            return False
+    return True
+
+
+class FetchRouter:
+    """
+    Decides for every URL whether to fetch it statically or render it.
+
+    Pages are fetched statically first and checked with needs_rendering; the
+    outcome is counted per URL shape (see classifier.url_path_shape) and for
+    the whole site. Once a shape, or the site when the shape is unknown, has
+    min_samples outcomes and at least min_agreement of them needed rendering,
+    its URLs go straight to the browser. A probe_rate share of them is still
+    tried statically so a decision can be unlearned. The counts are saved to
+    results/<domain>/render_routes.json and shared by executions.
+    """
+    def __init__(self, path=None, min_samples=ROUTER_MIN_SAMPLES,
+                 min_agreement=ROUTER_MIN_AGREEMENT, probe_rate=ROUTER_PROBE_RATE):
+        self.path = path
+        self.min_samples = min_samples
+        self.min_agreement = min_agreement
+        self.probe_rate = probe_rate
+        self.counts = {}  # shape -> [static, rendered]
+        self.site_counts = [0, 0]
+
+        self.static_fetches = 0
+        self.rendered_fetches = 0
+        self.fallbacks = 0  # Static fetches that had to be rendered afterwards
+
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            self.counts = saved.get("shapes", {})
+            self.site_counts = saved.get("site", [0, 0])
+            logging.info(f"Loaded render routes for {len(self.counts)} URL shapes from {path}")
+
+    def counts_need_rendering(self, counts):
+        static, rendered = counts
+        total = static + rendered
+        return total >= self.min_samples and rendered / total >= self.min_agreement
+
+    def should_render(self, url):
+        """
+        :return: True to render the URL directly, False to fetch it statically first.
+        """
+        counts = self.counts.get(url_path_shape(url))
+        if counts is not None and sum(counts) >= self.min_samples:
+            render = self.counts_need_rendering(counts)
+        else:
+            render = self.counts_need_rendering(self.site_counts)
+        if render and random.random() < self.probe_rate:
+            render = False
+        if render:
+            self.rendered_fetches += 1
+        else:
+            self.static_fetches += 1
+        return render
+
+    def record(self, url, rendered):
+        """
+        Record the outcome of a static fetch.
+
+        :param rendered: Whether the page needed rendering.
+        """
+        if rendered:
+            self.fallbacks += 1
+        counts = self.counts.setdefault(url_path_shape(url), [0, 0])
+        counts[1 if rendered else 0] += 1
+        self.site_counts[1 if rendered else 0] += 1
+
+    def check(self, url, html):
+        """
+        Check a statically fetched page and record the outcome.
+
+        :return: Whether the page has to be rendered.
+        """
+        rendered = needs_rendering(html)
+        self.record(url, rendered)
+        return rendered
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump({"site": self.site_counts, "shapes": self.counts}, f)
+
+    def report(self):
+        total = self.static_fetches + self.rendered_fetches
+        rendered_rate = (self.rendered_fetches + self.fallbacks) / total * 100 if total else 0
+        return (f"{self.static_fetches} static fetches ({self.fallbacks} rendered afterwards), "
+                f"{self.rendered_fetches} rendered directly, {rendered_rate:.1f}% of pages rendered")
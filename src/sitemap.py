@@ -0,0 +1,141 @@
+import logging
+import zlib
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin
+import aiohttp
+from CONFIG import REQUEST_TIMEOUT
+
+CHUNK_SIZE = 64 * 1024
+
+
+def sitemap_tag_name(tag):
+    """
+    Tag name without the sitemap namespace, or None for tags of other
+    namespaces (image:loc, video:loc, ...).
+    """
+    if tag.startswith('{'):
+        namespace, name = tag[1:].split('}', 1)
+        if 'sitemaps.org' not in namespace:
+            return None
+        return name
+    return tag
+
+
+async def find_sitemaps(session, root_url):
+    """
+    Get the sitemap URLs declared in robots.txt, or the usual locations if none.
+
+    :param session: The aiohttp client session.
+    :param root_url: Root URL of the shop.
+    :return: List of sitemap URLs.
+    """
+    sitemaps = []
+    robots_url = urljoin(root_url, '/robots.txt')
+    try:
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        async with session.get(robots_url, timeout=timeout) as response:
+            if response.status == 200:
+                robots = await response.text()
+                for line in robots.splitlines():
+                    if line.lower().startswith('sitemap:'):
+                        sitemaps.append(line.split(':', 1)[1].strip())
+    except Exception as e:
+        logging.warning(f"Could not read {robots_url}: {e}")
+
+    if not sitemaps:
+        sitemaps = [urljoin(root_url, '/sitemap.xml'), urljoin(root_url, '/sitemap_index.xml')]
+    return sitemaps
+
+
+async def parse_sitemap(session, sitemap_url):
+    """
+    Stream a sitemap and parse it incrementally, decompressing gzip sitemaps
+    on the fly.
+
+    :param session: The aiohttp client session.
+    :param sitemap_url: URL of the sitemap or sitemap index.
+    :return: Async generator of ('url' | 'sitemap', loc, lastmod) tuples.
+    """
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=REQUEST_TIMEOUT)
+    async with session.get(sitemap_url, timeout=timeout) as response:
+        if response.status != 200:
+            logging.warning(f"Failed to fetch sitemap {sitemap_url}, status code: {response.status}")
+            return
+
+        parser = ET.XMLPullParser(events=('end',))
+        decompressor = None
+        first_chunk = True
+        loc = lastmod = None
+
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            # .xml.gz sitemaps are served as gzip files, not with Content-Encoding
+            if first_chunk:
+                first_chunk = False
+                if chunk[:2] == b'\x1f\x8b':
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                name = sitemap_tag_name(element.tag)
+                if name == 'loc':
+                    loc = (element.text or '').strip()
+                elif name == 'lastmod':
+                    lastmod = (element.text or '').strip() or None
+                elif name in ('url', 'sitemap'):
+                    if loc:
+                        yield ('url' if name == 'url' else 'sitemap', loc, lastmod)
+                    loc = lastmod = None
+                    # Free the parsed entry to keep memory flat on huge sitemaps
+                    element.clear()
+
+        parser.close()
+
+
+def is_product_sitemap(sitemap_url):
+    return 'product' in sitemap_url.lower()
+
+
+async def iter_sitemap_urls(session, root_url, products_only=True, max_sitemaps=500):
+    """
+    Discover page URLs from the sitemaps of a shop.
+
+    Sitemap indexes are followed recursively. When products_only is set and an
+    index lists product sitemaps (Shopify sitemap_products_1.xml, WooCommerce
+    product-sitemap.xml, ...), only those are read.
+
+    :param session: The aiohttp client session.
+    :param root_url: Root URL of the shop.
+    :param products_only: Only follow product sub-sitemaps when there are any.
+    :param max_sitemaps: Maximum number of sitemap files to read.
+    :return: Async generator of (url, lastmod) tuples.
+    """
+    pending = await find_sitemaps(session, root_url)
+    read = set()
+
+    while pending and len(read) < max_sitemaps:
+        sitemap_url = pending.pop(0)
+        if sitemap_url in read:
+            continue
+        read.add(sitemap_url)
+
+        child_sitemaps = []
+        urls_found = 0
+        try:
+            async for kind, loc, lastmod in parse_sitemap(session, sitemap_url):
+                if kind == 'sitemap':
+                    child_sitemaps.append(loc)
+                else:
+                    urls_found += 1
+                    yield loc, lastmod
+        except ET.ParseError as e:
+            logging.warning(f"Invalid sitemap {sitemap_url}: {e}")
+        except Exception as e:
+            logging.warning(f"Error reading sitemap {sitemap_url}: {e}")
+
+        if products_only and any(is_product_sitemap(child) for child in child_sitemaps):
+            child_sitemaps = [child for child in child_sitemaps if is_product_sitemap(child)]
+        pending.extend(child_sitemaps)
+
+        logging.info(f"Read sitemap {sitemap_url}: {urls_found} URLs, {len(child_sitemaps)} sub-sitemaps")
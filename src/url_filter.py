@@ -0,0 +1,199 @@
+import logging
+import os
+import re
+from collections import deque
+from src.pages import normalize_url
+from CONFIG import IGNORE_URLS_WITH
+
+
+class SubstringMatcher:
+    """
+    Aho-Corasick automaton that finds whether any of many substrings occurs
+    in a text in a single pass, whatever the number of substrings.
+    """
+    def __init__(self, substrings=()):
+        self.goto = [{}]     # Transitions of each state
+        self.fail = [0]      # Failure link of each state
+        self.output = [False]  # Whether a substring ends in each state
+        for substring in substrings:
+            self.add(substring)
+        self.build()
+
+    def add(self, substring):
+        state = 0
+        for char in substring:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(False)
+            state = next_state
+        self.output[state] = True
+
+    def build(self):
+        # States at depth 1 fail back to the root, deeper ones are resolved breadth-first
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(char, 0)
+                self.output[next_state] = self.output[next_state] or self.output[self.fail[next_state]]
+
+    def search(self, text):
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                return True
+        return False
+
+
+class PrefixTrie:
+    """
+    Character trie that tells whether a text starts with any stored prefix.
+    """
+    END = None
+
+    def __init__(self, prefixes=()):
+        self.root = {}
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[self.END] = True
+
+    def match(self, text):
+        node = self.root
+        if self.END in node:
+            return True
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                return False
+            if self.END in node:
+                return True
+        return False
+
+
+class UrlFilter:
+    """
+    Decides whether a URL must be ignored.
+
+    Rules are compiled once: exact URLs into a set, prefixes into a trie,
+    suffixes into a trie of the reversed suffixes, substrings into an
+    Aho-Corasick automaton and regular expressions into a single combined
+    pattern, so checking a URL does not depend on how many rules there are.
+
+    Rule syntax (one per line in ignore_links.txt, '#' starts a comment):
+        https://shop.com/cart       exact URL
+        https://shop.com/blog/*     URL prefix
+        *.pdf                       URL suffix
+        *orderby=*                  substring anywhere in the URL
+        re:/page/\\d+               regular expression searched in the URL
+    """
+    def __init__(self, exact=(), prefixes=(), substrings=(), regexes=(), suffixes=()):
+        self.exact = set(normalize_url(url) for url in exact)
+        # An empty prefix, suffix or substring would match every URL
+        self.prefix_rules = [prefix for prefix in prefixes if prefix]
+        self.suffix_rules = [suffix for suffix in suffixes if suffix]
+        self.substring_rules = [substring for substring in substrings if substring]
+        regexes = [regex for regex in regexes if regex]
+        self.prefixes = PrefixTrie(self.prefix_rules)
+        self.suffixes = PrefixTrie(suffix[::-1] for suffix in self.suffix_rules)
+        self.substrings = SubstringMatcher(self.substring_rules)
+        self.regex = re.compile("|".join(f"(?:{regex})" for regex in regexes)) if regexes else None
+        self.rules_count = (len(self.exact) + len(self.prefix_rules) + len(self.suffix_rules)
+                            + len(self.substring_rules) + len(regexes))
+        self.checked = 0
+        self.ignored = 0
+
+    @classmethod
+    def from_rules(cls, rules, ignore_urls_with=IGNORE_URLS_WITH):
+        """
+        Build a filter from rule lines and the IGNORE_URLS_WITH setting.
+
+        :param rules: Iterable of rules using the syntax described in the class docstring.
+        :param ignore_urls_with: Substring or list of substrings of URLs to ignore.
+        """
+        exact, prefixes, suffixes, substrings, regexes = [], [], [], [], []
+        for rule in rules:
+            rule = rule.strip()
+            if not rule or rule.startswith('#'):
+                continue
+            if rule.startswith('re:'):
+                if rule[3:]:
+                    regexes.append(rule[3:])
+                else:
+                    logging.warning(f"Ignoring empty regular expression rule: {rule}")
+            elif not rule.strip('*'):
+                logging.warning(f"Ignoring rule without text, it would match every URL: {rule}")
+            elif len(rule) > 2 and rule.startswith('*') and rule.endswith('*'):
+                substrings.append(rule[1:-1])
+            elif rule.startswith('*'):
+                suffixes.append(rule[1:])
+            elif rule.endswith('*'):
+                prefixes.append(rule[:-1])
+            else:
+                exact.append(rule)
+
+        if isinstance(ignore_urls_with, str):
+            ignore_urls_with = [ignore_urls_with]
+        substrings.extend(substring for substring in ignore_urls_with if substring)
+
+        return cls(exact, prefixes, substrings, regexes, suffixes)
+
+    def is_ignored(self, url):
+        self.checked += 1
+        url = normalize_url(url)
+        ignored = (
+            url in self.exact
+            or self.prefixes.match(url)
+            or self.suffixes.match(url[::-1])
+            or self.substrings.search(url)
+            or (self.regex is not None and self.regex.search(url) is not None)
+        )
+        if ignored:
+            self.ignored += 1
+        return ignored
+
+    def page_rules(self):
+        """
+        Exact, prefix, suffix and substring rules in a JSON-friendly form, to filter
+        links inside a browser page. Regular expressions are left out because
+        the JavaScript and Python syntaxes differ; is_ignored still applies them.
+        """
+        return {"exact": sorted(self.exact), "prefixes": self.prefix_rules, "suffixes": self.suffix_rules,
+                "substrings": self.substring_rules}
+
+    def filter(self, urls):
+        """
+        Return the URLs that are not ignored, keeping their order.
+        """
+        return [url for url in urls if not self.is_ignored(url)]
+
+    def __len__(self):
+        return self.rules_count
+
+
+def load_url_filter(path='ignore_links.txt', ignore_urls_with=IGNORE_URLS_WITH):
+    """
+    Load the ignore rules file (if it exists) and compile it into a UrlFilter.
+    """
+    rules = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            rules = f.readlines()
+    url_filter = UrlFilter.from_rules(rules, ignore_urls_with)
+    logging.info(f"Loaded {len(url_filter)} URL ignore rules")
+    return url_filter